@@ -0,0 +1,137 @@
+"""
+Benchmark: latência de requests curtos enquanto uma listagem longa roda no server_db.
+
+Compara as chamadas ao banco fora do event loop (AsyncDB, padrão) com a execução
+direta no loop (--modo inline, o comportamento antigo):
+
+    python bench_db.py --rows 200000 --curtos 50
+    python bench_db.py --database-url postgresql+psycopg2://... --modo ambos
+
+Sem --database-url usa um SQLite temporário populado com --rows orçamentos.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+
+def _popular(rows: int):
+    from sqlalchemy import text
+    from db_backend import DB
+
+    with DB._engine.begin() as c:
+        existentes = c.execute(text("select count(*) from orcamentos")).scalar() or 0
+        if existentes >= rows:
+            return existentes
+        base = datetime(2024, 1, 1)
+        lote = []
+        for i in range(existentes, rows):
+            dt = base + timedelta(minutes=i)
+            doc = f"{i % 5000:014d}"
+            lote.append({
+                "id": f"OR-IM{i + 1}{dt:%d%m%Y}", "dh": dt.strftime("%d/%m/%Y %H:%M:%S"), "ts": DB._ts_param(dt),
+                "cnpj": doc, "dig": doc, "vend": f"Vendedor {i % 7}", "cli": f"Cliente {i % 5000}",
+            })
+            if len(lote) >= 5000:
+                c.execute(text("insert into orcamentos (id_orcamento, data_hora, data_hora_ts, cnpj_cpf, cnpj_digits, vendedor, cliente_valor) "
+                               "values (:id, :dh, :ts, :cnpj, :dig, :vend, :cli)"), lote)
+                lote = []
+        if lote:
+            c.execute(text("insert into orcamentos (id_orcamento, data_hora, data_hora_ts, cnpj_cpf, cnpj_digits, vendedor, cliente_valor) "
+                           "values (:id, :dh, :ts, :cnpj, :dig, :vend, :cli)"), lote)
+    return rows
+
+
+INTERVALO = 0.02  # s entre requests curtos
+
+
+def _pct(vals, p):
+    vals = sorted(vals)
+    return vals[min(len(vals) - 1, int(round(p / 100.0 * (len(vals) - 1))))]
+
+
+async def _rodada(app, curtos: int, longos: int) -> dict:
+    import httpx
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as client:
+        await client.get("/api/proximo-id", params={"tipo_servico": "Impressão"})  # aquece conexões
+
+        async def longo():
+            t = time.perf_counter()
+            r = await client.get("/api/orcamentos")
+            r.raise_for_status()
+            return time.perf_counter() - t
+
+        async def curto(previsto: float):
+            r = await client.get("/api/proximo-id", params={"tipo_servico": "Impressão"})
+            r.raise_for_status()
+            # mede a partir do horário agendado: se o loop estava travado, o atraso conta
+            return time.perf_counter() - previsto
+
+        async def rajada(tarefas):
+            # um request curto a cada INTERVALO enquanto a listagem longa roda (mínimo 'curtos')
+            out = []
+            previsto = time.perf_counter()
+            while len(out) < curtos or not all(t.done() for t in tarefas):
+                previsto += INTERVALO
+                await asyncio.sleep(max(0.0, previsto - time.perf_counter()))
+                out.append(await curto(previsto))
+            return out
+
+        inicio = time.perf_counter()
+        tarefas_longas = [asyncio.create_task(longo()) for _ in range(longos)]
+        lat = await rajada(tarefas_longas)
+        dur_longos = await asyncio.gather(*tarefas_longas)
+        total = time.perf_counter() - inicio
+    return {
+        "curto_p50_ms": statistics.median(lat) * 1000,
+        "curto_p95_ms": _pct(lat, 95) * 1000,
+        "curto_max_ms": max(lat) * 1000,
+        "curto_n": len(lat),
+        "longo_s": max(dur_longos) if dur_longos else 0.0,
+        "total_s": total,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Latência do server_db sob uma listagem longa")
+    ap.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    ap.add_argument("--rows", type=int, default=100000, help="orçamentos no SQLite temporário")
+    ap.add_argument("--curtos", type=int, default=30, help="mínimo de requests curtos (/api/proximo-id)")
+    ap.add_argument("--longos", type=int, default=1, help="listagens completas simultâneas")
+    ap.add_argument("--modo", choices=["thread", "inline", "ambos"], default="ambos")
+    args = ap.parse_args()
+
+    if not args.database_url:
+        caminho = os.path.join(tempfile.gettempdir(), f"bench_orcamentos_{args.rows}.db")
+        args.database_url = f"sqlite:///{caminho}"
+    os.environ["DATABASE_URL"] = args.database_url
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    import server_db
+    from db_backend import ADB
+
+    print(f"Banco: {args.database_url}")
+    print(f"Linhas: {_popular(args.rows)}")
+
+    rodar_original = ADB.run
+
+    async def inline(fn, *a, **kw):
+        return fn(*a, **kw)  # comportamento antigo: bloqueia o event loop
+
+    modos = ["thread", "inline"] if args.modo == "ambos" else [args.modo]
+    print(f"{'modo':8} {'curtos':>7} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9} {'lista s':>8} {'total s':>8}")
+    for modo in modos:
+        ADB.run = rodar_original if modo == "thread" else inline
+        r = asyncio.run(_rodada(server_db.app, args.curtos, args.longos))
+        print(f"{modo:8} {r['curto_n']:7d} {r['curto_p50_ms']:9.1f} {r['curto_p95_ms']:9.1f} {r['curto_max_ms']:9.1f} {r['longo_s']:8.2f} {r['total_s']:8.2f}")
+    ADB.run = rodar_original
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,50 @@
+import asyncio
+import base64
+import functools
+import json
 import os
 import re
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 try:
-    from sqlalchemy import create_engine, text
+    from sqlalchemy import bindparam, create_engine, event, text
     _SA_OK = True
 except Exception:
     _SA_OK = False
 
 
+# Pool de conexões (Postgres e SQLite em arquivo)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # s; evita conexões derrubadas pelo servidor/proxy
+# SQLite: vários clientes gravando ao mesmo tempo
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_WAL = os.getenv("SQLITE_WAL", "1") == "1"
+# Respostas guardadas por Idempotency-Key (reenvios da outbox do cliente)
+IDEMPOTENCIA_DIAS = float(os.getenv("IDEMPOTENCIA_DIAS", "7"))
+
+
+_TS_FORMATS = ("%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M", "%d/%m/%Y", "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d")
+
+
+def _parse_ts(s) -> datetime | None:
+    """Converte o texto de data/hora gravado (DD/MM/YYYY [HH:MM:SS] ou ISO) em datetime."""
+    if isinstance(s, datetime):
+        return s
+    txt = str(s or "").strip()
+    if not txt:
+        return None
+    for fmt in _TS_FORMATS:
+        try:
+            return datetime.strptime(txt, fmt)
+        except ValueError:
+            continue
+    return None
+
+
 def _snake(s: str) -> str:
     s = s.strip().lower()
     s = s.replace("ã", "a").replace("õ", "o").replace("ç", "c").replace("é", "e").replace("ê", "e").replace("á", "a").replace("í", "i").replace("ú", "u").replace("ó", "o")
@@ -25,11 +61,68 @@ class DB:
             return False
         try:
             if cls._engine is None:
-                cls._engine = create_engine(url, pool_pre_ping=True, future=True)
+                cls._engine = cls._create_engine(url)
             return True
         except Exception:
             return False
 
+    @classmethod
+    def _create_engine(cls, url: str):
+        sqlite = url.startswith("sqlite")
+        memoria = sqlite and (":memory:" in url or url.rstrip("/") in ("sqlite:", "sqlite:/"))
+        kw = {"pool_pre_ping": True, "future": True}
+        if not memoria:
+            kw.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW,
+                      pool_timeout=DB_POOL_TIMEOUT, pool_recycle=DB_POOL_RECYCLE)
+        if sqlite:
+            # as threads do AsyncDB compartilham o pool; o busy_timeout fica no PRAGMA abaixo
+            kw["connect_args"] = {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000.0}
+        engine = create_engine(url, **kw)
+        if sqlite:
+            event.listen(engine, "connect", cls._sqlite_pragmas)
+        return engine
+
+    @staticmethod
+    def _sqlite_pragmas(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        try:
+            if SQLITE_WAL:
+                # WAL: leitores não bloqueiam o escritor; NORMAL é seguro com WAL e bem mais rápido
+                cur.execute("PRAGMA journal_mode=WAL")
+                cur.execute("PRAGMA synchronous=NORMAL")
+            cur.execute(f"PRAGMA busy_timeout={int(SQLITE_BUSY_TIMEOUT_MS)}")
+            if SQLITE_MMAP_SIZE > 0:
+                cur.execute(f"PRAGMA mmap_size={int(SQLITE_MMAP_SIZE)}")
+        finally:
+            cur.close()
+
+    @classmethod
+    def pool_status(cls) -> dict:
+        """Métricas do pool de conexões (para /api/info)."""
+        if cls._engine is None:
+            return {"ready": False}
+        pool = cls._engine.pool
+        out = {"ready": True, "dialect": cls._engine.dialect.name, "class": type(pool).__name__}
+        for nome in ("size", "checkedin", "checkedout", "overflow"):
+            fn = getattr(pool, nome, None)
+            if callable(fn):
+                try:
+                    out[nome] = fn()
+                except Exception:
+                    pass
+        out["max_overflow"] = getattr(pool, "_max_overflow", None)
+        out["timeout"] = getattr(pool, "_timeout", None)
+        out["recycle"] = getattr(pool, "_recycle", None)
+        if cls._engine.dialect.name == "sqlite":
+            try:
+                with cls._engine.connect() as c:
+                    out["journal_mode"] = c.exec_driver_sql("PRAGMA journal_mode").scalar()
+                    out["busy_timeout"] = c.exec_driver_sql("PRAGMA busy_timeout").scalar()
+                    out["mmap_size"] = c.exec_driver_sql("PRAGMA mmap_size").scalar()
+            except Exception:
+                pass
+        return out
+
     @classmethod
     def init_schema(cls):
         """Cria as tabelas se não existirem."""
@@ -50,9 +143,15 @@ class DB:
             metros text,
             preco_por_metro text,
             forma_pagamento text,
-            valor_total text
+            valor_total text,
+            data_hora_ts timestamp,
+            cnpj_digits text
         );
-        create index if not exists idx_orc_cnpj on orcamentos((regexp_replace(cnpj_cpf,'\D','','g')));
+        alter table orcamentos add column if not exists data_hora_ts timestamp;
+        alter table orcamentos add column if not exists cnpj_digits text;
+        drop index if exists idx_orc_cnpj;
+        create index if not exists idx_orc_digits on orcamentos(cnpj_digits);
+        create index if not exists idx_orc_ts on orcamentos(data_hora_ts);
         
         create table if not exists cadastros (
             cnpj_cpf text primary key,
@@ -82,9 +181,15 @@ class DB:
             telefone2 text,
             vendedor text,
             criado_em text,
-            atualizado_em text
+            atualizado_em text,
+            atualizado_ts timestamp,
+            cnpj_digits text
         );
-        create index if not exists idx_cad_cnpj on cadastros((regexp_replace(cnpj_cpf,'\D','','g')));
+        alter table cadastros add column if not exists atualizado_ts timestamp;
+        alter table cadastros add column if not exists cnpj_digits text;
+        drop index if exists idx_cad_cnpj;
+        create index if not exists idx_cad_digits on cadastros(cnpj_digits);
+        create index if not exists idx_cad_ts on cadastros(atualizado_ts);
 
         create table if not exists pedidos (
             id text primary key,
@@ -105,12 +210,37 @@ class DB:
             pct_comissao_vendedor text,
             valor_comissao_vendedor text,
             pct_comissao_adm text,
-            valor_comissao_adm text
+            valor_comissao_adm text,
+            data_hora_criacao_ts timestamp,
+            cnpj_digits text
+        );
+        alter table pedidos add column if not exists data_hora_criacao_ts timestamp;
+        alter table pedidos add column if not exists cnpj_digits text;
+        drop index if exists idx_ped_cnpj;
+        create index if not exists idx_ped_digits on pedidos(cnpj_digits);
+        create index if not exists idx_ped_ts on pedidos(data_hora_criacao_ts);
+
+        create table if not exists orcamento_seq (
+            sigla text primary key,
+            seq int not null default 0
+        );
+
+        create table if not exists tabela_versao (
+            tabela text primary key,
+            versao bigint not null default 0
+        );
+
+        create table if not exists idempotencia (
+            chave text primary key,
+            resposta text not null,
+            criado double precision not null
         );
-        create index if not exists idx_ped_cnpj on pedidos((regexp_replace(cnpj_cpf,'\D','','g')));
         """
         with cls._engine.begin() as c:
             c.execute(text(ddl))
+        cls._seed_orcamento_seq()
+        cls._backfill_timestamps()
+        cls._backfill_cnpj_digits()
         # Views tipadas para Power Query
         try:
             with cls._engine.begin() as c:
@@ -171,7 +301,9 @@ class DB:
                 metros text,
                 preco_por_metro text,
                 forma_pagamento text,
-                valor_total text
+                valor_total text,
+                data_hora_ts timestamp,
+                cnpj_digits text
             );
             """,
             """
@@ -203,7 +335,9 @@ class DB:
                 telefone2 text,
                 vendedor text,
                 criado_em text,
-                atualizado_em text
+                atualizado_em text,
+                atualizado_ts timestamp,
+                cnpj_digits text
             );
             """,
             """
@@ -226,28 +360,69 @@ class DB:
                 pct_comissao_vendedor text,
                 valor_comissao_vendedor text,
                 pct_comissao_adm text,
-                valor_comissao_adm text
+                valor_comissao_adm text,
+                data_hora_criacao_ts timestamp,
+                cnpj_digits text
+            );
+            """,
+            """
+            create table if not exists orcamento_seq (
+                sigla text primary key,
+                seq int not null default 0
+            );
+            """,
+            """
+            create table if not exists tabela_versao (
+                tabela text primary key,
+                versao bigint not null default 0
+            );
+            """,
+            """
+            create table if not exists idempotencia (
+                chave text primary key,
+                resposta text not null,
+                criado double precision not null
             );
             """,
         ]
-        if is_sqlite:
-            stmts += [
-                "create index if not exists idx_orc_cnpj on orcamentos(replace(replace(replace(cnpj_cpf,'/',''),'.',''),'-',''));",
-                "create index if not exists idx_cad_cnpj on cadastros(replace(replace(replace(cnpj_cpf,'/',''),'.',''),'-',''));",
-                "create index if not exists idx_ped_cnpj on pedidos(replace(replace(replace(cnpj_cpf,'/',''),'.',''),'-',''));",
-            ]
-        else:
-            stmts += [
-                "create index if not exists idx_orc_cnpj on orcamentos((regexp_replace(cnpj_cpf,'\\D','','g')));",
-                "create index if not exists idx_cad_cnpj on cadastros((regexp_replace(cnpj_cpf,'\\D','','g')));",
-                "create index if not exists idx_ped_cnpj on pedidos((regexp_replace(cnpj_cpf,'\\D','','g')));",
-            ]
+        # Bancos criados antes das colunas derivadas (data tipada e dígitos do documento)
+        add_col = "alter table {} add column {} {}" if is_sqlite else "alter table {} add column if not exists {} {}"
+        stmts += [
+            add_col.format("orcamentos", "data_hora_ts", "timestamp"),
+            add_col.format("cadastros", "atualizado_ts", "timestamp"),
+            add_col.format("pedidos", "data_hora_criacao_ts", "timestamp"),
+            add_col.format("orcamentos", "cnpj_digits", "text"),
+            add_col.format("cadastros", "cnpj_digits", "text"),
+            add_col.format("pedidos", "cnpj_digits", "text"),
+            "create index if not exists idx_orc_ts on orcamentos(data_hora_ts);",
+            "create index if not exists idx_cad_ts on cadastros(atualizado_ts);",
+            "create index if not exists idx_ped_ts on pedidos(data_hora_criacao_ts);",
+            # Índices de expressão antigos deram lugar à coluna cnpj_digits
+            "drop index if exists idx_orc_cnpj;",
+            "drop index if exists idx_cad_cnpj;",
+            "drop index if exists idx_ped_cnpj;",
+            "create index if not exists idx_orc_digits on orcamentos(cnpj_digits);",
+            "create index if not exists idx_cad_digits on cadastros(cnpj_digits);",
+            "create index if not exists idx_ped_digits on pedidos(cnpj_digits);",
+        ]
         with cls._engine.begin() as conn:
             for sql in stmts:
                 try:
                     conn.execute(text(sql))
                 except Exception:
                     pass
+        try:
+            cls._seed_orcamento_seq()
+        except Exception:
+            pass
+        try:
+            cls._backfill_timestamps()
+        except Exception:
+            pass
+        try:
+            cls._backfill_cnpj_digits()
+        except Exception:
+            pass
 
     # Mapeamentos Excel -> DB
     ORC_MAP = {
@@ -334,18 +509,319 @@ class DB:
             out[v] = d.get(k)
         return out
 
+    # Colunas internas (derivadas) que não voltam para o app
+    INTERNAL_COLS = {"data_hora_ts", "atualizado_ts", "data_hora_criacao_ts", "cnpj_digits"}
+
     @classmethod
     def _row_to_excel_orc(cls, row: dict) -> dict:
-        return {cls.REV_ORC.get(k, k): v for k, v in row.items()}
+        return {cls.REV_ORC.get(k, k): v for k, v in row.items() if k not in cls.INTERNAL_COLS}
+
+    @classmethod
+    def _row_to_excel_cad(cls, row: dict) -> dict:
+        out = {label: row.get(col) for label, col in cls.CAD_MAP.items()}
+        out["CNPJ/CPF"] = row.get("cnpj_cpf")
+        return out
+
+    @classmethod
+    def _row_to_excel_ped(cls, row: dict) -> dict:
+        return {label: row.get(col) for label, col in cls.PED_MAP.items()}
+
+    @classmethod
+    def _ts_param(cls, dt: datetime | None):
+        """Valor de bind para colunas timestamp (SQLite guarda texto ISO, que ordena corretamente)."""
+        if dt is None:
+            return None
+        if cls._engine.dialect.name == "sqlite":
+            return dt.strftime("%Y-%m-%d %H:%M:%S")
+        return dt
+
+    @classmethod
+    def _add_date_filter(cls, where: list, params: dict, col: str, start: str | None, end: str | None):
+        """Filtro de período (DD/MM/YYYY, fim inclusivo) aplicado na coluna timestamp indexada."""
+        if start:
+            where.append(f"{col} >= :dstart")
+            params["dstart"] = cls._ts_param(datetime.strptime(start, "%d/%m/%Y"))
+        if end:
+            where.append(f"{col} < :dend")
+            params["dend"] = cls._ts_param(datetime.strptime(end, "%d/%m/%Y") + timedelta(days=1))
+
+    # (tabela, chave, coluna timestamp, colunas texto de origem em ordem de preferência)
+    _TS_SOURCES = (
+        ("orcamentos", "id_orcamento", "data_hora_ts", ("data_hora",)),
+        ("cadastros", "cnpj_cpf", "atualizado_ts", ("atualizado_em", "criado_em")),
+        ("pedidos", "id", "data_hora_criacao_ts", ("data_hora_criacao",)),
+    )
+
+    @classmethod
+    def _backfill_timestamps(cls, batch_size: int = 1000):
+        """Preenche as colunas timestamp de linhas antigas a partir do texto DD/MM/YYYY."""
+        for table, key, ts_col, src_cols in cls._TS_SOURCES:
+            cond = " or ".join(f"coalesce({c},'') <> ''" for c in src_cols)
+            sql = f"select {key}, {', '.join(src_cols)} from {table} where {ts_col} is null and ({cond})"
+            with cls._engine.connect() as c:
+                pend = c.execute(text(sql)).fetchall()
+            updates = []
+            for r in pend:
+                ts = next((t for t in (_parse_ts(v) for v in r[1:]) if t), None)
+                if ts is not None:
+                    updates.append({"k": r[0], "ts": cls._ts_param(ts)})
+            upd = text(f"update {table} set {ts_col} = :ts where {key} = :k")
+            for i in range(0, len(updates), batch_size):
+                with cls._engine.begin() as c:
+                    c.execute(upd, updates[i:i + batch_size])
+
+    @classmethod
+    def _backfill_cnpj_digits(cls, batch_size: int = 1000):
+        """Preenche/corrige cnpj_digits com a mesma normalização das gravações (só os dígitos, via regex)."""
+        for table, key, _, _ in cls._TS_SOURCES:
+            with cls._engine.connect() as c:
+                linhas = c.execute(text(f"select {key}, cnpj_cpf, cnpj_digits from {table} where cnpj_cpf is not null")).fetchall()
+            # também corrige valores gravados pelo backfill antigo, que só removia '/', '.', '-' e espaço
+            updates = [
+                {"k": k, "d": d}
+                for k, doc, atual in linhas
+                for d in (re.sub(r"\D", "", str(doc)),)
+                if d != atual
+            ]
+            upd = text(f"update {table} set cnpj_digits = :d where {key} = :k")
+            for i in range(0, len(updates), batch_size):
+                with cls._engine.begin() as c:
+                    c.execute(upd, updates[i:i + batch_size])
+
+    # ============ LISTAGENS (filtros / paginação) ============
+    # tabela -> (coluna timestamp, chave primária): ordenação "mais recentes primeiro" e cursor
+    _LIST_KEYS = {
+        "orcamentos": ("data_hora_ts", "id_orcamento"),
+        "cadastros": ("atualizado_ts", "cnpj_cpf"),
+        "pedidos": ("data_hora_criacao_ts", "id"),
+    }
+    _ROW_MAPPERS = {
+        "orcamentos": "_row_to_excel_orc",
+        "cadastros": "_row_to_excel_cad",
+        "pedidos": "_row_to_excel_ped",
+    }
+
+    @classmethod
+    def _list_keys(cls, table: str) -> tuple[str, str]:
+        if table not in cls._LIST_KEYS:
+            raise ValueError(f"tabela desconhecida: {table}")
+        return cls._LIST_KEYS[table]
+
+    @classmethod
+    def _list_filters(cls, ts_col: str, vendedor: str | None, cnpj_digits: str | None, start: str | None, end: str | None) -> tuple[list, dict]:
+        where, params = [], {}
+        if vendedor:
+            if cls._engine.dialect.name == "sqlite":
+                where.append("lower(coalesce(vendedor,'')) like :vend")
+                params["vend"] = f"%{(vendedor or '').lower()}%"
+            else:
+                where.append("coalesce(vendedor,'') ilike :vend")
+                params["vend"] = f"%{vendedor}%"
+        if cnpj_digits:
+            where.append("cnpj_digits = :digits")
+            params["digits"] = re.sub(r"\D","", cnpj_digits)
+        cls._add_date_filter(where, params, ts_col, start, end)
+        return where, params
+
+    @staticmethod
+    def _encode_cursor(ts, key) -> str:
+        if isinstance(ts, datetime):
+            ts = ts.strftime("%Y-%m-%d %H:%M:%S")
+        raw = json.dumps([ts, key]).encode("utf-8")
+        return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+    @classmethod
+    def _add_keyset(cls, where: list, params: dict, ts_col: str, key_col: str, cursor: str):
+        """Continua a listagem depois da última linha entregue (ordem: ts desc nulls last, chave desc)."""
+        try:
+            raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            ts_txt, key = json.loads(raw.decode("utf-8"))
+        except Exception:
+            raise ValueError("cursor inválido")
+        params["ckey"] = key
+        if ts_txt is None:
+            where.append(f"({ts_col} is null and {key_col} < :ckey)")
+            return
+        ts = _parse_ts(ts_txt)
+        if ts is None:
+            raise ValueError("cursor inválido")
+        params["cts"] = cls._ts_param(ts)
+        where.append(f"({ts_col} < :cts or ({ts_col} = :cts and {key_col} < :ckey) or {ts_col} is null)")
+
+    @classmethod
+    def _list_sql(cls, table: str, start: str | None = None, end: str | None = None, vendedor: str | None = None, cnpj_digits: str | None = None, limit: int | None = None, offset: int | None = None, cursor: str | None = None) -> tuple[str, dict]:
+        """SELECT filtrado e ordenado pelo índice de data (mais recentes primeiro)."""
+        ts_col, key_col = cls._list_keys(table)
+        where, params = cls._list_filters(ts_col, vendedor, cnpj_digits, start, end)
+        if cursor:
+            cls._add_keyset(where, params, ts_col, key_col, cursor)
+        sql = f"select * from {table}"
+        if where:
+            sql += " where " + " and ".join(where)
+        sql += f" order by {ts_col} desc nulls last, {key_col} desc"
+        if limit is not None:
+            sql += " limit :limit"
+            params["limit"] = int(limit)
+        elif offset and cls._engine.dialect.name == "sqlite":
+            sql += " limit -1"
+        if offset:
+            sql += " offset :offset"
+            params["offset"] = int(offset)
+        return sql, params
+
+    @classmethod
+    def _select_list(cls, table: str, start: str | None = None, end: str | None = None, vendedor: str | None = None, cnpj_digits: str | None = None, limit: int | None = None, offset: int | None = None, cursor: str | None = None) -> list[dict]:
+        """Linhas cruas (colunas do banco) já filtradas e ordenadas pelo índice de data."""
+        sql, params = cls._list_sql(table, start, end, vendedor, cnpj_digits, limit=limit, offset=offset, cursor=cursor)
+        with cls._engine.connect() as c:
+            return [dict(m) for m in c.execute(text(sql), params).mappings().all()]
+
+    @classmethod
+    def iter_rows(cls, table: str, batch_size: int = 1000, start: str | None = None, end: str | None = None, vendedor: str | None = None, cnpj_digits: str | None = None):
+        """Gera as linhas (labels do app) em lotes, via cursor do lado do servidor, sem carregar a tabela."""
+        sql, params = cls._list_sql(table, start, end, vendedor, cnpj_digits)
+        mapper = getattr(cls, cls._ROW_MAPPERS[table])
+        with cls._engine.connect() as c:
+            res = c.execution_options(stream_results=True, yield_per=batch_size).execute(text(sql), params)
+            for part in res.mappings().partitions(batch_size):
+                for m in part:
+                    yield mapper(dict(m))
+
+    # Tamanho máximo de página aceito em ?limit= nas listagens das APIs
+    MAX_PAGE_SIZE = int(os.getenv("API_MAX_PAGE_SIZE", "1000"))
+
+    @classmethod
+    def page_size(cls, limit) -> int:
+        """?limit= da requisição limitado a 1..MAX_PAGE_SIZE (sem limit: MAX_PAGE_SIZE)."""
+        return max(1, min(int(limit or cls.MAX_PAGE_SIZE), cls.MAX_PAGE_SIZE))
+
+    @classmethod
+    def list_page(cls, table: str, limit: int, cursor: str | None = None, offset: int | None = None, **filtros) -> dict:
+        """Uma página da listagem: {"rows": [...], "next_cursor": str | None}."""
+        ts_col, key_col = cls._list_keys(table)
+        raw = cls._select_list(table, limit=limit + 1, offset=offset, cursor=cursor, **filtros)
+        next_cursor = None
+        if len(raw) > limit:
+            raw = raw[:limit]
+            next_cursor = cls._encode_cursor(raw[-1].get(ts_col), raw[-1].get(key_col))
+        mapper = getattr(cls, cls._ROW_MAPPERS[table])
+        return {"rows": [mapper(r) for r in raw], "next_cursor": next_cursor}
+
+    @classmethod
+    def count_rows(cls, table: str, start: str | None = None, end: str | None = None, vendedor: str | None = None, cnpj_digits: str | None = None) -> int:
+        ts_col, _ = cls._list_keys(table)
+        where, params = cls._list_filters(ts_col, vendedor, cnpj_digits, start, end)
+        sql = f"select count(*) from {table}"
+        if where:
+            sql += " where " + " and ".join(where)
+        with cls._engine.connect() as c:
+            return int(c.execute(text(sql), params).scalar() or 0)
+
+    @classmethod
+    def table_version(cls, table: str) -> str:
+        """Marca de alteração da tabela para caches: contador de gravações (tabela_versao), sem varrer a tabela."""
+        cls._list_keys(table)
+        with cls._engine.connect() as c:
+            versao = c.execute(text("select versao from tabela_versao where tabela = :t"), {"t": table}).scalar()
+        return str(versao or 0)
+
+    @classmethod
+    def _marcar_alteracao(cls, conn, table: str):
+        """Incrementa a versão da tabela na mesma transação da gravação."""
+        conn.execute(
+            text("insert into tabela_versao (tabela, versao) values (:t, 1) "
+                 "on conflict (tabela) do update set versao = tabela_versao.versao + 1"),
+            {"t": table},
+        )
 
     # ============ ORÇAMENTOS ============
     @classmethod
     def salvar_orcamento(cls, dados: dict):
+        payload = cls._payload_orc(dados)
+        with cls._engine.begin() as c:
+            c.execute(cls._upsert_sql("orcamentos", payload), payload)
+            cls._apos_gravar(c, "orcamentos", [payload])
+
+    @classmethod
+    def _payload_orc(cls, dados: dict) -> dict:
         payload = cls._map_payload(dados, cls.ORC_MAP)
-        cols = ",".join(payload.keys())
-        params = ",".join(f":{k}" for k in payload.keys())
+        payload["data_hora_ts"] = cls._ts_param(_parse_ts(payload.get("data_hora")))
+        payload["cnpj_digits"] = re.sub(r"\D", "", str(payload.get("cnpj_cpf") or ""))
+        return payload
+
+    # Contador por sigla (IM/DG): evita contar a tabela inteira a cada novo ID
+    SIGLAS_ORC = ("IM", "DG")
+
+    _RE_ID_ORC = re.compile(r"^OR-([A-Z]{2})(\d+)(\d{8})$")
+
+    @classmethod
+    def _seq_do_id(cls, id_orc) -> tuple[str, int] | None:
+        """(sigla, sequencial) de um ID no formato OR-{sigla}{seq}{ddmmyyyy}."""
+        m = cls._RE_ID_ORC.match(str(id_orc or "").strip())
+        return (m.group(1), int(m.group(2))) if m else None
+
+    @classmethod
+    def _avancar_orcamento_seq(cls, conn, ids=(), minimos: dict | None = None):
+        """Leva o contador de cada sigla a pelo menos o maior sequencial visto (nunca recua)."""
+        alvo = dict(minimos or {})
+        for id_orc in ids:
+            sq = cls._seq_do_id(id_orc)
+            if sq and sq[1] > alvo.get(sq[0], 0):
+                alvo[sq[0]] = sq[1]
+        if not alvo:
+            return
+        maior = "max" if cls._engine.dialect.name == "sqlite" else "greatest"
+        sql = text(
+            "insert into orcamento_seq (sigla, seq) values (:s, :n) "
+            f"on conflict (sigla) do update set seq = {maior}(orcamento_seq.seq, excluded.seq)"
+        )
+        conn.execute(sql, [{"s": sg, "n": n} for sg, n in sorted(alvo.items())])
+
+    @classmethod
+    def _seed_orcamento_seq(cls, conn=None, sigla: str | None = None):
+        """Reconcilia o contador com os IDs já gravados: max(total de IDs da sigla, maior sequencial)."""
+        siglas = [sigla] if sigla else list(cls.SIGLAS_ORC)
+
+        def _reconciliar(c):
+            minimos = {}
+            for sg in siglas:
+                p = f"OR-{sg}%"
+                total = c.execute(text("select count(*) from orcamentos where id_orcamento like :p"), {"p": p}).scalar() or 0
+                maior = 0
+                for (id_orc,) in c.execute(text("select id_orcamento from orcamentos where id_orcamento like :p"), {"p": p}):
+                    sq = cls._seq_do_id(id_orc)
+                    if sq and sq[0] == sg and sq[1] > maior:
+                        maior = sq[1]
+                minimos[sg] = max(int(total), maior)
+            cls._avancar_orcamento_seq(c, minimos=minimos)
+
+        if conn is not None:
+            _reconciliar(conn)
+            return
         with cls._engine.begin() as c:
-            c.execute(text(f"insert into orcamentos ({cols}) values ({params}) on conflict (id_orcamento) do update set data_hora=excluded.data_hora"), payload)
+            _reconciliar(c)
+
+    @classmethod
+    def next_orcamento_seq(cls, sigla: str) -> int:
+        """Reserva o próximo sequencial da sigla de forma atômica (uma linha bloqueada por transação)."""
+        with cls._engine.begin() as c:
+            upd = text("update orcamento_seq set seq = seq + 1 where sigla = :s")
+            if c.execute(upd, {"s": sigla}).rowcount == 0:
+                cls._seed_orcamento_seq(c, sigla)
+                c.execute(upd, {"s": sigla})
+            row = c.execute(text("select seq from orcamento_seq where sigla = :s"), {"s": sigla}).first()
+            return int(row[0])
+
+    @classmethod
+    def peek_orcamento_seq(cls, sigla: str) -> int:
+        """Próximo sequencial da sigla sem reservá-lo (prévia exibida no formulário)."""
+        with cls._engine.connect() as c:
+            row = c.execute(text("select seq from orcamento_seq where sigla = :s"), {"s": sigla}).first()
+        if row is None:
+            cls._seed_orcamento_seq(sigla=sigla)
+            with cls._engine.connect() as c:
+                row = c.execute(text("select seq from orcamento_seq where sigla = :s"), {"s": sigla}).first()
+        return int(row[0] if row else 0) + 1
 
     @classmethod
     def get_orcamento_by_id(cls, id_orc: str):
@@ -361,71 +837,38 @@ class DB:
             params["id_orc"] = id_orc
         if doc_formatado:
             digits = re.sub(r"\D", "", doc_formatado or "")
-            where.append("regexp_replace(cnpj_cpf,'\\D','','g') = :digits")
+            where.append("cnpj_digits = :digits")
             params["digits"] = digits
         sql = "select * from orcamentos"
         if where:
             sql += " where " + " and ".join(where)
-        sql += " order by data_hora desc"
+        sql += " order by data_hora_ts desc nulls last, id_orcamento desc"
         with cls._engine.connect() as c:
             res = c.execute(text(sql), params).mappings().all()
             return [cls._row_to_excel_orc(dict(r)) for r in res]
 
     @classmethod
-    def list_orcamentos_excel(cls, start: str | None = None, end: str | None = None, vendedor: str | None = None, cnpj_digits: str | None = None) -> list[dict]:
-        where = []
-        params = {}
-        is_sqlite = cls._engine.dialect.name == "sqlite"
-        if vendedor:
-            if is_sqlite:
-                where.append("lower(coalesce(vendedor,'')) like :vend")
-                params["vend"] = f"%{(vendedor or '').lower()}%"
-            else:
-                where.append("coalesce(vendedor,'') ilike :vend")
-                params["vend"] = f"%{vendedor}%"
-        if cnpj_digits:
-            if is_sqlite:
-                where.append("replace(replace(replace(cnpj_cpf,'/',''),'.',''),'-','') = :digits")
-            else:
-                where.append("regexp_replace(cnpj_cpf,'\\D','','g') = :digits")
-            params["digits"] = re.sub(r"\D","", cnpj_digits)
-        sql = "select * from orcamentos"
-        if where:
-            sql += " where " + " and ".join(where)
-        sql += " order by data_hora desc"
-        with cls._engine.connect() as c:
-            res = c.execute(text(sql), params).mappings().all()
-            rows = [cls._row_to_excel_orc(dict(r)) for r in res]
-        # Filtro de data (formato DD/MM/YYYY) feito em Python para compatibilidade
-        if start or end:
-            dstart = datetime.strptime(start, "%d/%m/%Y") if start else None
-            dend = datetime.strptime(end, "%d/%m/%Y") if end else None
-            def parse_dt(s: str):
-                try:
-                    return datetime.strptime((s or "").split()[0], "%d/%m/%Y")
-                except Exception:
-                    return None
-            def ok(r):
-                ts = parse_dt(r.get("Data/Hora"))
-                if ts is None:
-                    return False if (dstart or dend) else True
-                if dstart and ts < dstart: return False
-                if dend and ts >= (dend + timedelta(days=1)): return False
-                return True
-            rows = [r for r in rows if ok(r)]
-        return rows
+    def list_orcamentos_excel(cls, start: str | None = None, end: str | None = None, vendedor: str | None = None, cnpj_digits: str | None = None, limit: int | None = None, offset: int | None = None) -> list[dict]:
+        rows = cls._select_list("orcamentos", start, end, vendedor, cnpj_digits, limit=limit, offset=offset)
+        return [cls._row_to_excel_orc(r) for r in rows]
 
     # ============ CADASTROS ============
     @classmethod
     def salvar_cadastro(cls, dados: dict):
+        payload = cls._payload_cad(dados)
+        with cls._engine.begin() as c:
+            c.execute(cls._upsert_sql("cadastros", payload), payload)
+            cls._apos_gravar(c, "cadastros", [payload])
+
+    @classmethod
+    def _payload_cad(cls, dados: dict) -> dict:
         payload = cls._map_payload(dados, cls.CAD_MAP)
         payload["cnpj_cpf"] = re.sub(r"\D", "", payload.get("cnpj_cpf") or "")
+        payload["cnpj_digits"] = payload["cnpj_cpf"]
         payload.setdefault("criado_em", datetime.now().strftime("%d/%m/%Y %H:%M:%S"))
         payload["atualizado_em"] = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
-        cols = ",".join(payload.keys())
-        params = ",".join(f":{k}" for k in payload.keys())
-        with cls._engine.begin() as c:
-            c.execute(text(f"insert into cadastros ({cols}) values ({params}) on conflict (cnpj_cpf) do update set documento=excluded.documento, razao_social_nome=excluded.razao_social_nome, nome_fantasia=excluded.nome_fantasia, contato=excluded.contato, email_cnpj=excluded.email_cnpj, email_manual=excluded.email_manual, cep=excluded.cep, endereco=excluded.endereco, numero=excluded.numero, complemento=excluded.complemento, bairro=excluded.bairro, municipio=excluded.municipio, uf=excluded.uf, entrega_cep=excluded.entrega_cep, entrega_endereco=excluded.entrega_endereco, entrega_numero=excluded.entrega_numero, entrega_complemento=excluded.entrega_complemento, entrega_bairro=excluded.entrega_bairro, entrega_municipio=excluded.entrega_municipio, entrega_uf=excluded.entrega_uf, desconto_duracao=excluded.desconto_duracao, desconto_unidade=excluded.desconto_unidade, telefone1=excluded.telefone1, telefone2=excluded.telefone2, vendedor=excluded.vendedor, atualizado_em=excluded.atualizado_em"), payload)
+        payload["atualizado_ts"] = cls._ts_param(_parse_ts(payload["atualizado_em"]))
+        return payload
 
     @classmethod
     def atualizar_cadastro(cls, doc_formatado: str, dados: dict) -> bool:
@@ -435,83 +878,49 @@ class DB:
     @classmethod
     def buscar_cadastro_por_documento(cls, tipo: str, valor_digitado: str):
         digits = re.sub(r"\D", "", valor_digitado or "")
-        is_sqlite = cls._engine.dialect.name == "sqlite"
         with cls._engine.connect() as c:
-            if is_sqlite:
-                sql = "select * from cadastros where replace(replace(replace(cnpj_cpf,'/',''),'.',''),'-','')=:d order by atualizado_em desc limit 1"
-            else:
-                sql = "select * from cadastros where regexp_replace(cnpj_cpf,'\\D','','g')=:d order by atualizado_em desc limit 1"
+            sql = "select * from cadastros where cnpj_digits=:d order by atualizado_ts desc limit 1"
             row = c.execute(text(sql), {"d": digits}).mappings().first()
             if not row:
                 return None
-            d = dict(row)
             # Converte para chaves usadas no app
-            out = {k: d.get(v) for k, v in cls.CAD_MAP.items()}
-            out["CNPJ/CPF"] = d.get("cnpj_cpf")
-            return out
+            return cls._row_to_excel_cad(dict(row))
+
+    LOOKUP_CHUNK = 500  # documentos por "in (...)"
 
     @classmethod
-    def list_cadastros_excel(cls, start: str | None = None, end: str | None = None, vendedor: str | None = None, cnpj_digits: str | None = None) -> list[dict]:
-        where = []
-        params = {}
-        is_sqlite = cls._engine.dialect.name == "sqlite"
-        if vendedor:
-            if is_sqlite:
-                where.append("lower(coalesce(vendedor,'')) like :vend")
-                params["vend"] = f"%{(vendedor or '').lower()}%"
-            else:
-                where.append("coalesce(vendedor,'') ilike :vend")
-                params["vend"] = f"%{vendedor}%"
-        if cnpj_digits:
-            if is_sqlite:
-                where.append("replace(replace(replace(cnpj_cpf,'/',''),'.',''),'-','') = :digits")
-            else:
-                where.append("regexp_replace(cnpj_cpf,'\\D','','g') = :digits")
-            params["digits"] = re.sub(r"\D","", cnpj_digits)
-        sql = "select * from cadastros"
-        if where:
-            sql += " where " + " and ".join(where)
-        sql += " order by atualizado_em desc"
+    def buscar_cadastros_por_documentos(cls, documentos) -> dict[str, dict]:
+        """Cadastro mais recente de cada documento numa consulta por lote; chave = dígitos do CNPJ/CPF."""
+        digits = sorted({re.sub(r"\D", "", str(d or "")) for d in documentos} - {""})
+        melhores: dict[str, dict] = {}
+        if not digits:
+            return {}
+        def _recencia(r):
+            return (r["atualizado_ts"] is not None, r["atualizado_ts"])
+
+        sql = text("select * from cadastros where cnpj_digits in :ds").bindparams(bindparam("ds", expanding=True))
         with cls._engine.connect() as c:
-            res = c.execute(text(sql), params); rows = []
-            for m in res.mappings().all():
-                d = dict(m)
-                out = {label: d.get(col) for label, col in cls.CAD_MAP.items()}
-                out["CNPJ/CPF"] = d.get("cnpj_cpf")
-                rows.append(out)
-        # Filtro por data (formato DD/MM/YYYY) aplicado em Python
-        if start or end:
-            dstart = datetime.strptime(start, "%d/%m/%Y") if start else None
-            dend = datetime.strptime(end, "%d/%m/%Y") if end else None
-            def parse_dt(s: str):
-                try:
-                    return datetime.strptime((s or "").split()[0], "%d/%m/%Y")
-                except Exception:
-                    return None
-            def ok(r):
-                ts = parse_dt(r.get("Atualizado em") or r.get("Criado em") or "")
-                if ts is None:
-                    return False if (dstart or dend) else True
-                if dstart and ts < dstart: return False
-                if dend and ts >= (dend + timedelta(days=1)): return False
-                return True
-            rows = [r for r in rows if ok(r)]
-            return rows
-        return rows
+            for i in range(0, len(digits), cls.LOOKUP_CHUNK):
+                for row in c.execute(sql, {"ds": digits[i:i + cls.LOOKUP_CHUNK]}).mappings():
+                    r = dict(row)
+                    atual = melhores.get(r["cnpj_digits"])
+                    # mesmo critério da busca unitária: maior atualizado_ts, nulos por último
+                    if atual is None or _recencia(r) > _recencia(atual):
+                        melhores[r["cnpj_digits"]] = r
+        return {d: cls._row_to_excel_cad(r) for d, r in melhores.items()}
+
+    @classmethod
+    def list_cadastros_excel(cls, start: str | None = None, end: str | None = None, vendedor: str | None = None, cnpj_digits: str | None = None, limit: int | None = None, offset: int | None = None) -> list[dict]:
+        rows = cls._select_list("cadastros", start, end, vendedor, cnpj_digits, limit=limit, offset=offset)
+        return [cls._row_to_excel_cad(r) for r in rows]
 
     # ============ PEDIDOS / OUTROS ============
     @classmethod
     def get_ultimo_pedido_data(cls, doc_formatado: str):
         digits = re.sub(r"\D", "", doc_formatado or "")
-        is_sqlite = cls._engine.dialect.name == "sqlite"
         with cls._engine.connect() as c:
-            if is_sqlite:
-                res = c.execute(text("select data_hora_criacao from pedidos where replace(replace(replace(cnpj_cpf,'/',''),'.',''),'-','')=:d"), {"d": digits}).fetchall()
-                vals = [r[0] for r in res if r and r[0]]
-                return max(vals) if vals else None
-            else:
-                row = c.execute(text("select data_hora_criacao from pedidos where regexp_replace(cnpj_cpf,'\\D','','g')=:d order by data_hora_criacao desc limit 1"), {"d": digits}).first()
-                return row[0] if row else None
+            row = c.execute(text("select data_hora_criacao from pedidos where cnpj_digits=:d and data_hora_criacao_ts is not null order by data_hora_criacao_ts desc limit 1"), {"d": digits}).first()
+            return row[0] if row else None
 
     @classmethod
     def get_proximo_pedido_numero(cls) -> int:
@@ -521,62 +930,134 @@ class DB:
 
     @classmethod
     def salvar_pedido(cls, dados: dict):
+        payload = cls._payload_ped(dados)
+        with cls._engine.begin() as c:
+            c.execute(cls._upsert_sql("pedidos", payload), payload)
+            cls._apos_gravar(c, "pedidos", [payload])
+
+    @classmethod
+    def _payload_ped(cls, dados: dict) -> dict:
         payload = cls._map_payload(dados, cls.PED_MAP)
         payload["cnpj_cpf"] = re.sub(r"\D", "", payload.get("cnpj_cpf") or "")
+        payload["data_hora_criacao_ts"] = cls._ts_param(_parse_ts(payload.get("data_hora_criacao")))
+        payload["cnpj_digits"] = payload["cnpj_cpf"]
+        return payload
+
+    # ============ IMPORTAÇÃO EM LOTE ============
+    _CONFLITO = {
+        "orcamentos": "on conflict (id_orcamento) do update set data_hora=excluded.data_hora, data_hora_ts=excluded.data_hora_ts, cnpj_digits=excluded.cnpj_digits",
+        "cadastros": "on conflict (cnpj_cpf) do update set documento=excluded.documento, razao_social_nome=excluded.razao_social_nome, nome_fantasia=excluded.nome_fantasia, contato=excluded.contato, email_cnpj=excluded.email_cnpj, email_manual=excluded.email_manual, cep=excluded.cep, endereco=excluded.endereco, numero=excluded.numero, complemento=excluded.complemento, bairro=excluded.bairro, municipio=excluded.municipio, uf=excluded.uf, entrega_cep=excluded.entrega_cep, entrega_endereco=excluded.entrega_endereco, entrega_numero=excluded.entrega_numero, entrega_complemento=excluded.entrega_complemento, entrega_bairro=excluded.entrega_bairro, entrega_municipio=excluded.entrega_municipio, entrega_uf=excluded.entrega_uf, desconto_duracao=excluded.desconto_duracao, desconto_unidade=excluded.desconto_unidade, telefone1=excluded.telefone1, telefone2=excluded.telefone2, vendedor=excluded.vendedor, atualizado_em=excluded.atualizado_em, atualizado_ts=excluded.atualizado_ts",
+        "pedidos": "on conflict (id) do nothing",
+    }
+    IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+
+    @classmethod
+    def _upsert_sql(cls, tabela: str, payload: dict):
         cols = ",".join(payload.keys())
         params = ",".join(f":{k}" for k in payload.keys())
-        with cls._engine.begin() as c:
-            c.execute(text(f"insert into pedidos ({cols}) values ({params}) on conflict (id) do nothing"), payload)
+        return text(f"insert into {tabela} ({cols}) values ({params}) {cls._CONFLITO[tabela]}")
 
     @classmethod
-    def list_pedidos_excel(cls, start: str | None = None, end: str | None = None, vendedor: str | None = None, cnpj_digits: str | None = None) -> list[dict]:
-        where = []
-        params = {}
-        is_sqlite = cls._engine.dialect.name == "sqlite"
-        if vendedor:
-            if is_sqlite:
-                where.append("lower(coalesce(vendedor,'')) like :vend")
-                params["vend"] = f"%{(vendedor or '').lower()}%"
-            else:
-                where.append("coalesce(vendedor,'') ilike :vend")
-                params["vend"] = f"%{vendedor}%"
-        if cnpj_digits:
-            if is_sqlite:
-                where.append("replace(replace(replace(cnpj_cpf,'/',''),'.',''),'-','') = :digits")
-            else:
-                where.append("regexp_replace(cnpj_cpf,'\\D','','g') = :digits")
-            params["digits"] = re.sub(r"\D","", cnpj_digits)
-        sql = "select * from pedidos"
-        if where:
-            sql += " where " + " and ".join(where)
-        sql += " order by data_hora_criacao desc"
+    def _apos_gravar(cls, conn, tabela: str, payloads: list[dict]):
+        """Na mesma transação de toda gravação: versão da tabela (caches) e contador de IDs dos orçamentos."""
+        if not payloads:
+            return
+        cls._marcar_alteracao(conn, tabela)
+        if tabela == "orcamentos":
+            # ID explícito (importação/edição) não pode ficar à frente do contador
+            cls._avancar_orcamento_seq(conn, [p.get("id_orcamento") for p in payloads])
+
+    @classmethod
+    def _bulk_upsert(cls, tabela: str, montar, rows, batch_size: int | None = None, progresso=None) -> dict:
+        """
+        Grava em lotes: um executemany por lote, numa transação por lote.
+        `rows` são dicts (rótulos do Excel) ou pares (linha, dict); a referência volta em "erros".
+        Se o lote falhar, refaz linha a linha com savepoints para apontar só as linhas com problema.
+        `progresso(res)` é chamado após cada lote gravado.
+        """
+        batch_size = max(1, int(batch_size or cls.IMPORT_BATCH_SIZE))
+        res = {"lidos": 0, "gravados": 0, "erros": []}
+
+        def _gravar(lote):
+            if not lote:
+                return
+            sql = cls._upsert_sql(tabela, lote[0][1])
+            try:
+                with cls._engine.begin() as c:
+                    c.execute(sql, [p for _, p in lote])
+                    cls._apos_gravar(c, tabela, [p for _, p in lote])
+                res["gravados"] += len(lote)
+                return
+            except Exception:
+                pass
+            with cls._engine.begin() as c:
+                gravados = []
+                for ref, p in lote:
+                    try:
+                        with c.begin_nested():
+                            c.execute(sql, p)
+                        gravados.append(p)
+                    except Exception as ex:
+                        res["erros"].append({"linha": ref, "erro": str(getattr(ex, "orig", None) or ex)})
+                cls._apos_gravar(c, tabela, gravados)
+                res["gravados"] += len(gravados)
+
+        def _gravar_lote(lote):
+            _gravar(lote)
+            if progresso is not None:
+                progresso(res)
+
+        lote = []
+        for i, item in enumerate(rows):
+            ref, dados = item if isinstance(item, tuple) else (i, item)
+            res["lidos"] += 1
+            try:
+                lote.append((ref, montar(dados)))
+            except Exception as ex:
+                res["erros"].append({"linha": ref, "erro": str(ex)})
+                continue
+            if len(lote) >= batch_size:
+                _gravar_lote(lote)
+                lote = []
+        _gravar_lote(lote)
+        return res
+
+    @classmethod
+    def bulk_upsert_orcamentos(cls, rows, batch_size: int | None = None, progresso=None) -> dict:
+        return cls._bulk_upsert("orcamentos", cls._payload_orc, rows, batch_size, progresso)
+
+    @classmethod
+    def bulk_upsert_cadastros(cls, rows, batch_size: int | None = None, progresso=None) -> dict:
+        return cls._bulk_upsert("cadastros", cls._payload_cad, rows, batch_size, progresso)
+
+    @classmethod
+    def bulk_upsert_pedidos(cls, rows, batch_size: int | None = None, progresso=None) -> dict:
+        return cls._bulk_upsert("pedidos", cls._payload_ped, rows, batch_size, progresso)
+
+    @classmethod
+    def list_pedidos_excel(cls, start: str | None = None, end: str | None = None, vendedor: str | None = None, cnpj_digits: str | None = None, limit: int | None = None, offset: int | None = None) -> list[dict]:
+        rows = cls._select_list("pedidos", start, end, vendedor, cnpj_digits, limit=limit, offset=offset)
+        return [cls._row_to_excel_ped(r) for r in rows]
+
+    # ============ IDEMPOTÊNCIA ============
+    @classmethod
+    def resposta_idempotente(cls, chave: str) -> dict | None:
+        """Resposta já dada a um POST com esta Idempotency-Key (None na primeira vez)."""
         with cls._engine.connect() as c:
-            res = c.execute(text(sql), params); rows = []
-            for m in res.mappings().all():
-                d = dict(m)
-                # reverse map
-                out = {}
-                for label, col in cls.PED_MAP.items():
-                    out[label] = d.get(col)
-                rows.append(out)
-        if start or end:
-            dstart = datetime.strptime(start, "%d/%m/%Y") if start else None
-            dend = datetime.strptime(end, "%d/%m/%Y") if end else None
-            def parse_dt(s: str):
-                try:
-                    return datetime.strptime(s, "%d/%m/%Y %H:%M:%S")
-                except Exception:
-                    return None
-            def ok(r):
-                ts = parse_dt(r.get("Data/Hora da criação do pedido") or r.get("data_hora_criacao") or "")
-                if ts is None:
-                    return False if (dstart or dend) else True
-                if dstart and ts < dstart: return False
-                if dend and ts >= (dend + timedelta(days=1)): return False
-                return True
-            rows = [r for r in rows if ok(r)]
-            return rows
-        return rows
+            raw = c.execute(text("select resposta from idempotencia where chave = :k"), {"k": chave}).scalar()
+        return json.loads(raw) if raw else None
+
+    @classmethod
+    def guardar_resposta_idempotente(cls, chave: str, resposta: dict):
+        """Guarda a resposta da 1ª execução e descarta as mais antigas que IDEMPOTENCIA_DIAS."""
+        import time
+        agora = time.time()
+        with cls._engine.begin() as c:
+            c.execute(
+                text("insert into idempotencia (chave, resposta, criado) values (:k, :r, :t) on conflict (chave) do nothing"),
+                {"k": chave, "r": json.dumps(resposta, ensure_ascii=False, default=str), "t": agora},
+            )
+            c.execute(text("delete from idempotencia where criado < :t"), {"t": agora - IDEMPOTENCIA_DIAS * 86400})
 
     # ============ USUARIOS / ACESSO ============
     @staticmethod
@@ -656,3 +1137,55 @@ class DB:
                 "is_admin": 1,
                 "permissoes": "*",
             })
+
+
+# ====== Acesso assíncrono (handlers FastAPI) ======
+# Threads dedicadas ao banco; o padrão acompanha o pool (DB_POOL_SIZE + DB_MAX_OVERFLOW):
+# mais threads que conexões só deixaria threads esperando conexão.
+DB_THREADS = int(os.getenv("DB_THREADS") or (DB_POOL_SIZE + DB_MAX_OVERFLOW))
+
+
+class AsyncDB:
+    """Fachada assíncrona do DB: `await adb.metodo(...)` roda o método síncrono num pool de threads limitado."""
+
+    def __init__(self, db=DB, max_workers: int | None = None):
+        self._db = db
+        self._max_workers = max(1, max_workers or DB_THREADS)
+        self._executor: ThreadPoolExecutor | None = None
+        self.stats = {"calls": 0, "running": 0}
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="db")
+        return self._executor
+
+    async def run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        self.stats["calls"] += 1
+        self.stats["running"] += 1
+        try:
+            return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+        finally:
+            self.stats["running"] -= 1
+
+    def __getattr__(self, name):
+        attr = getattr(self._db, name)
+        if not callable(attr):
+            return attr
+
+        async def _chamada(*args, **kwargs):
+            return await self.run(attr, *args, **kwargs)
+        return _chamada
+
+    def info(self) -> dict:
+        return {"max_workers": self._max_workers, **self.stats}
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+# Instância compartilhada: server, server_db e ui_app disputam o mesmo limite de threads
+ADB = AsyncDB(DB)
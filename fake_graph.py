@@ -0,0 +1,252 @@
+"""
+Servidor falso do Microsoft Graph (só a parte de workbook que o server.py usa).
+
+Serve para medir e testar o backend Excel sem internet:
+
+    python fake_graph.py --port 8765 --rows 5000 --latency-ms 80 --throttle 0.05
+
+e no server.py:
+
+    GRAPH_BASE_URL=http://127.0.0.1:8765/v1.0
+    GRAPH_STATIC_TOKEN=fake
+    STORAGE_BACKEND=excel
+
+GET /_stats mostra quantas chamadas cada endpoint recebeu; POST /_reset zera a tabela e os contadores.
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response
+
+
+COLUNAS = [
+    "ID Orçamento", "Data/Hora", "Tipo de Serviço", "CLIENTE (Etiqueta PDF)", "CLIENTE (Valor)",
+    "Documento", "CNPJ/CPF", "E-mail", "Vendedor", "Status", "Quantidade", "Unidade",
+    "Metros", "Preço por metro", "Forma de Pagamento", "Valor Total",
+]
+
+CONFIG = {
+    "rows": int(os.getenv("FAKE_GRAPH_ROWS", "1000")),
+    "latency_ms": float(os.getenv("FAKE_GRAPH_LATENCY_MS", "0")),
+    "jitter_ms": float(os.getenv("FAKE_GRAPH_JITTER_MS", "0")),
+    "throttle": float(os.getenv("FAKE_GRAPH_THROTTLE", "0")),  # fração de requests que recebem 429
+    "retry_after": int(os.getenv("FAKE_GRAPH_RETRY_AFTER", "1")),
+    "max_rps": float(os.getenv("FAKE_GRAPH_MAX_RPS", "0")),  # 0 = sem limite
+    "session_ttl": float(os.getenv("FAKE_GRAPH_SESSION_TTL", "300")),
+    "table": os.getenv("EXCEL_TABLE_NAME", "Orcamentos"),
+}
+
+ITEM_ID = "FAKEITEM"
+
+
+def _linha_exemplo(i: int) -> list:
+    sigla = "IM" if i % 3 else "DG"
+    dt = datetime(2025, 1, 1) + timedelta(hours=i)
+    doc = f"{i % 500:014d}"
+    cnpj = f"{doc[:2]}.{doc[2:5]}.{doc[5:8]}/{doc[8:12]}-{doc[12:]}"
+    return [
+        f"OR-{sigla}{i + 1}{dt:%d%m%Y}", dt.strftime("%d/%m/%Y %H:%M:%S"),
+        "Impressão" if sigla == "IM" else "Digitalização", "Razão Social", f"Cliente {i % 500}",
+        "CNPJ", cnpj, f"cliente{i % 500}@exemplo.com", f"Vendedor {i % 7}", "Novo",
+        "100", "Centímetros", "1,00", "8,00", "PIX", "8,00",
+    ]
+
+
+class Estado:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.linhas = [_linha_exemplo(i) for i in range(CONFIG["rows"])]
+        self.versao = 1
+        self.sessoes = {}  # id -> último uso
+        self.chamadas = Counter()
+        self.throttled = 0
+        self.janela = []  # timestamps para o limite de rps
+
+    @property
+    def etag(self) -> str:
+        return f'"{{{ITEM_ID}}},{self.versao}"'
+
+
+ESTADO = Estado()
+app = FastAPI(title="Fake Graph")
+
+
+@app.middleware("http")
+async def _simula_rede(request: Request, call_next):
+    if request.url.path.startswith("/_"):
+        return await call_next(request)
+    atraso = CONFIG["latency_ms"] + random.uniform(0, CONFIG["jitter_ms"])
+    if atraso > 0:
+        await asyncio.sleep(atraso / 1000.0)
+    agora = time.monotonic()
+    limitado = CONFIG["throttle"] > 0 and random.random() < CONFIG["throttle"]
+    if CONFIG["max_rps"] > 0:
+        ESTADO.janela = [t for t in ESTADO.janela if agora - t < 1.0]
+        if len(ESTADO.janela) >= CONFIG["max_rps"]:
+            limitado = True
+        else:
+            ESTADO.janela.append(agora)
+    if limitado:
+        ESTADO.throttled += 1
+        return JSONResponse(
+            {"error": {"code": "TooManyRequests", "message": "Fake throttling"}},
+            status_code=429, headers={"Retry-After": str(CONFIG["retry_after"])},
+        )
+    return await call_next(request)
+
+
+def _conta(nome: str):
+    ESTADO.chamadas[nome] += 1
+
+
+def _tabela(table: str):
+    if table != CONFIG["table"]:
+        raise HTTPException(404, "Tabela não encontrada")
+
+
+def _sessao(request: Request):
+    sid = request.headers.get("workbook-session-id")
+    if not sid:
+        return
+    ultimo = ESTADO.sessoes.get(sid)
+    if ultimo is None or time.time() - ultimo > CONFIG["session_ttl"]:
+        ESTADO.sessoes.pop(sid, None)
+        raise HTTPException(404, detail={"code": "InvalidSessionReCreatable"})
+    ESTADO.sessoes[sid] = time.time()
+
+
+@app.exception_handler(HTTPException)
+async def _erro_graph(request: Request, exc: HTTPException):
+    # mesmo formato de erro do Graph: {"error": {"code": ..., "message": ...}}
+    det = exc.detail if isinstance(exc.detail, dict) else {"code": "ItemNotFound", "message": str(exc.detail)}
+    return JSONResponse({"error": det}, status_code=exc.status_code, headers=exc.headers)
+
+
+@app.get("/v1.0/me/drive/root:/{path:path}")
+async def item_por_caminho(path: str):
+    _conta("item_by_path")
+    return {"id": ITEM_ID, "name": os.path.basename(path), "eTag": ESTADO.etag, "cTag": ESTADO.etag}
+
+
+@app.get("/v1.0/me/drive/items/{item_id}")
+async def item(item_id: str):
+    _conta("item")
+    return {"id": item_id, "eTag": ESTADO.etag, "cTag": ESTADO.etag}
+
+
+@app.post("/v1.0/me/drive/items/{item_id}/workbook/createSession", status_code=201)
+async def create_session(item_id: str):
+    _conta("createSession")
+    sid = uuid.uuid4().hex
+    ESTADO.sessoes[sid] = time.time()
+    return {"id": sid, "persistChanges": True}
+
+
+@app.post("/v1.0/me/drive/items/{item_id}/workbook/refreshSession", status_code=204)
+async def refresh_session(item_id: str, request: Request):
+    _conta("refreshSession")
+    _sessao(request)
+    return Response(status_code=204)
+
+
+@app.post("/v1.0/me/drive/items/{item_id}/workbook/closeSession", status_code=204)
+async def close_session(item_id: str, request: Request):
+    _conta("closeSession")
+    ESTADO.sessoes.pop(request.headers.get("workbook-session-id"), None)
+    return Response(status_code=204)
+
+
+@app.get("/v1.0/me/drive/items/{item_id}/workbook/tables/{table}/columns")
+async def colunas(item_id: str, table: str, request: Request):
+    _conta("columns")
+    _tabela(table)
+    _sessao(request)
+    return {"value": [{"index": i, "name": c} for i, c in enumerate(COLUNAS)]}
+
+
+@app.get("/v1.0/me/drive/items/{item_id}/workbook/tables/{table}/rows")
+async def linhas(item_id: str, table: str, request: Request):
+    _conta("rows")
+    _tabela(table)
+    _sessao(request)
+    skip = int(request.query_params.get("$skip") or 0)
+    top = request.query_params.get("$top")
+    fim = skip + int(top) if top else None
+    return {"value": [{"index": skip + i, "values": [v]} for i, v in enumerate(ESTADO.linhas[skip:fim])]}
+
+
+@app.get("/v1.0/me/drive/items/{item_id}/workbook/tables/{table}/rows/itemAt(index={index})")
+async def linha_em(item_id: str, table: str, index: int, request: Request):
+    _conta("rows_itemAt")
+    _tabela(table)
+    _sessao(request)
+    if not 0 <= index < len(ESTADO.linhas):
+        raise HTTPException(404, "Linha não encontrada")
+    return {"index": index, "values": [ESTADO.linhas[index]]}
+
+
+@app.post("/v1.0/me/drive/items/{item_id}/workbook/tables/{table}/rows/add", status_code=201)
+async def adicionar(item_id: str, table: str, request: Request):
+    _conta("rows_add")
+    _tabela(table)
+    _sessao(request)
+    body = await request.json()
+    valores = body.get("values") or []
+    if any(len(v) > len(COLUNAS) for v in valores):
+        raise HTTPException(400, detail={"code": "InvalidArgument", "message": "Linha maior que a tabela"})
+    inicio = len(ESTADO.linhas)
+    for v in valores:
+        ESTADO.linhas.append(list(v) + [""] * (len(COLUNAS) - len(v)))
+    ESTADO.versao += 1
+    ESTADO.chamadas["rows_added"] += len(valores)
+    return {"index": inicio, "values": ESTADO.linhas[inicio:]}
+
+
+@app.get("/_stats")
+async def stats():
+    return {"calls": dict(ESTADO.chamadas), "throttled": ESTADO.throttled, "rows": len(ESTADO.linhas),
+            "sessions": len(ESTADO.sessoes), "config": CONFIG}
+
+
+@app.post("/_reset")
+async def reset(request: Request):
+    try:
+        novos = await request.json()
+    except Exception:
+        novos = {}
+    CONFIG.update({k: type(CONFIG[k])(v) for k, v in (novos or {}).items() if k in CONFIG})
+    ESTADO.reset()
+    return await stats()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Servidor falso do Microsoft Graph (workbook)")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--rows", type=int, default=CONFIG["rows"], help="linhas iniciais da tabela")
+    ap.add_argument("--latency-ms", type=float, default=CONFIG["latency_ms"])
+    ap.add_argument("--jitter-ms", type=float, default=CONFIG["jitter_ms"])
+    ap.add_argument("--throttle", type=float, default=CONFIG["throttle"], help="fração de 429 aleatórios (0-1)")
+    ap.add_argument("--max-rps", type=float, default=CONFIG["max_rps"], help="429 acima deste rps (0 = sem limite)")
+    ap.add_argument("--retry-after", type=int, default=CONFIG["retry_after"])
+    ap.add_argument("--session-ttl", type=float, default=CONFIG["session_ttl"])
+    args = ap.parse_args()
+    CONFIG.update(rows=args.rows, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, throttle=args.throttle,
+                  max_rps=args.max_rps, retry_after=args.retry_after, session_ttl=args.session_ttl)
+    ESTADO.reset()
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
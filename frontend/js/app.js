@@ -40,14 +40,21 @@ async function criarOrcamento(e) {
   }
 }
 
-async function buscar(e) {
-  e.preventDefault();
+const PAGE_SIZE = 50;
+let nextCursor = null;
+let shown = 0;
+
+async function buscar(e, more=false) {
+  if (e) e.preventDefault();
   showMsg('');
   const id = qs('id')?.value?.trim();
   const cnpj = qs('cnpj')?.value?.trim();
   const params = new URLSearchParams();
   if (id) params.set('id', id);
   if (cnpj) params.set('cnpj', cnpj);
+  params.set('limit', PAGE_SIZE);
+  if (more && nextCursor) params.set('cursor', nextCursor);
+  else params.set('count', 'true');
   try {
     const r = await fetch(`${API_BASE}/api/orcamentos?${params.toString()}`);
     const data = await r.json();
@@ -56,7 +63,9 @@ async function buscar(e) {
     const tbl = qs('tbl');
     const tbody = tbl?.querySelector('tbody');
     if (!tbody) return;
-    tbody.innerHTML = '';
+    if (!more) { tbody.innerHTML = ''; shown = 0; }
+    nextCursor = data?.next_cursor || null;
+    if (!more) { if (data?.total != null) tbl.dataset.total = data.total; else delete tbl.dataset.total; }
     for (const d of rows) {
       const idv = d['ID Orçamento'] || d['id_orcamento'] || d['ID'] || '';
       const tr = document.createElement('tr');
@@ -70,8 +79,12 @@ async function buscar(e) {
       `;
       tbody.appendChild(tr);
     }
-    tbl.style.display = rows.length ? 'table' : 'none';
-    showMsg(`${rows.length} registro(s) encontrados.`, 'success');
+    shown += rows.length;
+    tbl.style.display = shown ? 'table' : 'none';
+    const more_btn = qs('mais');
+    if (more_btn) more_btn.style.display = nextCursor ? 'inline-block' : 'none';
+    const total = tbl.dataset.total ? ` de ${tbl.dataset.total}` : '';
+    showMsg(`${shown}${total} registro(s) encontrados.`, 'success');
   } catch (ex) {
     showMsg(String(ex), 'error');
   }
@@ -82,5 +95,7 @@ window.addEventListener('DOMContentLoaded', () => {
   const f2 = qs('form-busca');
   if (f1) f1.addEventListener('submit', criarOrcamento);
   if (f2) f2.addEventListener('submit', buscar);
+  const more_btn = qs('mais');
+  if (more_btn) more_btn.addEventListener('click', () => buscar(null, true));
 });
 
@@ -1,5 +1,9 @@
+import argparse
+import multiprocessing as mp
 import os
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Optional
 
@@ -38,6 +42,16 @@ def row_to_dict(headers, row):
     return out
 
 
+def iter_linhas(ws, inicio: int = 2):
+    """(nº da linha, dados) das linhas não vazias a partir da linha `inicio`."""
+    headers = header_map(ws)
+    inicio = max(2, inicio)
+    for i, row in enumerate(ws.iter_rows(min_row=inicio), start=inicio):
+        d = row_to_dict(headers, row)
+        if any(v for v in d.values()):
+            yield i, d
+
+
 def locate_excel_path(arg_path: Optional[str]) -> Optional[str]:
     if arg_path:
         return arg_path if os.path.exists(arg_path) else None
@@ -62,7 +76,82 @@ def locate_excel_path(arg_path: Optional[str]) -> Optional[str]:
     return None
 
 
+# abas importadas: (chave, nome exibido, nomes aceitos, método de gravação no DB)
+ABAS = (
+    ("orc", "Orçamentos", ("Orçamentos", "Orcamentos"), "bulk_upsert_orcamentos"),
+    ("cad", "Cadastros", ("Cadastros",), "bulk_upsert_cadastros"),
+    ("ped", "Pedidos", ("Pedidos",), "bulk_upsert_pedidos"),
+)
+FILA_MAX_LOTES = 4  # lotes em trânsito por aba entre o processo leitor e a thread gravadora
+
+
+def _ler_aba(excel_path: str, aba: str, inicio: int, lote: int, fila):
+    """Processo leitor: envia lotes de (linha, dados) para a fila; None marca o fim."""
+    try:
+        wb = load_workbook(excel_path, read_only=True, data_only=True)
+        try:
+            buf = []
+            for item in iter_linhas(wb[aba], inicio):
+                buf.append(item)
+                if len(buf) >= lote:
+                    fila.put(buf)
+                    buf = []
+            if buf:
+                fila.put(buf)
+        finally:
+            wb.close()
+    except Exception as ex:
+        fila.put(("erro", f"{type(ex).__name__}: {ex}"))
+    finally:
+        fila.put(None)
+
+
+def _consumir(fila):
+    while True:
+        lote = fila.get()
+        if lote is None:
+            return
+        if isinstance(lote, tuple):
+            raise RuntimeError(f"falha ao ler a planilha: {lote[1]}")
+        yield from lote
+
+
+def _processar_aba(excel_path: str, aba: str, gravar, args, ctx=None):
+    """Lê e grava uma aba; com ctx a leitura roda em outro processo. Retorna (resultado, segundos)."""
+    t0 = time.perf_counter()
+    proc = wb = None
+    try:
+        if ctx is not None:
+            fila = ctx.Queue(maxsize=FILA_MAX_LOTES)
+            proc = ctx.Process(target=_ler_aba, args=(excel_path, aba, args.resume_from_row, args.batch_size, fila), daemon=True)
+            proc.start()
+            linhas = _consumir(fila)
+        else:
+            wb = load_workbook(excel_path, read_only=True, data_only=True)
+            linhas = iter_linhas(wb[aba], args.resume_from_row)
+        if args.dry_run:
+            res = {"lidos": sum(1 for _ in linhas), "gravados": 0, "erros": []}
+        else:
+            res = gravar(linhas, batch_size=args.batch_size)
+    finally:
+        if proc is not None:
+            proc.join(timeout=5)
+            if proc.is_alive():
+                proc.terminate()
+        if wb is not None:
+            wb.close()
+    return res, time.perf_counter() - t0
+
+
 def main():
+    ap = argparse.ArgumentParser(description="Migra a planilha de orçamentos (Excel) para o banco")
+    ap.add_argument("excel_path", nargs="?", help="caminho do .xlsx (padrão: EXCEL_RELATIVE_PATH no OneDrive)")
+    ap.add_argument("--workers", type=int, default=1, help="abas processadas em paralelo (leitura em processos separados)")
+    ap.add_argument("--dry-run", action="store_true", help="só lê e conta as linhas, sem gravar no banco")
+    ap.add_argument("--resume-from-row", type=int, default=2, help="ignora as linhas anteriores a esta (em todas as abas)")
+    ap.add_argument("--batch-size", type=int, default=None, help="linhas por lote de gravação (padrão: IMPORT_BATCH_SIZE)")
+    args = ap.parse_args()
+
     print("== Migração Excel -> DB ==")
     load_dotenv()
 
@@ -72,84 +161,63 @@ def main():
         print("ERRO: não foi possível importar db_backend:", ex)
         sys.exit(1)
 
-    if not DB.is_ready():
-        print("ERRO: DATABASE_URL inválido ou SQLAlchemy indisponível. Verifique seu .env.")
-        sys.exit(2)
-
-    # Garante esquema
-    try:
-        if hasattr(DB, "init_schema_portable"):
-            DB.init_schema_portable()
-        else:
-            DB.init_schema()
-    except Exception as ex:
-        print("Aviso: falha ao criar esquema:", ex)
-
-    arg_path = sys.argv[1] if len(sys.argv) > 1 else None
-    excel_path = locate_excel_path(arg_path)
+    if not args.dry_run:
+        if not DB.is_ready():
+            print("ERRO: DATABASE_URL inválido ou SQLAlchemy indisponível. Verifique seu .env.")
+            sys.exit(2)
+
+        # Garante esquema
+        try:
+            if hasattr(DB, "init_schema_portable"):
+                DB.init_schema_portable()
+            else:
+                DB.init_schema()
+        except Exception as ex:
+            print("Aviso: falha ao criar esquema:", ex)
+    args.batch_size = max(1, args.batch_size or DB.IMPORT_BATCH_SIZE)
+
+    excel_path = locate_excel_path(args.excel_path)
     if not excel_path:
         print("ERRO: não encontrei a planilha. Informe o caminho como argumento ou configure EXCEL_RELATIVE_PATH no .env.")
         sys.exit(3)
 
-    print("Lendo:", excel_path)
+    print("Lendo:", excel_path, "(dry-run)" if args.dry_run else "")
     wb = load_workbook(excel_path, read_only=True, data_only=True)
-
-    def get_ws(*names):
-        for n in names:
-            if n in wb.sheetnames:
-                return wb[n]
-        return None
-
-    ws_orc = get_ws("Orçamentos", "Orcamentos")
-    ws_cad = get_ws("Cadastros")
-    ws_ped = get_ws("Pedidos")
-
+    nomes_abas = wb.sheetnames
+    wb.close()
+
+    tarefas = []
+    for chave, titulo, nomes, metodo in ABAS:
+        aba = next((n for n in nomes if n in nomes_abas), None)
+        if aba is not None:
+            tarefas.append((chave, titulo, aba, getattr(DB, metodo)))
+
+    # --workers > 1: cada aba é lida em um processo (openpyxl é CPU bound) e gravada por uma thread
+    workers = max(1, min(args.workers, len(tarefas) or 1))
+    ctx = mp.get_context() if workers > 1 else None
     from_count = {"orc": 0, "cad": 0, "ped": 0}
     to_count = {"orc": 0, "cad": 0, "ped": 0}
-
-    if ws_orc is not None:
-        headers = header_map(ws_orc)
-        for i, row in enumerate(ws_orc.iter_rows(min_row=2), start=2):
-            d = row_to_dict(headers, row)
-            if not any(v for v in d.values()):
-                continue
-            from_count["orc"] += 1
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="migracao") as ex:
+        futuros = [(chave, titulo, ex.submit(_processar_aba, excel_path, aba, gravar, args, ctx))
+                   for chave, titulo, aba, gravar in tarefas]
+        for chave, titulo, fut in futuros:
             try:
-                DB.salvar_orcamento(d)
-                to_count["orc"] += 1
-            except Exception as ex:
-                print(f"  Linha {i} (Orçamentos) falhou: {ex}")
-
-    if ws_cad is not None:
-        headers = header_map(ws_cad)
-        for i, row in enumerate(ws_cad.iter_rows(min_row=2), start=2):
-            d = row_to_dict(headers, row)
-            if not any(v for v in d.values()):
+                res, seg = fut.result()
+            except Exception as e:
+                print(f"  {titulo}: falhou: {e}")
                 continue
-            from_count["cad"] += 1
-            try:
-                DB.salvar_cadastro(d)
-                to_count["cad"] += 1
-            except Exception as ex:
-                print(f"  Linha {i} (Cadastros) falhou: {ex}")
-
-    if ws_ped is not None:
-        headers = header_map(ws_ped)
-        for i, row in enumerate(ws_ped.iter_rows(min_row=2), start=2):
-            d = row_to_dict(headers, row)
-            if not any(v for v in d.values()):
-                continue
-            from_count["ped"] += 1
-            try:
-                DB.salvar_pedido(d)
-                to_count["ped"] += 1
-            except Exception as ex:
-                print(f"  Linha {i} (Pedidos) falhou: {ex}")
+            from_count[chave] = res["lidos"]
+            to_count[chave] = res["gravados"]
+            for e in res["erros"]:
+                print(f"  Linha {e['linha']} ({titulo}) falhou: {e['erro']}")
+            print(f"  {titulo}: {res['lidos']} linhas em {seg:.1f}s ({res['lidos'] / seg if seg > 0 else 0:.0f} linhas/s)")
 
     print("Concluído:")
     print("  Orçamentos:", from_count["orc"], "lidos /", to_count["orc"], "inseridos")
     print("  Cadastros :", from_count["cad"], "lidos /", to_count["cad"], "inseridos")
     print("  Pedidos   :", from_count["ped"], "lidos /", to_count["ped"], "inseridos")
+    print(f"  Tempo total: {time.perf_counter() - t0:.1f}s")
 
 
 if __name__ == "__main__":
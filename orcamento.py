@@ -3,6 +3,7 @@ import os
 import re
 import urllib.parse
 import sys
+import threading
 from datetime import datetime, timedelta
 
 import flet as ft
@@ -36,6 +37,8 @@ FONT_ITAL = "Arial-Italic" if ARIAL_OK else "Helvetica-Oblique"
 
 # Debug opcional (para rodar via VS Code): defina ORC_DEBUG=1
 ORC_DEBUG = os.environ.get("ORC_DEBUG", "0") == "1"
+# Linhas por página pedidas à API nas buscas/listagens
+LIST_PAGE_SIZE = int(os.environ.get("ORC_LIST_PAGE_SIZE", "200"))
 
 MM = 2.834645669
 MARGEM = 20 * MM
@@ -57,35 +60,130 @@ LOGO_RIGHT_MARGIN = 5 * MM
 # =========================================================
 #                         HELPERS
 # =========================================================
-def http_get_json(url: str, timeout: int = 8):
-    """Tenta 'requests'; se não houver, usa 'urllib'."""
-    try:
-        import requests  # type: ignore
-        r = requests.get(url, timeout=timeout)
-        r.raise_for_status()
-        return r.json()
-    except Exception:
-        import urllib.request
-        import json as _json
-        with urllib.request.urlopen(url, timeout=timeout) as resp:
-            return _json.loads(resp.read().decode("utf-8"))
+# Cliente HTTP: timeouts/retries configuráveis por variável de ambiente
+HTTP_RETRIES = int(os.environ.get("ORC_HTTP_RETRIES", "2"))
+HTTP_BACKOFF = float(os.environ.get("ORC_HTTP_BACKOFF", "0.5"))
+HTTP_POOL_SIZE = int(os.environ.get("ORC_HTTP_POOL_SIZE", "8"))
 
 
-def http_post_json(url: str, payload: dict, timeout: int = 10):
-    """POST JSON com fallback para urllib."""
-    try:
-        import requests  # type: ignore
-        r = requests.post(url, json=payload, timeout=timeout)
-        r.raise_for_status()
-        return r.json()
-    except Exception:
+class ApiClient:
+    """Sessão HTTP compartilhada: conexões keep-alive, retries com backoff e respostas gzip.
+
+    Usa 'requests' quando disponível; sem ele, cada chamada cai em 'urllib' (sem pool).
+    """
+
+    def __init__(self, base_url: str | None = None, retries: int = HTTP_RETRIES, backoff: float = HTTP_BACKOFF, pool_size: int = HTTP_POOL_SIZE):
+        self.base_url = (base_url or get_api_base()).rstrip("/")
+        self.session = None
+        try:
+            import requests  # type: ignore
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+        except Exception:
+            return
+        # Erros de conexão são repetidos para qualquer método; status 502/503/504 só em GET
+        retry = Retry(
+            total=retries, connect=retries, read=retries, status=retries,
+            backoff_factor=backoff, status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({"GET"}), raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+        sess = requests.Session()
+        sess.mount("http://", adapter)
+        sess.mount("https://", adapter)
+        sess.headers.update({"Accept": "application/json", "Accept-Encoding": "gzip, deflate"})
+        self.session = sess
+
+    def url(self, path: str) -> str:
+        if path.startswith("http://") or path.startswith("https://"):
+            return path
+        if not path.startswith("/"):
+            path = "/" + path
+        return self.base_url + path
+
+    def get_json(self, path: str, timeout: float = 8):
+        url = self.url(path)
+        if self.session is not None:
+            r = self.session.get(url, timeout=timeout)
+            r.raise_for_status()
+            return r.json()
+        import urllib.request
+        import json as _json
+        import gzip
+        req = urllib.request.Request(url, headers={"Accept-Encoding": "gzip"})
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            raw = resp.read()
+            if resp.headers.get("Content-Encoding") == "gzip":
+                raw = gzip.decompress(raw)
+            return _json.loads(raw.decode("utf-8"))
+
+    def post_json(self, path: str, payload: dict, timeout: float = 10, headers: dict | None = None):
+        url = self.url(path)
+        if self.session is not None:
+            r = self.session.post(url, json=payload, timeout=timeout, headers=headers)
+            r.raise_for_status()
+            return r.json()
         import urllib.request
         import json as _json
         data = _json.dumps(payload).encode("utf-8")
-        req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"}, method="POST")
+        req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json", **(headers or {})}, method="POST")
         with urllib.request.urlopen(req, timeout=timeout) as resp:
             return _json.loads(resp.read().decode("utf-8"))
 
+    def iter_lines(self, path: str, timeout: float = 60):
+        """Linhas (bytes) de uma resposta lida em streaming."""
+        url = self.url(path)
+        if self.session is not None:
+            with self.session.get(url, stream=True, timeout=timeout) as r:
+                r.raise_for_status()
+                yield from r.iter_lines()
+            return
+        import urllib.request
+        with urllib.request.urlopen(url, timeout=timeout) as resp:
+            for line in resp:
+                yield line.strip()
+
+    def download(self, path: str, destino: str, timeout: float = 300) -> str:
+        """Baixa um arquivo direto para o disco, em blocos."""
+        url = self.url(path)
+        tmp = destino + ".part"
+        if self.session is not None:
+            with self.session.get(url, stream=True, timeout=timeout) as r:
+                r.raise_for_status()
+                with open(tmp, "wb") as f:
+                    for chunk in r.iter_content(chunk_size=64 * 1024):
+                        f.write(chunk)
+        else:
+            import urllib.request
+            with urllib.request.urlopen(url, timeout=timeout) as resp, open(tmp, "wb") as f:
+                shutil.copyfileobj(resp, f, 64 * 1024)
+        os.replace(tmp, destino)
+        return destino
+
+
+_API_CLIENT: ApiClient | None = None
+_API_CLIENT_LOCK = threading.Lock()
+
+
+def api_client() -> ApiClient:
+    """Cliente único do processo, criado no primeiro uso (a URL base é resolvida uma vez)."""
+    global _API_CLIENT
+    if _API_CLIENT is None:
+        with _API_CLIENT_LOCK:
+            if _API_CLIENT is None:
+                _API_CLIENT = ApiClient()
+    return _API_CLIENT
+
+
+def http_get_json(url: str, timeout: int = 8):
+    """GET JSON pela sessão compartilhada (fallback 'urllib' sem 'requests')."""
+    return api_client().get_json(url, timeout=timeout)
+
+
+def http_post_json(url: str, payload: dict, timeout: int = 10):
+    """POST JSON pela sessão compartilhada (fallback 'urllib' sem 'requests')."""
+    return api_client().post_json(url, payload, timeout=timeout)
+
 
 def _read_text_file(path: str) -> str | None:
     try:
@@ -130,24 +228,58 @@ def get_api_base() -> str:
 
 
 def api_get(path: str) -> dict:
-    import urllib.parse as _up
-    base = get_api_base()
-    if not path.startswith("/"):
-        path = "/" + path
-    url = base + path
+    client = api_client()
     if ORC_DEBUG:
-        print(f"[DEBUG] GET {url}")
-    return http_get_json(url)
+        print(f"[DEBUG] GET {client.url(path)}")
+    return client.get_json(path)
+
+
+def api_post(path: str, payload: dict, headers: dict | None = None) -> dict:
+    client = api_client()
+    if ORC_DEBUG:
+        print(f"[DEBUG] POST {client.url(path)} payload_keys={list(payload.keys())}")
+    return client.post_json(path, payload, headers=headers)
+
+
+def api_get_paginado(path: str, page_size: int = 1000, limite: int | None = None) -> list[dict]:
+    """Todas as linhas de uma listagem, seguindo next_cursor página a página (até `limite`, se dado)."""
+    out: list[dict] = []
+    cursor = None
+    sep = "&" if "?" in path else "?"
+    while True:
+        n = min(page_size, limite - len(out)) if limite else page_size
+        q = f"{path}{sep}limit={n}"
+        if cursor:
+            q += f"&cursor={urllib.parse.quote(cursor)}"
+        r = api_get(q)
+        if isinstance(r, list):
+            return r
+        if not isinstance(r, dict):
+            break
+        out.extend(r.get("rows") or [])
+        cursor = r.get("next_cursor")
+        if not cursor or (limite and len(out) >= limite):
+            break
+    return out
 
 
-def api_post(path: str, payload: dict) -> dict:
-    base = get_api_base()
-    if not path.startswith("/"):
-        path = "/" + path
-    url = base + path
+def api_stream_ndjson(path: str, timeout: int = 60):
+    """Gera um dict por linha de um endpoint NDJSON, lendo a resposta em streaming."""
+    import json as _json
+    client = api_client()
     if ORC_DEBUG:
-        print(f"[DEBUG] POST {url} payload_keys={list(payload.keys())}")
-    return http_post_json(url, payload)
+        print(f"[DEBUG] GET (stream) {client.url(path)}")
+    for line in client.iter_lines(path, timeout=timeout):
+        if line:
+            yield _json.loads(line)
+
+
+def api_download(path: str, destino: str, timeout: int = 300) -> str:
+    """Baixa um arquivo da API direto para o disco, em blocos."""
+    client = api_client()
+    if ORC_DEBUG:
+        print(f"[DEBUG] GET (download) {client.url(path)} -> {destino}")
+    return client.download(path, destino, timeout=timeout)
 
 
 def find_onedrive_base() -> str | None:
@@ -597,6 +729,603 @@ def load_wb_safe(path: str, **kwargs):
         # Tenta recuperar recriando/normalizando a planilha
         init_excel()
         return load_workbook(path, **kwargs)
+
+
+def _digitos(v) -> str:
+    return re.sub(r"\D", "", str(v or ""))
+
+
+def _as_datetime(v) -> datetime | None:
+    if isinstance(v, datetime):
+        return v
+    return _parse_datetime_ptbr(v) if isinstance(v, str) else None
+
+
+# Gravações offline vão para um journal append-only (uma linha JSON por operação) em vez de
+# regravar o .xlsx inteiro; compactar_journal() aplica tudo na planilha de uma vez
+JOURNAL_FILE = os.environ.get("ORC_JOURNAL_FILE") or safe_join(LOCAL_BASE, "BANCO_DE_DADOS_ORCAMENTO.journal.jsonl")
+JOURNAL_COMPACT_EVERY = int(os.environ.get("ORC_JOURNAL_COMPACT_EVERY", "500"))
+# propriedade da planilha com o "oid" da última operação do journal já gravada nela
+JOURNAL_PROP_APLICADO = "journal_aplicado"
+
+
+def _mesclar_cadastro(atual: dict, dados: dict, agora: str) -> dict:
+    """Mesma regra do atualizar_excel_cadastro: preserva 'Criado em' e carimba 'Atualizado em'."""
+    novo = {}
+    for nome, valor in atual.items():
+        if nome == "Criado em":
+            novo[nome] = valor or dados.get("Criado em", "")
+        elif nome == "Atualizado em":
+            novo[nome] = agora
+        else:
+            novo[nome] = dados.get(nome, valor)
+    return novo
+
+
+class JournalLocal:
+    """Journal append-only das gravações offline: cada operação é uma linha JSON com fsync."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.RLock()
+        self._total: int | None = None  # operações no arquivo (contadas na 1ª gravação)
+
+    def tamanho(self) -> int:
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def _reparar_cauda(self):
+        """Corta uma última linha sem "\n" (queda no meio da escrita) para a próxima não colar nela."""
+        try:
+            f = open(self.path, "rb+")
+        except OSError:
+            return
+        with f:
+            fim = f.seek(0, os.SEEK_END)
+            if not fim:
+                return
+            f.seek(fim - 1)
+            if f.read(1) == b"\n":
+                return
+            pos = fim
+            while pos > 0:
+                bloco = min(65536, pos)
+                pos -= bloco
+                f.seek(pos)
+                i = f.read(bloco).rfind(b"\n")
+                if i >= 0:
+                    pos += i + 1
+                    break
+            f.truncate(pos)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def registrar(self, op: str, aba: str, **campos) -> int:
+        """Acrescenta uma operação e devolve quantas existem no journal."""
+        import json
+        import uuid
+        linha = json.dumps({"op": op, "aba": aba, "ts": data_hora_tokens()["combinado"], "oid": uuid.uuid4().hex, **campos},
+                           ensure_ascii=False, default=str)
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._reparar_cauda()
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(linha + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            if self._total is None:
+                self._total = len(self.entradas()[0])
+            else:
+                self._total += 1
+            return self._total
+
+    def entradas(self, inicio: int = 0) -> tuple[list[dict], int]:
+        """Operações a partir do byte `inicio` e o byte logo após a última linha completa lida.
+
+        Uma última linha incompleta (queda ou gravação em andamento) não é consumida: a posição
+        devolvida para antes dela, e a próxima leitura recomeça dali.
+        """
+        import json
+        out = []
+        fim = inicio
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(inicio)
+                for raw in f:
+                    if not raw.endswith(b"\n"):
+                        break
+                    fim += len(raw)
+                    try:
+                        out.append(json.loads(raw.decode("utf-8")))
+                    except ValueError:
+                        continue
+        except OSError:
+            pass
+        return out, fim
+
+    def posicao_apos(self, oid: str | None) -> int:
+        """Byte logo após a operação `oid` (0 se não estiver no journal)."""
+        import json
+        if not oid:
+            return 0
+        pos = 0
+        try:
+            with open(self.path, "rb") as f:
+                for raw in f:
+                    if not raw.endswith(b"\n"):
+                        break
+                    pos += len(raw)
+                    try:
+                        if json.loads(raw.decode("utf-8")).get("oid") == oid:
+                            return pos
+                    except ValueError:
+                        continue
+        except OSError:
+            pass
+        return 0
+
+    def limpar(self):
+        with self.lock:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            self._total = 0
+
+
+class _IndicePlanilha:
+    """Foto da planilha local (linhas como dicts) com os índices usados nas buscas offline."""
+
+    def __init__(self, wb=None):
+        self.cabecalhos: dict[str, list[str]] = {}
+        self.orcamentos: list[dict] = []
+        self.orc_por_id: dict[str, list[dict]] = {}
+        self.orc_por_doc: dict[str, list[dict]] = {}
+        self.cad_por_digitos: dict[str, dict] = {}
+        self.ultimo_pedido: dict[str, datetime] = {}
+        self.maior_pedido = 0
+        self._ids: list[str] = []  # 1ª coluna de Orçamentos, para os contadores por prefixo
+        self._prefixos: dict[str, int] = {}
+        self._idx_pedido = "Pedido"
+        if wb is None:
+            return
+
+        if ABA_ORCAMENTOS in wb.sheetnames:
+            ws = wb[ABA_ORCAMENTOS]
+            hmap = _header_map(ws)
+            self.cabecalhos[ABA_ORCAMENTOS] = list(hmap)
+            for row in ws.iter_rows(min_row=2, values_only=True):
+                self._add_orcamento({n: (row[i] if i < len(row) else None) for n, i in hmap.items()}, row[0] if row else None)
+
+        if ABA_CADASTROS in wb.sheetnames:
+            ws = wb[ABA_CADASTROS]
+            hmap = _header_map(ws)
+            self.cabecalhos[ABA_CADASTROS] = list(hmap)
+            col = hmap.get("CNPJ/CPF")
+            if col is not None:
+                for row in ws.iter_rows(min_row=2, values_only=True):
+                    v = row[col] if col < len(row) else None
+                    if v:
+                        # a última linha do documento vence (mesma regra da busca linear)
+                        self.cad_por_digitos[_digitos(v)] = {n: (row[i] if i < len(row) else None) for n, i in hmap.items()}
+
+        if ABA_PEDIDOS in wb.sheetnames:
+            ws = wb[ABA_PEDIDOS]
+            hmap = _header_map(ws)
+            self.cabecalhos[ABA_PEDIDOS] = list(hmap)
+            idx_ped = hmap.get("Pedido", 1)
+            idx_doc = hmap.get("CNPJ/CPF")
+            idx_dh = hmap.get("Data/Hora da criação do pedido")
+            for row in ws.iter_rows(min_row=2, values_only=True):
+                self._add_pedido(
+                    row[idx_ped] if idx_ped < len(row) else None,
+                    row[idx_doc] if idx_doc is not None and idx_doc < len(row) else None,
+                    row[idx_dh] if idx_dh is not None and idx_dh < len(row) else None,
+                )
+
+    def _add_orcamento(self, d: dict, id_col):
+        self.orcamentos.append(d)
+        self.orc_por_id.setdefault(str(d.get("ID Orçamento") or "").strip(), []).append(d)
+        self.orc_por_doc.setdefault(str(d.get("CNPJ/CPF") or "").strip(), []).append(d)
+        if id_col:
+            self._ids.append(str(id_col))
+            self._prefixos.clear()
+
+    def _add_pedido(self, numero, vdoc, vdh):
+        try:
+            self.maior_pedido = max(self.maior_pedido, int(str(numero).strip()))
+        except Exception:
+            pass
+        dt = _as_datetime(vdh)
+        if vdoc and dt:
+            chave = _digitos(vdoc)
+            if chave not in self.ultimo_pedido or dt > self.ultimo_pedido[chave]:
+                self.ultimo_pedido[chave] = dt
+
+    def linha_como_dict(self, aba: str, entrada: dict) -> dict:
+        """Dados de uma operação do journal no formato das linhas da aba."""
+        if entrada.get("valores") is not None:
+            cab = self.cabecalhos.get(aba) or []
+            vals = entrada["valores"]
+            return {n: (vals[i] if i < len(vals) else None) for i, n in enumerate(cab)}
+        return dict(entrada.get("dados") or {})
+
+    def aplicar(self, entrada: dict):
+        """Reflete nos índices uma operação do journal ainda não compactada."""
+        aba, op = entrada.get("aba"), entrada.get("op")
+        d = self.linha_como_dict(aba, entrada)
+        if aba == ABA_ORCAMENTOS and op == "append":
+            vals = entrada.get("valores")
+            self._add_orcamento(d, vals[0] if vals else d.get("ID Orçamento"))
+        elif aba == ABA_CADASTROS and op == "append":
+            if d.get("CNPJ/CPF"):
+                self.cad_por_digitos[_digitos(d["CNPJ/CPF"])] = d
+        elif aba == ABA_CADASTROS and op == "update":
+            atual = self.cad_por_digitos.get(entrada.get("doc") or "")
+            if atual is not None:
+                self.cad_por_digitos[entrada["doc"]] = _mesclar_cadastro(atual, d, entrada.get("agora") or entrada.get("ts") or "")
+        elif aba == ABA_PEDIDOS and op == "append":
+            self._add_pedido(d.get("Pedido"), d.get("CNPJ/CPF"), d.get("Data/Hora da criação do pedido"))
+
+    def contar_prefixo(self, prefixo: str) -> int:
+        n = self._prefixos.get(prefixo)
+        if n is None:
+            n = self._prefixos[prefixo] = sum(1 for i in self._ids if i.startswith(prefixo))
+        return n
+
+
+class PlanilhaLocal:
+    """Cache da planilha local (modo offline): lê o .xlsx uma vez e só recarrega quando mtime/tamanho mudam.
+
+    Operações do journal ainda não compactadas são aplicadas por cima, lendo só o trecho novo do arquivo.
+    """
+
+    def __init__(self, path: str, journal: JournalLocal | None = None):
+        self.path = path
+        self.journal = journal
+        self._lock = threading.Lock()
+        self._assinatura = None
+        self._indice: _IndicePlanilha | None = None
+        self._journal_pos = 0
+        self.cargas = 0
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def indice(self) -> _IndicePlanilha | None:
+        """Índices da versão atual do arquivo (+ journal), ou None se não há planilha nem journal."""
+        assinatura = self._stat()
+        jpos = self.journal.tamanho() if self.journal else 0
+        if assinatura is None and not jpos:
+            return None
+        if assinatura == self._assinatura and jpos == self._journal_pos and self._indice is not None:
+            return self._indice
+        with self._lock:
+            assinatura = self._stat()
+            if assinatura != self._assinatura or self._indice is None or jpos < self._journal_pos:
+                aplicado = None
+                if assinatura is not None:
+                    wb = load_wb_safe(self.path, read_only=True, data_only=True)
+                    try:
+                        indice = _IndicePlanilha(wb)
+                        aplicado = _journal_aplicado(wb)
+                    finally:
+                        wb.close()
+                else:
+                    indice = _IndicePlanilha()
+                # compactação interrompida antes de zerar o journal: o início dele já está na planilha
+                inicio = self.journal.posicao_apos(aplicado) if self.journal else 0
+                self._indice, self._assinatura, self._journal_pos = indice, assinatura, inicio
+                self.cargas += 1
+            if self.journal and self.journal.tamanho() > self._journal_pos:
+                # avança só até onde foi lido: o que for acrescentado depois entra na próxima chamada
+                novas, self._journal_pos = self.journal.entradas(self._journal_pos)
+                for e in novas:
+                    self._indice.aplicar(e)
+            return self._indice
+
+    def invalidar(self):
+        with self._lock:
+            self._indice = self._assinatura = None
+            self._journal_pos = 0
+
+
+def _journal_aplicado(wb) -> str | None:
+    prop = next((p for p in wb.custom_doc_props if p.name == JOURNAL_PROP_APLICADO), None)
+    return str(prop.value) if prop is not None and prop.value else None
+
+
+def _marcar_journal_aplicado(wb, oid: str):
+    from openpyxl.packaging.custom import StringProperty
+    for p in wb.custom_doc_props:
+        if p.name == JOURNAL_PROP_APLICADO:
+            p.value = oid
+            return
+    wb.custom_doc_props.append(StringProperty(name=JOURNAL_PROP_APLICADO, value=oid))
+
+
+_JOURNAL = JournalLocal(JOURNAL_FILE)
+_PLANILHA = PlanilhaLocal(EXCEL_FILE, _JOURNAL)
+
+
+def compactar_journal() -> int:
+    """Aplica o journal na planilha em uma única gravação (arquivo temporário + os.replace) e o zera.
+
+    A planilha gravada leva o "oid" da última operação aplicada: se o processo cair entre o
+    os.replace e a limpeza do journal, a próxima compactação pula o que já está nela.
+    Devolve quantas operações foram aplicadas; se a planilha estiver travada, o journal é mantido.
+    """
+    with _JOURNAL.lock:
+        if not _JOURNAL.tamanho():
+            return 0
+        if not os.path.exists(EXCEL_FILE):
+            init_excel()
+        wb = load_wb_safe(EXCEL_FILE)
+        entradas, _ = _JOURNAL.entradas(_JOURNAL.posicao_apos(_journal_aplicado(wb)))
+        if not entradas:
+            wb.close()
+            _JOURNAL.limpar()
+            _PLANILHA.invalidar()
+            return 0
+        linhas_cad = None
+        for e in entradas:
+            aba = e.get("aba")
+            if aba not in wb.sheetnames:
+                continue
+            ws = wb[aba]
+            hmap = _header_map(ws)
+            if e.get("op") == "append":
+                if e.get("valores") is not None:
+                    ws.append(e["valores"])
+                else:
+                    dados = e.get("dados") or {}
+                    ws.append([dados.get(h, "") for h in hmap.keys()])
+                if aba == ABA_CADASTROS and linhas_cad is not None and "CNPJ/CPF" in hmap:
+                    linhas_cad.setdefault(_digitos((e.get("dados") or {}).get("CNPJ/CPF")), ws.max_row)
+            elif e.get("op") == "update" and aba == ABA_CADASTROS and "CNPJ/CPF" in hmap:
+                if linhas_cad is None:
+                    # 1ª linha de cada documento, como na busca do atualizar_excel_cadastro
+                    linhas_cad = {}
+                    col = hmap["CNPJ/CPF"] + 1
+                    for r in range(2, ws.max_row + 1):
+                        val = ws.cell(row=r, column=col).value
+                        if val:
+                            linhas_cad.setdefault(_digitos(val), r)
+                alvo_row = linhas_cad.get(e.get("doc") or "")
+                if not alvo_row:
+                    continue
+                atual = {nome: ws.cell(row=alvo_row, column=i + 1).value for nome, i in hmap.items()}
+                novo = _mesclar_cadastro(atual, e.get("dados") or {}, e.get("agora") or e.get("ts") or "")
+                for nome, i in hmap.items():
+                    ws.cell(row=alvo_row, column=i + 1, value=novo[nome])
+        ultimo = next((e.get("oid") for e in reversed(entradas) if e.get("oid")), None)
+        if ultimo:
+            _marcar_journal_aplicado(wb, ultimo)
+        tmp = f"{EXCEL_FILE}.tmp"
+        wb.save(tmp)
+        wb.close()
+        os.replace(tmp, EXCEL_FILE)
+        _JOURNAL.limpar()
+        _PLANILHA.invalidar()
+        return len(entradas)
+
+
+def _registrar_offline(op: str, aba: str, **campos):
+    """Grava a operação no journal e compacta quando ele passa de JOURNAL_COMPACT_EVERY linhas."""
+    total = _JOURNAL.registrar(op, aba, **campos)
+    if JOURNAL_COMPACT_EVERY and total >= JOURNAL_COMPACT_EVERY:
+        try:
+            compactar_journal()
+        except Exception:
+            pass  # planilha aberta/travada: fica para a próxima compactação
+
+
+# Fila de saída (outbox): POSTs que falharam ficam num SQLite local e são reenviados em
+# segundo plano, com backoff, quando /api/info volta a responder
+OUTBOX_FILE = os.environ.get("ORC_OUTBOX_FILE") or safe_join(LOCAL_BASE, "outbox.sqlite3")
+OUTBOX_BACKOFF = float(os.environ.get("ORC_OUTBOX_BACKOFF", "2"))
+OUTBOX_BACKOFF_MAX = float(os.environ.get("ORC_OUTBOX_BACKOFF_MAX", "300"))
+OUTBOX_PING_TIMEOUT = float(os.environ.get("ORC_OUTBOX_PING_TIMEOUT", "3"))
+
+
+def _status_http(ex) -> int | None:
+    resp = getattr(ex, "response", None)
+    code = getattr(resp, "status_code", None) if resp is not None else getattr(ex, "code", None)
+    return code if isinstance(code, int) else None
+
+
+def _falha_de_conexao(ex) -> bool:
+    """True só quando o pedido não chegou ao servidor (conexão recusada, DNS, timeout de conexão/pool).
+
+    Timeout de leitura ou conexão caída depois do envio não contam: o servidor pode ter gravado.
+    """
+    import urllib.error
+    if isinstance(ex, urllib.error.URLError) and not isinstance(ex, urllib.error.HTTPError):
+        return True  # urllib: erro ao conectar/enviar; timeout de leitura vem como TimeoutError
+    try:
+        import requests  # type: ignore
+        from urllib3.exceptions import ClosedPoolError, ConnectTimeoutError, EmptyPoolError
+    except Exception:
+        return False
+    if isinstance(ex, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(ex, requests.exceptions.ConnectionError):
+        motivo = ex.args[0] if ex.args else None
+        motivo = getattr(motivo, "reason", motivo)  # MaxRetryError guarda a causa em .reason
+        return isinstance(motivo, (ConnectTimeoutError, EmptyPoolError, ClosedPoolError))
+    return False
+
+
+class OutboxLocal:
+    """Fila durável de POSTs pendentes para a API (uma linha por chave; a mais recente vence)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._acordar = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._ouvintes = []
+        self.offline = False  # True após falha de conexão, até a API responder de novo
+        self.ultimo_erro = ""
+        self._pendentes = None
+        self._migrado = False
+
+    def _conn(self):
+        import sqlite3
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute(
+            "create table if not exists outbox (chave text primary key, caminho text not null, payload text not null,"
+            " criado real not null, tentativas integer not null default 0, erro text, idem text)"
+        )
+        if not self._migrado:
+            # filas criadas antes da chave de idempotência
+            try:
+                conn.execute("alter table outbox add column idem text")
+            except sqlite3.OperationalError:
+                pass
+            self._migrado = True
+        return conn
+
+    def pendentes(self) -> int:
+        """Envios aguardando reenvio (os recusados pela API não contam)."""
+        if self._pendentes is None:
+            with self._lock:
+                conn = self._conn()
+                try:
+                    self._pendentes = conn.execute("select count(*) from outbox where erro is null").fetchone()[0]
+                finally:
+                    conn.close()
+        return self._pendentes
+
+    def ao_mudar(self, fn):
+        """Registra fn(pendentes, offline), chamada sempre que a fila muda."""
+        self._ouvintes.append(fn)
+
+    def _avisar(self):
+        for fn in list(self._ouvintes):
+            try:
+                fn(self.pendentes(), self.offline)
+            except Exception:
+                pass
+
+    def enfileirar(self, caminho: str, payload: dict, chave: str | None = None, idem: str | None = None):
+        """Guarda o POST para reenvio; `idem` vai como Idempotency-Key em todas as tentativas."""
+        import json
+        import time
+        import uuid
+        chave = f"{caminho}:{chave}" if chave else f"{caminho}:{uuid.uuid4().hex}"
+        vazia = not self.pendentes()
+        with self._lock:
+            conn = self._conn()
+            try:
+                with conn:
+                    # mesma chave (ID) substitui o payload anterior: só o último estado é enviado
+                    conn.execute(
+                        "insert into outbox (chave, caminho, payload, criado, idem) values (?, ?, ?, ?, ?)"
+                        " on conflict(chave) do update set payload = excluded.payload, idem = excluded.idem,"
+                        " tentativas = 0, erro = null",
+                        (chave, caminho, json.dumps(payload, ensure_ascii=False, default=str), time.time(),
+                         idem or uuid.uuid4().hex),
+                    )
+                self._pendentes = conn.execute("select count(*) from outbox where erro is null").fetchone()[0]
+            finally:
+                conn.close()
+        self.iniciar()
+        if vazia:
+            self._acordar.set()  # com a fila já em backoff, não antecipa a próxima tentativa
+        self._avisar()
+
+    def postar(self, caminho: str, payload: dict, chave: str | None = None) -> dict:
+        """api_post que, sem conexão, enfileira e devolve {'ok': True, 'enfileirado': True}.
+
+        Só falhas de conexão vão para a fila; as demais (4xx, 5xx, timeout de leitura, em que o
+        servidor pode ter gravado) continuam sendo levantadas. A mesma Idempotency-Key segue no
+        envio e nos reenvios, para a API não gravar duas vezes.
+        """
+        import uuid
+        idem = uuid.uuid4().hex
+        if not self.offline:
+            try:
+                return api_post(caminho, payload, headers={"Idempotency-Key": idem})
+            except Exception as ex:
+                if not _falha_de_conexao(ex):
+                    raise
+                self.offline = True
+                self.ultimo_erro = str(ex)
+        self.enfileirar(caminho, payload, chave, idem=idem)
+        return {"ok": True, "enfileirado": True, "fallback": self.ultimo_erro}
+
+    def reenviar(self) -> bool:
+        """Envia a fila em ordem de chegada; devolve True se ela esvaziou."""
+        import json
+        try:
+            api_client().get_json("/api/info", timeout=OUTBOX_PING_TIMEOUT)
+        except Exception as ex:
+            self.offline, self.ultimo_erro = True, str(ex)
+            self._avisar()
+            return False
+        self.offline = False
+        with self._lock:
+            conn = self._conn()
+            try:
+                itens = conn.execute("select chave, caminho, payload, idem from outbox where erro is null order by criado").fetchall()
+            finally:
+                conn.close()
+        esvaziou = True
+        for chave, caminho, payload, idem in itens:
+            erro = None
+            try:
+                api_post(caminho, json.loads(payload), headers={"Idempotency-Key": idem or chave})
+            except Exception as ex:
+                status = _status_http(ex)
+                if status is None or status >= 500:
+                    # sem resposta ou 5xx: tenta de novo depois com a mesma chave (a API ignora repetidos)
+                    self.offline, self.ultimo_erro = _falha_de_conexao(ex), str(ex)
+                    esvaziou = False
+                    break
+                erro = f"HTTP {status}: {ex}"  # recusado: fica guardado, mas não é reenviado
+            with self._lock:
+                conn = self._conn()
+                try:
+                    with conn:
+                        if erro:
+                            conn.execute("update outbox set erro = ?, tentativas = tentativas + 1 where chave = ?", (erro, chave))
+                        else:
+                            conn.execute("delete from outbox where chave = ?", (chave,))
+                    self._pendentes = conn.execute("select count(*) from outbox where erro is null").fetchone()[0]
+                finally:
+                    conn.close()
+            self._avisar()
+        return esvaziou
+
+    def _loop(self):
+        import random
+        espera = OUTBOX_BACKOFF
+        while True:
+            if self.pendentes() and self.reenviar():
+                espera = OUTBOX_BACKOFF
+            elif self.pendentes():
+                espera = min(OUTBOX_BACKOFF_MAX, espera * 2)
+            # sem pendências dorme até o próximo enfileirar(); com falha, backoff com jitter
+            self._acordar.wait(random.uniform(espera / 2, espera) if self.pendentes() else None)
+            self._acordar.clear()
+
+    def iniciar(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._loop, name="outbox", daemon=True)
+            self._thread.start()
+
+
+_OUTBOX = OutboxLocal(OUTBOX_FILE)
+
+
 def salvar_excel_orcamento(dados):
     # Agora salva via API/DB. Mantemos a assinatura para mínimo impacto.
     try:
@@ -609,64 +1338,38 @@ def salvar_excel_orcamento(dados):
             "unidade": str(dados.get("Unidade") or ""),
             "quantidade": str(dados.get("Quantidade") or ""),
         }
-        return api_post("/api/orcamentos", body)
+        # sem conexão, o POST vai para a outbox e é reenviado em segundo plano
+        res = _OUTBOX.postar("/api/orcamentos", body, chave=str(dados.get("ID Orçamento") or "") or None)
     except Exception as ex:
-        # Como fallback (somente para desenvolvimento), ainda tenta local
-        wb = load_wb_safe(EXCEL_FILE)
-        ws = wb[ABA_ORCAMENTOS]
+        res = {"ok": True, "fallback": str(ex)}
+    if "fallback" in res:
+        # cópia no journal local para as buscas offline
         if isinstance(dados, dict):
-            hmap = _header_map(ws)
-            row = [dados.get(h, "") for h in hmap.keys()]
-            ws.append(row)
+            _registrar_offline("append", ABA_ORCAMENTOS, dados=dict(dados))
         else:
-            ws.append(dados)
-        wb.save(EXCEL_FILE)
-        return {"ok": True, "fallback": str(ex)}
+            _registrar_offline("append", ABA_ORCAMENTOS, valores=list(dados))
+    return res
 
 def salvar_excel_cadastro(dados_dict):
     try:
-        return api_post("/api/cadastros", dict(dados_dict))
+        res = _OUTBOX.postar("/api/cadastros", dict(dados_dict), chave=_digitos(dados_dict.get("CNPJ/CPF")) or None)
     except Exception as ex:
-        wb = load_wb_safe(EXCEL_FILE)
-        ws = wb[ABA_CADASTROS]
-        hmap = _header_map(ws)
+        res = {"ok": True, "fallback": str(ex)}
+    if "fallback" in res:
         agora = data_hora_tokens()["combinado"]
         dados = dict(dados_dict)
         dados.setdefault("Criado em", agora)
         dados["Atualizado em"] = agora
-        row = [dados.get(h, "") for h in hmap.keys()]
-        ws.append(row)
-        wb.save(EXCEL_FILE)
-        return {"ok": True, "fallback": str(ex)}
+        _registrar_offline("append", ABA_CADASTROS, dados=dados)
+    return res
 
 def atualizar_excel_cadastro(doc_formatado: str, dados_dict: dict) -> bool:
-    wb = load_wb_safe(EXCEL_FILE)
-    ws = wb[ABA_CADASTROS]
-    hmap = _header_map(ws)
-    if "CNPJ/CPF" not in hmap:
-        wb.close()
+    indice = _PLANILHA.indice()
+    alvo_digits = _digitos(doc_formatado)
+    if indice is None or alvo_digits not in indice.cad_por_digitos:
         return False
-    col_doc = hmap["CNPJ/CPF"] + 1
-    alvo_row, alvo_digits = None, re.sub(r"\D", "", doc_formatado or "")
-    for r in range(2, ws.max_row + 1):
-        val = ws.cell(row=r, column=col_doc).value
-        if val and re.sub(r"\D", "", str(val)) == alvo_digits:
-            alvo_row = r
-            break
-    if not alvo_row:
-        wb.close()
-        return False
-    criado_col = hmap.get("Criado em")
-    criado_atual = ws.cell(row=alvo_row, column=criado_col + 1).value if criado_col is not None else ""
-    agora = data_hora_tokens()["combinado"]
-    for nome, idx0 in hmap.items():
-        if nome == "Criado em":
-            ws.cell(row=alvo_row, column=idx0 + 1, value=criado_atual or dados_dict.get("Criado em", ""))
-        elif nome == "Atualizado em":
-            ws.cell(row=alvo_row, column=idx0 + 1, value=agora)
-        else:
-            ws.cell(row=alvo_row, column=idx0 + 1, value=dados_dict.get(nome, ws.cell(row=alvo_row, column=idx0 + 1).value))
-    wb.save(EXCEL_FILE)
+    _registrar_offline("update", ABA_CADASTROS, doc=alvo_digits, dados=dict(dados_dict),
+                       agora=data_hora_tokens()["combinado"])
     return True
 
 def buscar_cadastro_por_documento(tipo: str, valor_digitado: str) -> dict | None:
@@ -679,32 +1382,43 @@ def buscar_cadastro_por_documento(tipo: str, valor_digitado: str) -> dict | None
             return rows[0]
     except Exception:
         pass
-    # Fallback Excel local, se existir
-    if not os.path.exists(EXCEL_FILE):
-        return None
+    # Fallback Excel local (índice em memória), se existir
     try:
-        wb = load_wb_safe(EXCEL_FILE, read_only=True, data_only=True)
-        if ABA_CADASTROS not in wb.sheetnames:
-            wb.close()
+        indice = _PLANILHA.indice()
+        if indice is None:
             return None
-        ws = wb[ABA_CADASTROS]
-        hmap = _header_map(ws)
-        if "CNPJ/CPF" not in hmap:
-            wb.close()
-            return None
-        alvo = re.sub(r"\D", "", formatar_doc(tipo, valor_digitado))
-        col = hmap["CNPJ/CPF"]
-        ultimo = None
-        for row in ws.iter_rows(min_row=2, values_only=True):
-            v = row[col] if col < len(row) else None
-            if v and re.sub(r"\D", "", str(v)) == alvo:
-                d = {n: (row[i] if i < len(row) else None) for n, i in hmap.items()}
-                ultimo = d
-        wb.close()
-        return ultimo
+        cad = indice.cad_por_digitos.get(_digitos(formatar_doc(tipo, valor_digitado)))
+        return dict(cad) if cad is not None else None
     except Exception:
         return None
 
+LOOKUP_DOCS_POR_REQUEST = 1000  # documentos por POST /api/cadastros/lookup
+
+
+def buscar_cadastros_por_documentos(documentos) -> dict[str, dict]:
+    """Cadastros de vários documentos de uma vez (chave = dígitos): API em lote, depois o índice local."""
+    faltam = sorted({_digitos(d) for d in documentos} - {""})
+    out: dict[str, dict] = {}
+    if faltam and not _OUTBOX.offline:
+        try:
+            for i in range(0, len(faltam), LOOKUP_DOCS_POR_REQUEST):
+                resp = api_post("/api/cadastros/lookup", {"documentos": faltam[i:i + LOOKUP_DOCS_POR_REQUEST]})
+                out.update(resp.get("cadastros") or {})
+        except Exception:
+            pass  # sem API: o que faltou vem da planilha local
+    faltam = [d for d in faltam if d not in out]
+    if faltam:
+        try:
+            indice = _PLANILHA.indice()
+        except Exception:
+            indice = None
+        if indice is not None:
+            for d in faltam:
+                cad = indice.cad_por_digitos.get(d)
+                if cad is not None:
+                    out[d] = dict(cad)
+    return out
+
 def get_orcamento_by_id(id_orc: str) -> dict | None:
     # API primeiro
     try:
@@ -715,37 +1429,39 @@ def get_orcamento_by_id(id_orc: str) -> dict | None:
     except Exception:
         pass
     # Fallback Excel
-    if not os.path.exists(EXCEL_FILE):
-        return None
-    wb = load_wb_safe(EXCEL_FILE, read_only=True, data_only=True)
-    if ABA_ORCAMENTOS not in wb.sheetnames:
-        wb.close()
-        return None
-    ws = wb[ABA_ORCAMENTOS]
-    hmap = _header_map(ws)
-    for row in ws.iter_rows(min_row=2, values_only=True):
-        d = {n: (row[i] if i < len(row) else None) for n, i in hmap.items()}
-        if str(d.get("ID Orçamento") or "").strip() == (id_orc or "").strip():
-            wb.close()
-            return d
-    wb.close()
-    return None
+    indice = _PLANILHA.indice()
+    linhas = indice.orc_por_id.get((id_orc or "").strip()) if indice else None
+    return dict(linhas[0]) if linhas else None
 
 def get_orcamentos_list(doc_formatado: str | None = None, id_orc: str | None = None) -> list[dict]:
-    # Primeiro tenta pela API (já no formato de labels)
-    try:
-        params = []
-        if id_orc:
-            params.append(f"id={urllib.parse.quote(id_orc)}")
-        if doc_formatado:
-            params.append(f"cnpj={re.sub(r'\\D','', doc_formatado)}")
-        q = ("?" + "&".join(params)) if params else ""
-        resp = api_get(f"/api/orcamentos{q}")
-        rows = resp.get("rows") or []
-        if rows:
-            return rows
-    except Exception:
-        pass
+    """Primeira página (LIST_PAGE_SIZE linhas) da listagem de orçamentos."""
+    return get_orcamentos_pagina(doc_formatado=doc_formatado, id_orc=id_orc)[0]
+
+
+def get_orcamentos_pagina(doc_formatado: str | None = None, id_orc: str | None = None, cursor: str | None = None) -> tuple[list[dict], str | None]:
+    """Uma página de orçamentos e o cursor da próxima (None quando acabou).
+
+    Cursores "local:<n>" vêm do fallback na planilha local; os demais são da API.
+    """
+    if not (cursor or "").startswith("local:"):
+        # Primeiro tenta pela API (já no formato de labels), uma página por chamada
+        try:
+            params = [f"limit={LIST_PAGE_SIZE}"]
+            if id_orc:
+                params.append(f"id={urllib.parse.quote(id_orc)}")
+            if doc_formatado:
+                params.append(f"cnpj={_digitos(doc_formatado)}")
+            if cursor:
+                params.append(f"cursor={urllib.parse.quote(cursor)}")
+            r = api_get("/api/orcamentos?" + "&".join(params))
+            if isinstance(r, dict) and (r.get("rows") or cursor):
+                return list(r.get("rows") or []), r.get("next_cursor")
+            if isinstance(r, list) and r:
+                return r, None
+        except Exception:
+            if cursor:
+                return [], None
+    inicio = int((cursor or "local:0").split(":", 1)[1] or 0)
     out = []
     def _looks_currency_ptbr(s: str) -> bool:
         t = (s or "").strip()
@@ -753,14 +1469,14 @@ def get_orcamentos_list(doc_formatado: str | None = None, id_orc: str | None = N
     def _looks_number_ptbr(s: str) -> bool:
         t = (s or "").strip()
         return bool(re.match(r"^\d{1,3}(?:\.\d{3})*,\d{1,3}$", t))
-    def _normalize_row(d: dict) -> dict:
+    def _nome_corrompido(d: dict) -> bool:
+        nome_cli = extrair_nome_CLIENTE(d)
+        return not nome_cli or _looks_currency_ptbr(str(nome_cli))
+    def _normalize_row(d: dict, cadastros: dict) -> dict:
         outd = dict(d)
         # Nome do CLIENTE pode ter sido corrompido por gravação antiga; tenta recuperar pelo cadastro
-        nome_cli = extrair_nome_CLIENTE(outd)
-        if not nome_cli or _looks_currency_ptbr(str(nome_cli)):
-            doc_tipo = str(outd.get("Documento") or "")
-            doc_val = str(outd.get("CNPJ/CPF") or "")
-            cad = buscar_cadastro_por_documento(doc_tipo, doc_val) or {}
+        if _nome_corrompido(outd):
+            cad = cadastros.get(_digitos(outd.get("CNPJ/CPF"))) or {}
             nome_corrigido = extrair_nome_CLIENTE(cad)
             if nome_corrigido:
                 outd["CLIENTE (Valor)"] = nome_corrigido
@@ -796,23 +1512,25 @@ def get_orcamentos_list(doc_formatado: str | None = None, id_orc: str | None = N
                 outd["Valor Total"] = format_num_ptbr(metros_num * preco_num)
 
         return outd
-    if not os.path.exists(EXCEL_FILE):
-        return out
-    wb = load_wb_safe(EXCEL_FILE, read_only=True, data_only=True)
-    if ABA_ORCAMENTOS not in wb.sheetnames:
-        wb.close()
-        return out
-    ws = wb[ABA_ORCAMENTOS]
-    hmap = _header_map(ws)
-    for row in ws.iter_rows(min_row=2, values_only=True):
-        d = {n: (row[i] if i < len(row) else None) for n, i in hmap.items()}
-        if id_orc and str(d.get("ID Orçamento") or "").strip() != id_orc.strip():
-            continue
-        if doc_formatado and str(d.get("CNPJ/CPF") or "").strip() != doc_formatado.strip():
-            continue
-        out.append(_normalize_row(d))
-    wb.close()
-    return out
+    indice = _PLANILHA.indice()
+    if indice is None:
+        return out, None
+    if id_orc:
+        linhas = indice.orc_por_id.get(id_orc.strip(), [])
+        if doc_formatado:
+            linhas = [d for d in linhas if str(d.get("CNPJ/CPF") or "").strip() == doc_formatado.strip()]
+    elif doc_formatado:
+        linhas = indice.orc_por_doc.get(doc_formatado.strip(), [])
+    else:
+        linhas = indice.orcamentos
+    fim = inicio + LIST_PAGE_SIZE
+    proximo = f"local:{fim}" if fim < len(linhas) else None
+    linhas = linhas[inicio:fim]
+    # cadastros dos nomes a corrigir resolvidos de uma vez, não um por linha
+    cadastros = buscar_cadastros_por_documentos(d.get("CNPJ/CPF") for d in linhas if _nome_corrompido(d))
+    for d in linhas:
+        out.append(_normalize_row(d, cadastros))
+    return out, proximo
 
 def _parse_datetime_ptbr(txt: str) -> datetime | None:
     try:
@@ -823,7 +1541,8 @@ def _parse_datetime_ptbr(txt: str) -> datetime | None:
 def get_ultimo_pedido_data(doc_formatado: str) -> datetime | None:
     try:
         digits = re.sub(r"\D", "", doc_formatado or "")
-        resp = api_get(f"/api/pedidos?cnpj={digits}")
+        # A API ordena do mais recente para o mais antigo: basta a primeira linha
+        resp = api_get(f"/api/pedidos?cnpj={digits}&limit=1")
         rows = resp.get("rows") or []
         def parse_row(r):
             txt = r.get("Data/Hora da criação do pedido") or r.get("data_hora_criacao") or ""
@@ -835,31 +1554,9 @@ def get_ultimo_pedido_data(doc_formatado: str) -> datetime | None:
         return max(dts) if dts else None
     except Exception:
         pass
-    if not os.path.exists(EXCEL_FILE):
-        return None
     try:
-        wb = load_wb_safe(EXCEL_FILE, read_only=True, data_only=True)
-        if ABA_PEDIDOS not in wb.sheetnames:
-            wb.close()
-            return None
-        ws = wb[ABA_PEDIDOS]
-        hmap = _header_map(ws)
-        idx_doc = hmap.get("CNPJ/CPF")
-        idx_dh = hmap.get("Data/Hora da criação do pedido")
-        if idx_doc is None or idx_dh is None:
-            wb.close()
-            return None
-        alvo = re.sub(r"\D", "", doc_formatado or "")
-        ultimo = None
-        for row in ws.iter_rows(min_row=2, values_only=True):
-            vdoc = row[idx_doc] if idx_doc < len(row) else None
-            vdh = row[idx_dh] if idx_dh < len(row) else None
-            if vdoc and re.sub(r"\D", "", str(vdoc)) == alvo:
-                d = _parse_datetime_ptbr(str(vdh)) if isinstance(vdh, str) else (vdh if isinstance(vdh, datetime) else None)
-                if d and (ultimo is None or d > ultimo):
-                    ultimo = d
-        wb.close()
-        return ultimo
+        indice = _PLANILHA.indice()
+        return indice.ultimo_pedido.get(_digitos(doc_formatado)) if indice else None
     except Exception:
         return None
 
@@ -888,19 +1585,8 @@ def get_proximo_sequencial(sigla: str) -> int:
         return 1
     except Exception:
         pass
-    if not os.path.exists(EXCEL_FILE):
-        return 1
-    wb = load_wb_safe(EXCEL_FILE, read_only=True, data_only=True)
-    if ABA_ORCAMENTOS not in wb.sheetnames:
-        wb.close()
-        return 1
-    ws = wb[ABA_ORCAMENTOS]
-    cont = 0
-    for row in ws.iter_rows(min_row=2, values_only=True):
-        if row[0] and str(row[0]).startswith(f"OR-{sigla}"):
-            cont += 1
-    wb.close()
-    return cont + 1
+    indice = _PLANILHA.indice()
+    return (indice.contar_prefixo(f"OR-{sigla}") if indice else 0) + 1
 
 def gerar_id(tipo_servico: str) -> str:
     if not tipo_servico:
@@ -915,8 +1601,12 @@ def gerar_id(tipo_servico: str) -> str:
 def get_proximo_pedido_numero() -> int:
     """Pega o MAIOR valor de 'Pedido' via API; fallback Excel."""
     try:
-        resp = api_get("/api/pedidos")
-        rows = resp.get("rows") or []
+        return int(api_get("/api/pedidos/proximo-numero")["numero"])
+    except Exception:
+        pass
+    try:
+        # servidor sem o endpoint: percorre todas as páginas (a listagem é limitada por página)
+        rows = api_get_paginado("/api/pedidos")
         maior = 0
         for r in rows:
             try:
@@ -928,38 +1618,18 @@ def get_proximo_pedido_numero() -> int:
         return maior + 1
     except Exception:
         pass
-    if not os.path.exists(EXCEL_FILE):
-        return 1
-    wb = load_workbook(EXCEL_FILE, read_only=True, data_only=True)
-    if ABA_PEDIDOS not in wb.sheetnames:
-        wb.close()
-        return 1
-    ws = wb[ABA_PEDIDOS]
-    hmap = _header_map(ws)
-    idx = hmap.get("Pedido", 1)
-    maior = 0
-    for row in ws.iter_rows(min_row=2, values_only=True):
-        val = row[idx] if idx < len(row) else None
-        try:
-            n = int(str(val).strip())
-            if n > maior:
-                maior = n
-        except Exception:
-            pass
-    wb.close()
-    return maior + 1
+    indice = _PLANILHA.indice()
+    return (indice.maior_pedido if indice else 0) + 1
 
 def salvar_excel_pedido(dados_dict):
     try:
-        return api_post("/api/pedidos", dict(dados_dict))
+        chave = str(dados_dict.get("ID") or dados_dict.get("Pedido") or "") or None
+        res = _OUTBOX.postar("/api/pedidos", dict(dados_dict), chave=chave)
     except Exception as ex:
-        wb = load_wb_safe(EXCEL_FILE)
-        ws = wb[ABA_PEDIDOS]
-        hmap = _header_map(ws)
-        row = [dados_dict.get(h, "") for h in hmap.keys()]
-        ws.append(row)
-        wb.save(EXCEL_FILE)
-        return {"ok": True, "fallback": str(ex)}
+        res = {"ok": True, "fallback": str(ex)}
+    if "fallback" in res:
+        _registrar_offline("append", ABA_PEDIDOS, dados=dict(dados_dict))
+    return res
 
 # =========================================================
 #                         PDF Orçamento
@@ -1347,6 +2017,21 @@ def main(page: ft.Page):
     # NAV
     resultado_global = ft.Text("", size=14, weight="bold")
 
+    # Envios pendentes na outbox (gravados sem conexão, reenviados em segundo plano)
+    outbox_txt = ft.Text("", size=12, color="orange")
+
+    def _outbox_mudou(pendentes: int, offline: bool):
+        outbox_txt.value = (f"{pendentes} envio(s) pendente(s)" + (" - sem conexão" if offline else "")) if pendentes else ""
+        try:
+            page.update()
+        except Exception:
+            pass
+
+    _OUTBOX.ao_mudar(_outbox_mudou)
+    _outbox_mudou(_OUTBOX.pendentes(), _OUTBOX.offline)
+    if _OUTBOX.pendentes():
+        _OUTBOX.iniciar()
+
     # ===== Login simples =====
     current_user = {"usuario": None, "nome": None, "is_admin": False, "permissoes": "*"}
     login_user = ft.TextField(label="Usuário", width=200)
@@ -1459,6 +2144,7 @@ def main(page: ft.Page):
             ft.ElevatedButton("Gerar Contrato", on_click=show_contrato, style=pill),
             ft.ElevatedButton("Relatórios", on_click=show_relatorios, style=pill),
             ft.ElevatedButton("Usuários", on_click=show_usuarios, style=pill),
+            outbox_txt,
         ],
         spacing=12,
     )
@@ -1674,7 +2360,7 @@ def main(page: ft.Page):
         resultado_orc.value = "Orçamento carregado para reImpressão."
         page.update()
 
-    def _render_tabela_generica(lista, on_select):
+    def _render_tabela_generica(lista, on_select, on_mais=None):
         orc_tab_container.controls.clear()
         if not lista:
             orc_tab_container.visible = False
@@ -1717,9 +2403,26 @@ def main(page: ft.Page):
             )
         tabela = ft.DataTable(columns=cols, rows=rows, heading_row_height=32, data_row_min_height=32)
         orc_tab_container.controls.append(tabela)
+        if on_mais:
+            orc_tab_container.controls.append(ft.ElevatedButton("Carregar mais", on_click=on_mais, style=pill))
         orc_tab_container.visible = True
         page.update()
 
+    # páginas já carregadas da busca atual; as seguintes só vêm em "Carregar mais"
+    orc_busca_ref = {"filtros": {}, "linhas": [], "cursor": None}
+
+    def _mostrar_busca_orc():
+        _render_tabela_generica(
+            orc_busca_ref["linhas"],
+            on_select=_fill_orc_form_from_dict,
+            on_mais=carregar_mais_orc if orc_busca_ref["cursor"] else None,
+        )
+
+    def carregar_mais_orc(e):
+        rows, orc_busca_ref["cursor"] = get_orcamentos_pagina(cursor=orc_busca_ref["cursor"], **orc_busca_ref["filtros"])
+        orc_busca_ref["linhas"].extend(rows)
+        _mostrar_busca_orc()
+
     def buscar_orcamentos(e):
         idf = (orc_busca_id.value or "").strip()
         docf = None
@@ -1731,8 +2434,9 @@ def main(page: ft.Page):
                 page.update()
                 return
             docf = formatar_doc(orc_busca_doc_tipo.value, orc_busca_doc.value or "")
-        lista = get_orcamentos_list(doc_formatado=docf, id_orc=idf) if (idf or docf) else get_orcamentos_list()
-        _render_tabela_generica(lista, on_select=_fill_orc_form_from_dict)
+        orc_busca_ref["filtros"] = {"doc_formatado": docf, "id_orc": idf or None}
+        orc_busca_ref["linhas"], orc_busca_ref["cursor"] = get_orcamentos_pagina(**orc_busca_ref["filtros"])
+        _mostrar_busca_orc()
 
     def limpar_busca_orc(e):
         for c in [orc_busca_id, orc_busca_doc, resultado_orc]:
@@ -2563,7 +3267,7 @@ def main(page: ft.Page):
         contrato_result.value = f"ID selecionado: {selecionado_id_ref['id']}"
         page.update()
 
-    def _render_tabela_contrato(lista: list[dict]):
+    def _render_tabela_contrato(lista: list[dict], on_mais=None):
         tabela_container.controls.clear()
         if not lista:
             tabela_container.visible = False
@@ -2619,9 +3323,27 @@ def main(page: ft.Page):
             )
         tabela = ft.DataTable(columns=cols, rows=rows, heading_row_height=32, data_row_min_height=32)
         tabela_container.controls.append(tabela)
+        if on_mais:
+            tabela_container.controls.append(ft.ElevatedButton("Carregar mais", on_click=on_mais, style=pill))
         tabela_container.visible = True
         page.update()
 
+    contrato_busca_ref = {"filtros": {}, "linhas": [], "cursor": None}
+
+    def _mostrar_busca_contrato():
+        n = len(contrato_busca_ref["linhas"])
+        mais = " (há mais)" if contrato_busca_ref["cursor"] else ""
+        contrato_result.value = f"{n} Orçamento(s) encontrados{mais}."
+        _render_tabela_contrato(
+            contrato_busca_ref["linhas"],
+            on_mais=carregar_mais_contrato if contrato_busca_ref["cursor"] else None,
+        )
+
+    def carregar_mais_contrato(e):
+        rows, contrato_busca_ref["cursor"] = get_orcamentos_pagina(cursor=contrato_busca_ref["cursor"], **contrato_busca_ref["filtros"])
+        contrato_busca_ref["linhas"].extend(rows)
+        _mostrar_busca_contrato()
+
     def buscar_por_campos(e):
         selecionado_id_ref["id"] = ""
         contrato_result.value = ""
@@ -2635,9 +3357,9 @@ def main(page: ft.Page):
                 page.update()
                 return
             docf = formatar_doc(contrato_doc_tipo.value, contrato_doc.value or "")
-        lista = get_orcamentos_list() if not (idf or docf) else get_orcamentos_list(doc_formatado=docf, id_orc=idf)
-        contrato_result.value = f"{len(lista)} Orçamento(s) encontrados."
-        _render_tabela_contrato(lista)
+        contrato_busca_ref["filtros"] = {"doc_formatado": docf, "id_orc": idf or None}
+        contrato_busca_ref["linhas"], contrato_busca_ref["cursor"] = get_orcamentos_pagina(**contrato_busca_ref["filtros"])
+        _mostrar_busca_contrato()
 
     def limpar_pesquisa(e):
         selecionado_id_ref["id"] = ""
@@ -2824,66 +3546,61 @@ def main(page: ft.Page):
     )
 
     # ===================== Relatórios =====================
-    def _fetch_all(endpoint: str) -> list[dict]:
+    def _fetch_all(endpoint: str, page_size: int = 1000) -> list[dict]:
+        # Percorre as páginas (next_cursor) em vez de pedir a tabela inteira de uma vez
         try:
-            r = api_get(endpoint)
-            if isinstance(r, dict) and "rows" in r:
-                return r.get("rows") or []
-            if isinstance(r, list):
-                return r
+            return api_get_paginado(endpoint, page_size=page_size)
         except Exception:
-            pass
-        return []
+            return []
 
     def _exportar_para_excel(pasta: str):
-        try:
-            from openpyxl import Workbook
-        except Exception as ex:
-            resultado_global.value = f"openpyxl não disponível: {ex}"
-            page.update(); return
-        orcs = _fetch_all('/api/orcamentos')
-        cads = _fetch_all('/api/cadastros')
-        peds = _fetch_all('/api/pedidos')
-        wb = Workbook(); ws = wb.active; ws.title = 'Orcamentos'
-        if orcs:
-            cols = list(orcs[0].keys()); ws.append(cols)
-            for r in orcs: ws.append([r.get(k, '') for k in cols])
-        ws2 = wb.create_sheet('Cadastros')
-        if cads:
-            cols = list(cads[0].keys()); ws2.append(cols)
-            for r in cads: ws2.append([r.get(k, '') for k in cols])
-        ws3 = wb.create_sheet('Pedidos')
-        if peds:
-            cols = list(peds[0].keys()); ws3.append(cols)
-            for r in peds: ws3.append([r.get(k, '') for k in cols])
-        nome = os.path.join(pasta, f"Relatorios_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx")
-        wb.save(nome)
-        resultado_global.value = f"Relatório gerado: {nome}"
-        page.update()
+        _exportar_por_tipo(pasta, 'Tudo')
 
     _dlg_rel = ft.FilePicker(on_result=lambda d: (_exportar_para_excel(d.path) if d.path else None))
     page.overlay.append(_dlg_rel)
 
     rel_tipo = ft.Dropdown(label='Tipo', options=[ft.dropdown.Option('Tudo'), ft.dropdown.Option('Orçamentos'), ft.dropdown.Option('Cadastros'), ft.dropdown.Option('Pedidos')], value='Tudo', width=200)
 
+    def _escrever_aba(ws, entidade: str):
+        # Lê /api/export em streaming e grava linha a linha (memória constante);
+        # servidores sem o endpoint caem na listagem paginada.
+        try:
+            rows = api_stream_ndjson(f'/api/export/{entidade}?format=ndjson')
+            first = next(rows, None)
+        except Exception:
+            rows, first = None, None
+        if rows is None:
+            todas = _fetch_all(f'/api/{entidade}')
+            rows, first = iter(todas[1:]), (todas[0] if todas else None)
+        if first is None:
+            return
+        cols = list(first.keys()); ws.append(cols)
+        ws.append([first.get(k, '') for k in cols])
+        for r in rows:
+            ws.append([r.get(k, '') for k in cols])
+
     def _exportar_por_tipo(pasta: str, tipo: str):
+        nome = os.path.join(pasta, f"Relatorio_{tipo}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx")
+        # Preferência: planilha montada no servidor (só o arquivo final trafega pela rede)
+        try:
+            api_download(f"/api/relatorios.xlsx?tipo={urllib.parse.quote(tipo)}", nome)
+            resultado_global.value = f"Relatório gerado: {nome}"; page.update()
+            return
+        except Exception:
+            pass
         try:
             from openpyxl import Workbook
         except Exception as ex:
             resultado_global.value = f"openpyxl não disponível: {ex}"; page.update(); return
-        wb = Workbook();
+        wb = Workbook(write_only=True)
         if tipo in ('Tudo','Orçamentos'):
-            orcs = _fetch_all('/api/orcamentos'); ws = wb.active; ws.title = 'Orcamentos'
-            if orcs: cols=list(orcs[0].keys()); ws.append(cols); [ws.append([r.get(k,'') for k in cols]) for r in orcs]
-        else:
-            wb.active.title='Plan1'
+            _escrever_aba(wb.create_sheet('Orcamentos'), 'orcamentos')
         if tipo in ('Tudo','Cadastros'):
-            cads = _fetch_all('/api/cadastros'); ws2 = wb.create_sheet('Cadastros')
-            if cads: cols=list(cads[0].keys()); ws2.append(cols); [ws2.append([r.get(k,'') for k in cols]) for r in cads]
+            _escrever_aba(wb.create_sheet('Cadastros'), 'cadastros')
         if tipo in ('Tudo','Pedidos'):
-            peds = _fetch_all('/api/pedidos'); ws3 = wb.create_sheet('Pedidos')
-            if peds: cols=list(peds[0].keys()); ws3.append(cols); [ws3.append([r.get(k,'') for k in cols]) for r in peds]
-        nome = os.path.join(pasta, f"Relatorio_{tipo}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx")
+            _escrever_aba(wb.create_sheet('Pedidos'), 'pedidos')
+        if not wb.worksheets:
+            wb.create_sheet('Plan1')
         wb.save(nome)
         resultado_global.value = f"Relatório gerado: {nome}"; page.update()
 
@@ -3073,4 +3790,8 @@ def main(page: ft.Page):
 # =========================================================
 if __name__ == "__main__":
     init_excel()
+    try:
+        compactar_journal()
+    except Exception:
+        pass
     ft.app(target=main)
\ No newline at end of file
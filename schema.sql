@@ -16,9 +16,12 @@ create table if not exists orcamentos (
   metros text,
   preco_por_metro text,
   forma_pagamento text,
-  valor_total text
+  valor_total text,
+  data_hora_ts timestamp,
+  cnpj_digits text
 );
-create index if not exists idx_orc_cnpj on orcamentos((regexp_replace(cnpj_cpf,'\D','','g')));
+create index if not exists idx_orc_digits on orcamentos(cnpj_digits);
+create index if not exists idx_orc_ts on orcamentos(data_hora_ts);
 
 create table if not exists cadastros (
   cnpj_cpf text primary key,
@@ -48,9 +51,12 @@ create table if not exists cadastros (
   telefone2 text,
   vendedor text,
   criado_em text,
-  atualizado_em text
+  atualizado_em text,
+  atualizado_ts timestamp,
+  cnpj_digits text
 );
-create index if not exists idx_cad_cnpj on cadastros((regexp_replace(cnpj_cpf,'\D','','g')));
+create index if not exists idx_cad_digits on cadastros(cnpj_digits);
+create index if not exists idx_cad_ts on cadastros(atualizado_ts);
 
 create table if not exists pedidos (
   id text primary key,
@@ -71,9 +77,22 @@ create table if not exists pedidos (
   pct_comissao_vendedor text,
   valor_comissao_vendedor text,
   pct_comissao_adm text,
-  valor_comissao_adm text
+  valor_comissao_adm text,
+  data_hora_criacao_ts timestamp,
+  cnpj_digits text
+);
+create index if not exists idx_ped_digits on pedidos(cnpj_digits);
+create index if not exists idx_ped_ts on pedidos(data_hora_criacao_ts);
+
+-- Contador de IDs de orçamento por sigla (IM/DG), incrementado de forma atômica
+create table if not exists orcamento_seq (
+  sigla text primary key,
+  seq int not null default 0
 );
-create index if not exists idx_ped_cnpj on pedidos((regexp_replace(cnpj_cpf,'\D','','g')));
+insert into orcamento_seq (sigla, seq)
+select s.sigla, (select count(*) from orcamentos where id_orcamento like 'OR-' || s.sigla || '%')
+from (values ('IM'), ('DG')) as s(sigla)
+on conflict (sigla) do nothing;
 
 -- Views com tipos normalizados (úteis para Power Query)
 create or replace view vw_orcamentos_typed as
@@ -2,15 +2,21 @@
 from datetime import datetime
 from typing import Literal, Optional, List, Dict
 import time
+import random
 import unicodedata
+from functools import lru_cache
+from operator import itemgetter
 
 import httpx
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel, Field
 from dotenv import load_dotenv
 import msal
 import threading, socket, json
+import asyncio
+from starlette.concurrency import run_in_threadpool
 
 # ====== Config ======
 load_dotenv()
@@ -21,9 +27,13 @@ TABLE_NAME = os.getenv("EXCEL_TABLE_NAME", "Orcamentos")
 ALLOWED_ORIGINS = [o.strip() for o in os.getenv("ALLOWED_ORIGINS", "").split(",") if o.strip()]
 # Preferimos 'db' como padrão para ambientes de nuvem (evita exigir OneDrive/Graph na importação)
 STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "db").strip().lower()
+# Token fixo (sem MSAL): só para o fake_graph.py
+GRAPH_STATIC_TOKEN = os.getenv("GRAPH_STATIC_TOKEN", "").strip()
 
 if STORAGE_BACKEND != "db":
-    if not (TENANT_ID and CLIENT_ID and EXCEL_REL_PATH):
+    if GRAPH_STATIC_TOKEN:
+        EXCEL_REL_PATH = EXCEL_REL_PATH or "fake.xlsx"
+    elif not (TENANT_ID and CLIENT_ID and EXCEL_REL_PATH):
         raise RuntimeError("Configure TENANT_ID, CLIENT_ID e EXCEL_RELATIVE_PATH no .env")
 
 SCOPES = ["Files.ReadWrite.All", "offline_access"]  # Delegated scopes
@@ -39,42 +49,122 @@ def _load_cache():
     return cache
 
 def _save_cache(cache: msal.SerializableTokenCache):
-    if cache.has_state_changed:
+    if cache is not None and cache.has_state_changed:
         open(CACHE_FILE, "w", encoding="utf-8").write(cache.serialize())
 
-def acquire_token():
-    cache = _load_cache()
-    app = msal.PublicClientApplication(client_id=CLIENT_ID, authority=AUTHORITY, token_cache=cache)
-    # Tenta silencioso (usa cache/refresh)
+# App MSAL e token de acesso mantidos em memÃ³ria (um por processo)
+TOKEN_REFRESH_MARGIN = int(os.getenv("TOKEN_REFRESH_MARGIN", "300"))  # renova N s antes de expirar
+_TOKEN_LOCK = threading.Lock()  # serializa chamadas MSAL e gravação do token_cache.bin
+_MSAL_APP: msal.PublicClientApplication | None = None
+_MSAL_CACHE: msal.SerializableTokenCache | None = None
+_ACCESS_TOKEN: str | None = None
+_TOKEN_EXPIRES_AT: float = 0.0
+_TOKEN_REFRESH_TASK: asyncio.Task | None = None
+
+def _msal_app() -> msal.PublicClientApplication:
+    global _MSAL_APP, _MSAL_CACHE
+    if _MSAL_APP is None:
+        _MSAL_CACHE = _load_cache()
+        _MSAL_APP = msal.PublicClientApplication(client_id=CLIENT_ID, authority=AUTHORITY, token_cache=_MSAL_CACHE)
+    return _MSAL_APP
+
+def _token_valido(margem: float = 60) -> bool:
+    return bool(_ACCESS_TOKEN) and time.time() < _TOKEN_EXPIRES_AT - margem
+
+def _guardar_token(result: dict) -> str:
+    global _ACCESS_TOKEN, _TOKEN_EXPIRES_AT
+    _ACCESS_TOKEN = result["access_token"]
+    _TOKEN_EXPIRES_AT = time.time() + int(result.get("expires_in") or 3600)
+    _save_cache(_MSAL_CACHE)
+    return _ACCESS_TOKEN
+
+def _acquire_silent(force_refresh: bool = False) -> Optional[str]:
+    app = _msal_app()
     accounts = app.get_accounts()
-    if accounts:
-        result = app.acquire_token_silent(SCOPES, account=accounts[0])
-        if result and "access_token" in result:
-            _save_cache(cache)
-            return result["access_token"]
-
-    # Device Code (primeira vez)
-    flow = app.initiate_device_flow(scopes=[f"https://graph.microsoft.com/{s}" for s in SCOPES])
-    if "user_code" not in flow:
-        raise RuntimeError("Falha ao iniciar Device Code Flow")
-    print("\n=== Autorização necessÃ¡ria ===")
-    print(flow["message"])  # abre https://microsoft.com/devicelogin e informe o cÃ³digo
-    result = app.acquire_token_by_device_flow(flow)
-    if "access_token" not in result:
-        raise RuntimeError(f"Erro ao obter token: {result.get('error_description')}")
-    _save_cache(cache)
-    return result["access_token"]
-
-GRAPH = "https://graph.microsoft.com/v1.0"
+    if not accounts:
+        return None
+    result = app.acquire_token_silent(SCOPES, account=accounts[0], force_refresh=force_refresh)
+    if result and "access_token" in result:
+        return _guardar_token(result)
+    return None
+
+def acquire_token(force_refresh: bool = False):
+    """Token do Graph: memÃ³ria -> cache MSAL (silencioso) -> Device Code. Bloqueante."""
+    if GRAPH_STATIC_TOKEN:
+        return GRAPH_STATIC_TOKEN
+    if not force_refresh and _token_valido():
+        return _ACCESS_TOKEN
+    with _TOKEN_LOCK:
+        # outra thread pode ter renovado enquanto esperÃ¡vamos o lock
+        if not force_refresh and _token_valido():
+            return _ACCESS_TOKEN
+        token = _acquire_silent(force_refresh)
+        if token:
+            return token
+
+        # Device Code (primeira vez)
+        app = _msal_app()
+        flow = app.initiate_device_flow(scopes=[f"https://graph.microsoft.com/{s}" for s in SCOPES])
+        if "user_code" not in flow:
+            raise RuntimeError("Falha ao iniciar Device Code Flow")
+        print("\n=== Autorização necessÃ¡ria ===")
+        print(flow["message"])  # abre https://microsoft.com/devicelogin e informe o cÃ³digo
+        result = app.acquire_token_by_device_flow(flow)
+        if "access_token" not in result:
+            raise RuntimeError(f"Erro ao obter token: {result.get('error_description')}")
+        return _guardar_token(result)
+
+async def get_token() -> str:
+    """Versão assíncrona: usa o token em memÃ³ria ou roda o MSAL numa thread."""
+    if GRAPH_STATIC_TOKEN:
+        return GRAPH_STATIC_TOKEN
+    _ensure_token_refresher()
+    if _token_valido():
+        return _ACCESS_TOKEN
+    return await run_in_threadpool(acquire_token)
+
+async def _token_refresh_loop():
+    while True:
+        espera = _TOKEN_EXPIRES_AT - TOKEN_REFRESH_MARGIN - time.time() if _ACCESS_TOKEN else 60
+        await asyncio.sleep(max(30.0, espera))
+        if not _ACCESS_TOKEN or _token_valido(TOKEN_REFRESH_MARGIN):
+            continue
+        try:
+            # só renovação silenciosa: nunca abre Device Code em segundo plano
+            def _renovar():
+                with _TOKEN_LOCK:
+                    return _acquire_silent(force_refresh=True)
+            await run_in_threadpool(_renovar)
+        except Exception as e:
+            print(f"[token] falha ao renovar token: {e}")
+
+def _ensure_token_refresher():
+    global _TOKEN_REFRESH_TASK
+    if _TOKEN_REFRESH_TASK is None or _TOKEN_REFRESH_TASK.done():
+        _TOKEN_REFRESH_TASK = asyncio.get_running_loop().create_task(_token_refresh_loop())
+
+async def stop_token_refresher():
+    global _TOKEN_REFRESH_TASK
+    task, _TOKEN_REFRESH_TASK = _TOKEN_REFRESH_TASK, None
+    if task is not None and not task.done():
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+# GRAPH_BASE_URL permite apontar para o fake_graph.py (benchmarks/testes offline)
+GRAPH = os.getenv("GRAPH_BASE_URL", "https://graph.microsoft.com/v1.0").rstrip("/")
 _HTTP_CLIENT: httpx.AsyncClient | None = None
 _EXCEL_ITEM_ID: str | None = None
-_SESSION_ID: str | None = None
-_SESSION_TS: float = 0.0
-_SESSION_TTL_SECONDS = 300
+_EXCEL_ITEM_ID_LOCK: asyncio.Lock | None = None  # criado no event loop, no primeiro uso
+_SESSION_TTL_SECONDS = int(os.getenv("GRAPH_SESSION_TTL", "300"))  # inatividade tolerada pelo Graph
+_SESSION_REFRESH_AHEAD = int(os.getenv("GRAPH_SESSION_REFRESH_AHEAD", "60"))
 
 # ====== DB opcional ======
+# db_backend só depende da biblioteca padrão (SQLAlchemy é opcional); DB.page_size vale também no modo Excel
+from db_backend import DB as _DB, ADB as _ADB  # _ADB: chamadas ao banco fora do event loop
 try:
-    from db_backend import DB as _DB
     _DB_READY = _DB.is_ready()
     if _DB_READY:
         try:
@@ -88,46 +178,218 @@ except Exception:
     _DB_READY = False
 
 # ====== Helpers Graph ======
-async def graph_client(token: str):
-    return httpx.AsyncClient(headers={"Authorization": f"Bearer {token}"}, timeout=30.0)
+# Um único AsyncClient (pool keep-alive, HTTP/2 se 'h2' estiver instalado) para todas as chamadas
+GRAPH_MAX_CONNECTIONS = int(os.getenv("GRAPH_MAX_CONNECTIONS", "20"))
+GRAPH_MAX_KEEPALIVE = int(os.getenv("GRAPH_MAX_KEEPALIVE", "10"))
+GRAPH_KEEPALIVE_EXPIRY = float(os.getenv("GRAPH_KEEPALIVE_EXPIRY", "60"))
+GRAPH_TIMEOUT = float(os.getenv("GRAPH_TIMEOUT", "30"))
+_GRAPH_STATS = {"requests": 0, "errors": 0, "clients_created": 0}
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def get_http_client() -> httpx.AsyncClient:
+    global _HTTP_CLIENT
+    if _HTTP_CLIENT is None or _HTTP_CLIENT.is_closed:
+        _HTTP_CLIENT = httpx.AsyncClient(
+            http2=_http2_available(),
+            timeout=GRAPH_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=GRAPH_MAX_CONNECTIONS,
+                max_keepalive_connections=GRAPH_MAX_KEEPALIVE,
+                keepalive_expiry=GRAPH_KEEPALIVE_EXPIRY,
+            ),
+        )
+        _GRAPH_STATS["clients_created"] += 1
+    return _HTTP_CLIENT
+
+async def close_http_client():
+    global _HTTP_CLIENT
+    if _HTTP_CLIENT is not None and not _HTTP_CLIENT.is_closed:
+        await _HTTP_CLIENT.aclose()
+    _HTTP_CLIENT = None
+
+def http_pool_stats() -> dict:
+    client = _HTTP_CLIENT
+    out = dict(_GRAPH_STATS)
+    out["open"] = bool(client is not None and not client.is_closed)
+    out["http2"] = _http2_available()
+    out["max_connections"] = GRAPH_MAX_CONNECTIONS
+    out["max_keepalive"] = GRAPH_MAX_KEEPALIVE
+    # httpcore não expõe estatísticas públicas; lemos o pool de forma defensiva
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    conns = list(getattr(pool, "connections", []) or [])
+    out["connections"] = len(conns)
+    out["idle"] = sum(1 for c in conns if getattr(c, "is_idle", lambda: False)())
+    out["http2_connections"] = sum(1 for c in conns if "HTTP/2" in repr(c))
+    return out
+
+# ====== Agendador: limite de taxa, concorrência e retry com Retry-After ======
+GRAPH_RATE_PER_SEC = float(os.getenv("GRAPH_RATE_PER_SEC", "10"))
+GRAPH_RATE_BURST = int(os.getenv("GRAPH_RATE_BURST", "20"))
+GRAPH_MAX_CONCURRENCY = int(os.getenv("GRAPH_MAX_CONCURRENCY", "8"))
+GRAPH_MAX_RETRIES = int(os.getenv("GRAPH_MAX_RETRIES", "4"))
+GRAPH_BACKOFF_BASE = float(os.getenv("GRAPH_BACKOFF_BASE", "0.5"))
+GRAPH_BACKOFF_MAX = float(os.getenv("GRAPH_BACKOFF_MAX", "30"))
+_RETRY_STATUS = {429, 502, 503, 504}
+_RETRY_STATUS_WRITE = {429, 503}  # POST só repete quando o Graph garante que não processou
+_NAO_ENVIADO = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+class GraphScheduler:
+    """Token bucket + semáforo para o Graph; 429/503 viram espera (Retry-After ou backoff com jitter)."""
+
+    def __init__(self, rate: float, burst: int, concurrency: int):
+        self.rate = max(0.1, rate)
+        self.burst = max(1, burst)
+        self.concurrency = max(1, concurrency)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.pause_until = 0.0  # pausa global pedida pelo Graph
+        self.stats = {"throttled": 0, "retries": 0, "waited_s": 0.0, "gave_up": 0}
+        self._sem: asyncio.Semaphore | None = None
+        self._lock: asyncio.Lock | None = None
+
+    def _prims(self):
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.concurrency)
+            self._lock = asyncio.Lock()
+        return self._sem, self._lock
+
+    async def _acquire_token(self):
+        _, lock = self._prims()
+        async with lock:
+            while True:
+                now = time.monotonic()
+                espera = self.pause_until - now
+                if espera <= 0:
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    espera = (1 - self.tokens) / self.rate
+                self.stats["waited_s"] += espera
+                await asyncio.sleep(espera)
+
+    def _delay(self, tentativa: int, r: Optional[httpx.Response]) -> float:
+        ra = r.headers.get("Retry-After") if r is not None else None
+        if ra:
+            try:
+                return min(GRAPH_BACKOFF_MAX, max(0.0, float(ra)))
+            except ValueError:
+                pass
+        # backoff exponencial com "full jitter"
+        return random.uniform(0, min(GRAPH_BACKOFF_MAX, GRAPH_BACKOFF_BASE * (2 ** tentativa)))
+
+    async def send(self, method: str, url: str, headers: dict, **kwargs) -> httpx.Response:
+        sem, _ = self._prims()
+        leitura = method.upper() in ("GET", "HEAD", "OPTIONS")
+        repete_status = _RETRY_STATUS if leitura else _RETRY_STATUS_WRITE
+        tentativa = 0
+        while True:
+            await self._acquire_token()
+            r = None
+            erro: Exception | None = None
+            async with sem:
+                _GRAPH_STATS["requests"] += 1
+                try:
+                    r = await get_http_client().request(method, url, headers=headers, **kwargs)
+                except httpx.TransportError as e:
+                    _GRAPH_STATS["errors"] += 1
+                    if not leitura and not isinstance(e, _NAO_ENVIADO):
+                        raise
+                    erro = e
+            if erro is None and r.status_code not in repete_status:
+                return r
+            if tentativa >= GRAPH_MAX_RETRIES:
+                self.stats["gave_up"] += 1
+                if erro is not None:
+                    raise erro
+                raise HTTPException(503, "Microsoft Graph sobrecarregado; tente novamente em instantes",
+                                    headers={"Retry-After": r.headers.get("Retry-After", "5")})
+            atraso = self._delay(tentativa, r)
+            if r is not None and r.status_code == 429:
+                self.stats["throttled"] += 1
+                # vale para todos: não adianta os outros requests baterem no limite também
+                self.pause_until = max(self.pause_until, time.monotonic() + atraso)
+            self.stats["retries"] += 1
+            tentativa += 1
+            await asyncio.sleep(atraso)
+
+    def info(self) -> dict:
+        sem = self._sem
+        em_uso = self.concurrency - sem._value if sem is not None else 0
+        return {"rate_per_sec": self.rate, "burst": self.burst, "concurrency": self.concurrency,
+                "in_flight": em_uso, "paused_for": max(0.0, round(self.pause_until - time.monotonic(), 2)),
+                **{k: (round(v, 2) if isinstance(v, float) else v) for k, v in self.stats.items()}}
+
+_SCHEDULER = GraphScheduler(GRAPH_RATE_PER_SEC, GRAPH_RATE_BURST, GRAPH_MAX_CONCURRENCY)
+
+async def _graph_send(method: str, url: str, token: str, session_id: str | None, **kwargs) -> httpx.Response:
+    headers = {"Authorization": f"Bearer {token}"}
+    if session_id:
+        headers["workbook-session-id"] = session_id
+    headers.update(kwargs.pop("headers", None) or {})
+    return await _SCHEDULER.send(method, url, headers, **kwargs)
+
+_SESSION_ERRORS = {"invalidsessionrecreatable", "invalidsession", "sessionnotfound", "invalidsessionid"}
+
+def _session_expired(r: httpx.Response) -> bool:
+    if r.status_code not in (400, 404, 409, 440):
+        return False
+    try:
+        err = r.json().get("error") or {}
+    except Exception:
+        return False
+    codes = {str(err.get("code") or "").lower(), str((err.get("innerError") or {}).get("code") or "").lower()}
+    return bool(codes & _SESSION_ERRORS)
+
+async def graph_request(method: str, url: str, token: str, session_id: str | None = None, **kwargs) -> httpx.Response:
+    r = await _graph_send(method, url, token, session_id, **kwargs)
+    if session_id and _session_expired(r):
+        # sessão expirou do lado do Graph: recria uma vez e repete
+        _SESSIONS.stats["renewed_on_error"] += 1
+        novo = await _SESSIONS.renew(token, expired=session_id)
+        r = await _graph_send(method, url, token, novo, **kwargs)
+    return r
 
 async def get_drive_item_id(token: str) -> str:
     # localiza o item pelo caminho no OneDrive do usuÃ¡rio logado
     encoded = urllib.parse.quote(EXCEL_REL_PATH)
     url = f"{GRAPH}/me/drive/root:/{encoded}"
-    async with await graph_client(token) as client:
-        r = await client.get(url)
-        if r.status_code != 200:
-            raise HTTPException(500, f"Não achei o arquivo no OneDrive ({r.text})")
-        return r.json()["id"]
+    r = await graph_request("GET", url, token)
+    if r.status_code != 200:
+        raise HTTPException(500, f"Não achei o arquivo no OneDrive ({r.text})")
+    return r.json()["id"]
 
 async def create_session(token: str, item_id: str) -> str:
     url = f"{GRAPH}/me/drive/items/{item_id}/workbook/createSession"
-    async with await graph_client(token) as client:
-        r = await client.post(url, json={"persistChanges": True})
-        if r.status_code not in (200, 201):
-            raise HTTPException(500, f"Erro ao criar sessão do Excel: {r.text}")
-        return r.json()["id"]  # workbook-session-id
+    r = await graph_request("POST", url, token, json={"persistChanges": True})
+    if r.status_code not in (200, 201):
+        raise HTTPException(500, f"Erro ao criar sessão do Excel: {r.text}")
+    return r.json()["id"]  # workbook-session-id
 
 async def list_rows(token: str, item_id: str, session_id: str) -> list:
     url = f"{GRAPH}/me/drive/items/{item_id}/workbook/tables/{TABLE_NAME}/rows"
-    async with await graph_client(token) as client:
-        r = await client.get(url, headers={"workbook-session-id": session_id})
-        if r.status_code != 200:
-            raise HTTPException(500, f"Erro ao listar linhas: {r.text}")
-        data = r.json()
-        # Cada row tem "values": [[col1, col2, ...]]
-        return [row["values"][0] for row in data.get("value", [])]
+    r = await graph_request("GET", url, token, session_id)
+    if r.status_code != 200:
+        raise HTTPException(500, f"Erro ao listar linhas: {r.text}")
+    data = r.json()
+    # Cada row tem "values": [[col1, col2, ...]]
+    return [row["values"][0] for row in data.get("value", [])]
 
 async def list_columns(token: str, item_id: str, session_id: str) -> List[str]:
     url = f"{GRAPH}/me/drive/items/{item_id}/workbook/tables/{TABLE_NAME}/columns"
-    async with await graph_client(token) as client:
-        r = await client.get(url, headers={"workbook-session-id": session_id})
-        if r.status_code != 200:
-            raise HTTPException(500, f"Erro ao listar colunas: {r.text}")
-        data = r.json()
-        cols = [c.get("name") for c in data.get("value", [])]
-        return [str(x) if x is not None else "" for x in cols]
+    r = await graph_request("GET", url, token, session_id)
+    if r.status_code != 200:
+        raise HTTPException(500, f"Erro ao listar colunas: {r.text}")
+    data = r.json()
+    cols = [c.get("name") for c in data.get("value", [])]
+    return [str(x) if x is not None else "" for x in cols]
 
 def _norm(s: str) -> str:
     s = str(s or "").strip().lower()
@@ -157,11 +419,239 @@ async def list_rows_dicts(token: str, item_id: str, session_id: str) -> List[Dic
 async def add_row(token: str, item_id: str, session_id: str, values: list):
     url = f"{GRAPH}/me/drive/items/{item_id}/workbook/tables/{TABLE_NAME}/rows/add"
     body = {"values": [values]}  # uma linha; pode enviar vÃ¡rias
-    async with await graph_client(token) as client:
-        r = await client.post(url, json=body, headers={"workbook-session-id": session_id})
-        if r.status_code not in (200, 201):
-            raise HTTPException(500, f"Erro ao inserir linha: {r.text}")
-        return r.json()
+    r = await graph_request("POST", url, token, session_id, json=body)
+    if r.status_code not in (200, 201):
+        raise HTTPException(500, f"Erro ao inserir linha: {r.text}")
+    return r.json()
+
+async def add_rows(token: str, item_id: str, session_id: str, rows: List[list]) -> dict:
+    """Várias linhas num único rows/add (o Graph devolve o índice da primeira)."""
+    url = f"{GRAPH}/me/drive/items/{item_id}/workbook/tables/{TABLE_NAME}/rows/add"
+    r = await graph_request("POST", url, token, session_id, json={"values": rows})
+    if r.status_code not in (200, 201):
+        raise HTTPException(500, f"Erro ao inserir linhas: {r.text}")
+    return r.json()
+
+# ====== Espelho local da tabela (evita baixar a planilha inteira a cada request) ======
+GRAPH_MIRROR_TTL = float(os.getenv("GRAPH_MIRROR_TTL", "30"))           # s entre checagens do eTag
+GRAPH_MIRROR_FULL_SYNC = float(os.getenv("GRAPH_MIRROR_FULL_SYNC", "900"))  # s entre recargas completas
+_ID_CANDS = ["id_orcamento", "id_orc", "idorcamento"]
+_CNPJ_CANDS = ["cnpj_cpf", "cnpjcpf", "cnpj"]
+_CAMPOS = {
+    "id": _ID_CANDS,
+    "cnpj": _CNPJ_CANDS,
+    "vendedor": ["vendedor"],
+    "data_hora": ["data_hora", "datahora"],
+}
+
+@lru_cache(maxsize=16)
+def _column_map(table: str, cols: tuple) -> Dict[str, Optional[int]]:
+    # resolvido uma vez por cabeçalho; cabeçalho diferente = nova chave
+    return {campo: _find_col(list(cols), cands) for campo, cands in _CAMPOS.items()}
+
+def _digits(s) -> str:
+    return re.sub(r"\D", "", str(s or ""))
+
+class TableMirror:
+    """CÃ³pia em memÃ³ria da tabela do Excel, com índices por ID e por CNPJ/CPF (dígitos)."""
+
+    def __init__(self):
+        self.cols: List[str] = []
+        self.rows: List[tuple] = []
+        self.by_id: Dict[str, List[int]] = {}
+        self.by_doc: Dict[str, List[int]] = {}
+        self.colmap: Dict[str, Optional[int]] = {}
+        self.get: Dict[str, Optional[itemgetter]] = {}  # campo -> acessor da tupla
+        self.etag: Optional[str] = None
+        self.loaded = False
+        self.checked_at = 0.0
+        self.full_at = 0.0
+        self.stats = {"full_syncs": 0, "delta_syncs": 0, "delta_rows": 0, "etag_hits": 0}
+        self._lock: asyncio.Lock | None = None
+
+    @property
+    def lock(self) -> asyncio.Lock:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    @property
+    def idx_id(self) -> Optional[int]:
+        return self.colmap.get("id")
+
+    @property
+    def idx_cnpj(self) -> Optional[int]:
+        return self.colmap.get("cnpj")
+
+    def reset(self, cols: List[str], rows: List[list]):
+        self.cols = list(cols)
+        self.colmap = _column_map(TABLE_NAME, tuple(self.cols))
+        self.get = {k: (itemgetter(i) if i is not None else None) for k, i in self.colmap.items()}
+        self.rows, self.by_id, self.by_doc = [], {}, {}
+        self.extend(rows)
+        self.loaded = True
+
+    def extend(self, rows: List[list]):
+        n = len(self.cols)
+        get_id, get_doc = self.get.get("id"), self.get.get("cnpj")
+        for r in rows:
+            # tupla com a largura do cabeçalho: os acessores não precisam checar tamanho
+            t = tuple(r[:n]) + (None,) * (n - len(r)) if len(r) != n else tuple(r)
+            i = len(self.rows)
+            self.rows.append(t)
+            if get_id is not None:
+                self.by_id.setdefault(str(get_id(t)), []).append(i)
+            if get_doc is not None:
+                self.by_doc.setdefault(_digits(get_doc(t)), []).append(i)
+
+    def as_dict(self, row: tuple) -> Dict[str, str]:
+        return dict(zip(self.cols, row))
+
+    def find_id(self, orc_id: str) -> List[tuple]:
+        return [self.rows[i] for i in self.by_id.get(str(orc_id), [])]
+
+    def find_doc(self, doc: str) -> List[tuple]:
+        return [self.rows[i] for i in self.by_doc.get(_digits(doc), [])]
+
+    def info(self) -> dict:
+        return {"loaded": self.loaded, "rows": len(self.rows), "etag": self.etag,
+                "checked_at": self.checked_at, "full_at": self.full_at, **self.stats}
+
+_MIRROR = TableMirror()
+
+async def _fetch_etag(token: str, item_id: str) -> Optional[str]:
+    r = await graph_request("GET", f"{GRAPH}/me/drive/items/{item_id}?$select=eTag,cTag", token)
+    if r.status_code != 200:
+        return None
+    data = r.json()
+    return data.get("cTag") or data.get("eTag")
+
+async def _fetch_rows_from(token: str, item_id: str, session_id: str, skip: int) -> list:
+    url = f"{GRAPH}/me/drive/items/{item_id}/workbook/tables/{TABLE_NAME}/rows?$skip={int(skip)}"
+    r = await graph_request("GET", url, token, session_id)
+    if r.status_code != 200:
+        raise HTTPException(500, f"Erro ao listar linhas: {r.text}")
+    return [row["values"][0] for row in r.json().get("value", [])]
+
+async def _fetch_row_at(token: str, item_id: str, session_id: str, index: int) -> Optional[list]:
+    url = f"{GRAPH}/me/drive/items/{item_id}/workbook/tables/{TABLE_NAME}/rows/itemAt(index={int(index)})"
+    r = await graph_request("GET", url, token, session_id)
+    if r.status_code != 200:
+        return None
+    vals = r.json().get("values") or [None]
+    return vals[0]
+
+def _same_row(a: Optional[list], b: Optional[list]) -> bool:
+    if a is None or b is None:
+        return False
+    return [str(x if x is not None else "") for x in a] == [str(x if x is not None else "") for x in b]
+
+async def _sync_delta(m: TableMirror, token: str, item_id: str, session_id: str) -> bool:
+    """Busca só as linhas novas. Falso se a tabela mudou de outro jeito (edição/remoção)."""
+    n = len(m.rows)
+    if n and not _same_row(await _fetch_row_at(token, item_id, session_id, n - 1), m.rows[n - 1]):
+        return False
+    novas = await _fetch_rows_from(token, item_id, session_id, n)
+    if not novas:
+        return False  # eTag mudou sem linhas novas: edição no meio da tabela
+    m.extend(novas)
+    m.stats["delta_syncs"] += 1
+    m.stats["delta_rows"] += len(novas)
+    return True
+
+async def get_mirror(token: str, item_id: str, session_id: str, max_age: Optional[float] = None, force: bool = False) -> TableMirror:
+    """Espelho atualizado: eTag igual -> nada; só linhas novas -> delta; senão recarga completa."""
+    m = _MIRROR
+    ttl = GRAPH_MIRROR_TTL if max_age is None else max_age
+    if not force and m.loaded and time.time() - m.checked_at < ttl:
+        return m
+    async with m.lock:
+        now = time.time()
+        if not force and m.loaded and now - m.checked_at < ttl:
+            return m
+        etag = await _fetch_etag(token, item_id)
+        if m.loaded and not force and now - m.full_at < GRAPH_MIRROR_FULL_SYNC:
+            if etag and etag == m.etag:
+                m.stats["etag_hits"] += 1
+                m.checked_at = now
+                return m
+            if await _sync_delta(m, token, item_id, session_id):
+                m.etag, m.checked_at = etag, now
+                return m
+        cols = await list_columns(token, item_id, session_id)
+        rows = await list_rows(token, item_id, session_id)
+        m.reset(cols, rows)
+        m.stats["full_syncs"] += 1
+        m.etag, m.checked_at, m.full_at = etag, now, now
+    return m
+
+# ====== Escrita em lote (write-behind) ======
+GRAPH_BATCH_WINDOW_MS = int(os.getenv("GRAPH_BATCH_WINDOW_MS", "50"))  # janela para juntar inserções
+GRAPH_BATCH_MAX_ROWS = int(os.getenv("GRAPH_BATCH_MAX_ROWS", "200"))
+
+class RowBatcher:
+    """Junta inserções que chegam na mesma janela num único rows/add; cada chamador recebe seu future."""
+
+    def __init__(self):
+        self.pending: List[tuple] = []  # (values, future, token, item_id, session_id)
+        self.inflight: List[list] = []  # enviadas ao Graph, ainda fora do espelho
+        self.stats = {"batches": 0, "rows": 0, "errors": 0, "max_batch": 0}
+        self._task: asyncio.Task | None = None
+
+    def pending_rows(self) -> List[list]:
+        return self.inflight + [p[0] for p in self.pending]
+
+    def submit(self, token: str, item_id: str, session_id: str, values: list) -> asyncio.Future:
+        # síncrono de propósito: quem calcula o ID e enfileira não cede o event loop no meio
+        fut = asyncio.get_running_loop().create_future()
+        self.pending.append((list(values), fut, token, item_id, session_id))
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return fut
+
+    async def _run(self):
+        while self.pending:
+            if len(self.pending) < GRAPH_BATCH_MAX_ROWS:
+                await asyncio.sleep(GRAPH_BATCH_WINDOW_MS / 1000.0)
+            lote, self.pending = self.pending[:GRAPH_BATCH_MAX_ROWS], self.pending[GRAPH_BATCH_MAX_ROWS:]
+            await self._flush(lote)
+
+    async def _flush(self, lote: List[tuple]):
+        _, _, token, item_id, session_id = lote[-1]  # credenciais mais recentes
+        valores = [p[0] for p in lote]
+        self.inflight = valores
+        try:
+            res = await add_rows(token, item_id, session_id, valores) or {}
+        except Exception as e:
+            self.inflight = []
+            self.stats["errors"] += 1
+            for _, fut, *_ in lote:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        self.stats["batches"] += 1
+        self.stats["rows"] += len(lote)
+        self.stats["max_batch"] = max(self.stats["max_batch"], len(lote))
+        base = res.get("index") if isinstance(res.get("index"), int) else None
+        gravadas = res.get("values") or valores
+        async with _MIRROR.lock:
+            # um delta concorrente pode já ter trazido as linhas
+            if base is None or base >= len(_MIRROR.rows):
+                _MIRROR.extend(gravadas)
+                try:
+                    _MIRROR.etag = await _fetch_etag(token, item_id)
+                except Exception:
+                    _MIRROR.etag = None
+            self.inflight = []
+        for i, (_, fut, *_) in enumerate(lote):
+            if not fut.done():
+                fut.set_result({"index": (base + i) if base is not None else None,
+                                "values": [gravadas[i] if i < len(gravadas) else valores[i]]})
+
+_BATCHER = RowBatcher()
+
+async def append_row(token: str, item_id: str, session_id: str, values: list) -> dict:
+    return await _BATCHER.submit(token, item_id, session_id, values)
 
 # ====== DomÃ­nio (mesma regra do app) ======
 def pt(n: float) -> str:
@@ -232,6 +722,9 @@ class OrcamentoOut(BaseModel):
 
 app = FastAPI(title="Integração Orçamento API")
 
+# Listagens JSON grandes trafegam comprimidas (o cliente desktop envia Accept-Encoding: gzip)
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
 if ALLOWED_ORIGINS:
     app.add_middleware(
         CORSMiddleware,
@@ -247,27 +740,45 @@ async def proximo_id(tipo_servico: Literal["Impressao", "Digitalizacao"]):
     prefix = f"OR-{sigla}"
     if STORAGE_BACKEND == "db" and _DB_READY:
         try:
-            rows = _DB.list_orcamentos_excel()
-            count = 0
-            for r in rows:
-                try:
-                    v = str(r.get("ID Orçamento") or r.get("ID") or "")
-                    if v.startswith(prefix):
-                        count += 1
-                except Exception:
-                    pass
-            seq = count + 1
+            seq = await _ADB.peek_orcamento_seq(sigla)
             return {"id": f"{prefix}{seq}{dtok['data_compacta']}"}
         except Exception:
             pass
-    token = acquire_token()
+    token = await get_token()
     item_id = await get_drive_item_id_cached(token)
     session_id = await get_session_id_cached(token, item_id)
-    rows = await list_rows(token, item_id, session_id)
-    seq = proximo_seq_por_rows(rows, prefix)
+    mirror = await get_mirror(token, item_id, session_id)
+    seq = proximo_seq_por_rows(mirror.rows, prefix)
     return {"id": f"{prefix}{seq}{dtok['data_compacta']}"}
+
+
+# Reenvios da outbox do cliente trazem a mesma Idempotency-Key: devolvem o orçamento já criado.
+# Com banco, as respostas ficam na tabela idempotencia; no modo Excel, em memória (últimas IDEMPOTENCIA_MAX).
+IDEMPOTENCIA_MAX = int(os.getenv("IDEMPOTENCIA_MAX", "5000"))
+_IDEMPOTENCIA: Dict[str, dict] = {}
+
+
+async def _resposta_idempotente(chave: str) -> Optional[dict]:
+    if STORAGE_BACKEND == "db" and _DB_READY:
+        return await _ADB.resposta_idempotente(f"orcamentos:{chave}")
+    return _IDEMPOTENCIA.get(chave)
+
+
+async def _guardar_idempotente(chave: str, resposta: dict):
+    if STORAGE_BACKEND == "db" and _DB_READY:
+        await _ADB.guardar_resposta_idempotente(f"orcamentos:{chave}", resposta)
+        return
+    _IDEMPOTENCIA[chave] = resposta
+    while len(_IDEMPOTENCIA) > IDEMPOTENCIA_MAX:
+        _IDEMPOTENCIA.pop(next(iter(_IDEMPOTENCIA)))  # dict mantém a ordem de inserção
+
+
 @app.post("/api/orcamentos", response_model=OrcamentoOut)
-async def criar_orcamento(body: OrcamentoIn):
+async def criar_orcamento(body: OrcamentoIn, idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")):
+    if idempotency_key:
+        anterior = await _resposta_idempotente(idempotency_key)
+        if anterior:
+            return OrcamentoOut(**anterior)
     # validaÃ§Ãµes
     if not validar_email(body.email):
         raise HTTPException(400, "E-mail inválido")
@@ -281,24 +792,16 @@ async def criar_orcamento(body: OrcamentoIn):
 
     sigla = sigla_tipo(body.tipo_servico)
     if STORAGE_BACKEND == "db" and _DB_READY:
-        try:
-            rows = _DB.list_orcamentos_excel()
-        except Exception:
-            rows = []
-        seq = 1
-        for r in rows:
-            try:
-                v = str(r.get("ID Orçamento") or r.get("ID") or "")
-                if v.startswith(f"OR-{sigla}"):
-                    seq += 1
-            except Exception:
-                pass
+        seq = await _ADB.next_orcamento_seq(sigla)
     else:
-        token = acquire_token()
+        token = await get_token()
         item_id = await get_drive_item_id_cached(token)
         session_id = await get_session_id_cached(token, item_id)
-        rows = await list_rows(token, item_id, session_id)
-        seq = proximo_seq_por_rows(rows, f"OR-{sigla}")
+        # o sequencial precisa refletir a planilha atual: sempre checa o eTag antes de gravar
+        mirror = await get_mirror(token, item_id, session_id, max_age=0)
+        # inclui as linhas ainda na fila de escrita (e que o espelho ainda não viu) para não repetir o sequencial
+        fila = [r for r in _BATCHER.pending_rows() if str(r[0]) not in mirror.by_id]
+        seq = proximo_seq_por_rows(mirror.rows + fila, f"OR-{sigla}")
     dtok = data_tokens()
 
     id_orc = f"OR-{sigla}{seq}{dtok['data_compacta']}"
@@ -336,7 +839,7 @@ async def criar_orcamento(body: OrcamentoIn):
     ]
 
     if STORAGE_BACKEND == "db" and _DB_READY:
-        _DB.salvar_orcamento({
+        await _ADB.salvar_orcamento({
             "ID Orçamento": id_orc,
             "Data/Hora": dtok["combinado"],
             "Tipo de Serviço": body.tipo_servico,
@@ -355,10 +858,10 @@ async def criar_orcamento(body: OrcamentoIn):
             "Valor Total": pt(total),
         })
     else:
-        # Insere via Graph/Excel
-        await add_row(token, item_id, session_id, linha)
+        # Insere via Graph/Excel (fila em lote; o espelho local é atualizado no flush)
+        await append_row(token, item_id, session_id, linha)
 
-    return OrcamentoOut(
+    out = OrcamentoOut(
         id_orcamento=id_orc,
         data_hora=dtok["combinado"],
         tipo_servico=body.tipo_servico,
@@ -372,6 +875,9 @@ async def criar_orcamento(body: OrcamentoIn):
         preco_por_metro=pt(preco),
         valor_total=pt(total),
     )
+    if idempotency_key:
+        await _guardar_idempotente(idempotency_key, out.dict())
+    return out
 
 @app.get("/api/orcamentos")
 async def listar_orcamentos(
@@ -380,24 +886,36 @@ async def listar_orcamentos(
     vendedor: Optional[str] = None,
     start: Optional[str] = None,  # dd/mm/yyyy
     end: Optional[str] = None,    # dd/mm/yyyy
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    offset: Optional[int] = None,
+    count: bool = False,
 ):
     if STORAGE_BACKEND == "db" and _DB_READY:
-        rows = _DB.list_orcamentos_excel(start=start, end=end, vendedor=vendedor, cnpj_digits=cnpj)
+        if id:
+            d = await _ADB.get_orcamento_by_id(id)
+            rows = [d] if d else []
+            return {"count": len(rows), "rows": rows}
+        if limit or cursor:
+            limit = _DB.page_size(limit)
+            try:
+                page = await _ADB.list_page("orcamentos", limit, cursor=cursor, offset=offset, start=start, end=end, vendedor=vendedor, cnpj_digits=cnpj)
+            except ValueError as ex:
+                raise HTTPException(400, str(ex))
+            out = {"count": len(page["rows"]), "rows": page["rows"], "next_cursor": page["next_cursor"]}
+            if count:
+                out["total"] = await _ADB.count_rows("orcamentos", start=start, end=end, vendedor=vendedor, cnpj_digits=cnpj)
+            return out
+        rows = await _ADB.list_orcamentos_excel(start=start, end=end, vendedor=vendedor, cnpj_digits=cnpj, offset=offset)
         return {"count": len(rows), "rows": rows}
-    token = acquire_token()
+    token = await get_token()
     item_id = await get_drive_item_id_cached(token)
     session_id = await get_session_id_cached(token, item_id)
-    rows = await list_rows_dicts(token, item_id, session_id)
+    mirror = await get_mirror(token, item_id, session_id)
 
-    # Identify columns by normalized names
-    cols = await list_columns(token, item_id, session_id)
-    idx_id = _find_col(cols, ["id_orcamento", "id_orc", "idorcamento", "id_orcamento"])
-    idx_cnpj = _find_col(cols, ["cnpj_cpf", "cnpjcpf", "cnpj"])
-    idx_vend = _find_col(cols, ["vendedor"])
-    idx_dh = _find_col(cols, ["data_hora", "datahora", "data_hora"])
-
-    def _digits(s: Optional[str]) -> str:
-        return re.sub(r"\D", "", s or "")
+    # Colunas resolvidas uma vez por cabeçalho (acessores prontos no espelho)
+    get_id, get_doc = mirror.get.get("id"), mirror.get.get("cnpj")
+    get_vend, get_dh = mirror.get.get("vendedor"), mirror.get.get("data_hora")
 
     def _parse_date(d: Optional[str]):
         if not d:
@@ -407,80 +925,172 @@ async def listar_orcamentos(
         except Exception:
             return None
 
-    ds = _parse_date(start)
-    de = _parse_date(end)
+    # Candidatos pelo índice mais seletivo do espelho
+    if id and get_id is not None:
+        rows = mirror.find_id(id)
+    elif cnpj and get_doc is not None:
+        rows = mirror.find_doc(cnpj)
+    else:
+        rows = mirror.rows
+
+    ds = _parse_date(start).date() if _parse_date(start) else None
+    de = _parse_date(end).date() if _parse_date(end) else None
+    doc = _digits(cnpj) if cnpj else ""
+    vend = vendedor.strip().lower() if vendedor else ""
+    if not id:
+        get_id = None
+    if not doc:
+        get_doc = None
+    if not vend:
+        get_vend = None
+    if not (ds or de):
+        get_dh = None
     out = []
-    for d in rows:
-        # Apply filters using indices if found
-        if id and idx_id is not None and str(list(d.values())[idx_id]) != id:
+    for r in rows:
+        if get_id is not None and str(get_id(r)) != id:
             continue
-        if cnpj and idx_cnpj is not None and _digits(str(list(d.values())[idx_cnpj])) != _digits(cnpj):
+        if get_doc is not None and _digits(get_doc(r)) != doc:
             continue
-        if vendedor and idx_vend is not None and str(list(d.values())[idx_vend]).strip().lower() != vendedor.strip().lower():
+        if get_vend is not None and str(get_vend(r)).strip().lower() != vend:
             continue
-        if (ds or de) and idx_dh is not None:
-            dt_txt = str(list(d.values())[idx_dh] or "").strip()
+        if get_dh is not None:
             try:
-                dt = datetime.strptime(dt_txt, "%d/%m/%Y %H:%M:%S")
+                dt = datetime.strptime(str(get_dh(r) or "").strip(), "%d/%m/%Y %H:%M:%S").date()
             except Exception:
-                dt = None
-            if dt is None:
                 continue
-            if ds and dt.date() < ds.date():
+            if (ds and dt < ds) or (de and dt > de):
                 continue
-            if de and dt.date() > de.date():
-                continue
-        out.append(d)
-    return {"count": len(out), "rows": out}
+        out.append(r)
+    if offset or limit or cursor:
+        # Excel: paginação simples por posição (o cursor é o próprio offset)
+        try:
+            ini = int(cursor or offset or 0)
+        except ValueError:
+            raise HTTPException(400, "cursor inválido")
+        fim = ini + _DB.page_size(limit)
+        total = len(out)
+        out = [mirror.as_dict(r) for r in out[ini:fim]]
+        resp = {"count": len(out), "rows": out, "next_cursor": str(fim) if fim < total else None}
+        if count:
+            resp["total"] = total
+        return resp
+    return {"count": len(out), "rows": [mirror.as_dict(r) for r in out]}
 
 @app.get("/api/orcamentos/{orc_id}")
 async def obter_orcamento(orc_id: str):
     if STORAGE_BACKEND == "db" and _DB_READY:
-        d = _DB.get_orcamento_by_id(orc_id)
+        d = await _ADB.get_orcamento_by_id(orc_id)
         if d:
             return d
-    token = acquire_token()
+    token = await get_token()
     item_id = await get_drive_item_id_cached(token)
     session_id = await get_session_id_cached(token, item_id)
-    rows = await list_rows_dicts(token, item_id, session_id)
-    cols = await list_columns(token, item_id, session_id)
-    idx_id = _find_col(cols, ["id_orcamento", "id_orc", "idorcamento", "id_orcamento"])
-    for d in rows:
-        if idx_id is not None and str(list(d.values())[idx_id]) == orc_id:
-            return d
+    mirror = await get_mirror(token, item_id, session_id)
+    for r in mirror.find_id(orc_id):
+        return mirror.as_dict(r)
     raise HTTPException(404, "OrÃ§amento não encontrado")
 
 # ====== Cache helpers (item_id e sessão) ======
 async def get_drive_item_id_cached(token: str) -> str:
-    global _EXCEL_ITEM_ID
+    global _EXCEL_ITEM_ID, _EXCEL_ITEM_ID_LOCK
     if _EXCEL_ITEM_ID:
         return _EXCEL_ITEM_ID
-    encoded = urllib.parse.quote(EXCEL_REL_PATH)
-    url = f"{GRAPH}/me/drive/root:/{encoded}"
-    async with await graph_client(token) as client:
-        r = await client.get(url)
+    if _EXCEL_ITEM_ID_LOCK is None:
+        _EXCEL_ITEM_ID_LOCK = asyncio.Lock()
+    async with _EXCEL_ITEM_ID_LOCK:
+        # uma busca por vez: quem esperou reaproveita o ID achado pelo primeiro
+        if _EXCEL_ITEM_ID:
+            return _EXCEL_ITEM_ID
+        encoded = urllib.parse.quote(EXCEL_REL_PATH)
+        url = f"{GRAPH}/me/drive/root:/{encoded}"
+        r = await graph_request("GET", url, token)
         if r.status_code != 200:
             raise HTTPException(500, f"Não achei o arquivo no OneDrive ({r.text})")
-        data = r.json(); _EXCEL_ITEM_ID = str(data.get("id") or "")
-        if not _EXCEL_ITEM_ID:
+        item_id = str(r.json().get("id") or "")
+        if not item_id:
             raise HTTPException(500, "ID do arquivo Excel não retornado")
-        return _EXCEL_ITEM_ID
+        _EXCEL_ITEM_ID = item_id
+    return _EXCEL_ITEM_ID
+
+class WorkbookSessions:
+    """Sessão do workbook compartilhada: renova antes de expirar, uma criação por vez, fecha a antiga."""
+
+    def __init__(self):
+        self.session_id: Optional[str] = None
+        self.item_id: Optional[str] = None
+        self.used_at = 0.0
+        self.stats = {"created": 0, "refreshed": 0, "renewed_on_error": 0, "closed": 0}
+        self._lock: asyncio.Lock | None = None
+        self._refresh_task: asyncio.Task | None = None
+
+    @property
+    def lock(self) -> asyncio.Lock:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def get(self, token: str, item_id: str) -> str:
+        idade = time.time() - self.used_at
+        if self.session_id and self.item_id == item_id and idade < _SESSION_TTL_SECONDS:
+            if idade >= _SESSION_TTL_SECONDS - _SESSION_REFRESH_AHEAD:
+                self._refresh_ahead(token)
+            else:
+                self.used_at = time.time()  # cada uso estende a sessão no Graph
+            return self.session_id
+        return await self.renew(token, item_id=item_id, expired=self.session_id)
+
+    async def renew(self, token: str, item_id: Optional[str] = None, expired: Optional[str] = None) -> str:
+        item_id = item_id or self.item_id or await get_drive_item_id_cached(token)
+        async with self.lock:
+            # outro request já trocou a sessão enquanto esperÃ¡vamos
+            if self.session_id and self.session_id != expired and self.item_id == item_id:
+                return self.session_id
+            antiga = self.session_id
+            self.session_id = await create_session(token, item_id)
+            self.item_id, self.used_at = item_id, time.time()
+            self.stats["created"] += 1
+        if antiga:
+            asyncio.get_running_loop().create_task(self._close(token, item_id, antiga))
+        return self.session_id
+
+    def _refresh_ahead(self, token: str):
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.get_running_loop().create_task(self._refresh(token))
+
+    async def _refresh(self, token: str):
+        sid, item_id = self.session_id, self.item_id
+        try:
+            url = f"{GRAPH}/me/drive/items/{item_id}/workbook/refreshSession"
+            r = await _graph_send("POST", url, token, sid)
+            if r.status_code in (200, 204) and self.session_id == sid:
+                self.used_at = time.time()
+                self.stats["refreshed"] += 1
+                return
+            await self.renew(token, item_id=item_id, expired=sid)
+        except Exception as e:
+            print(f"[graph] falha ao renovar sessão: {e}")
+
+    async def _close(self, token: str, item_id: str, session_id: str):
+        try:
+            await _graph_send("POST", f"{GRAPH}/me/drive/items/{item_id}/workbook/closeSession", token, session_id)
+            self.stats["closed"] += 1
+        except Exception:
+            pass
+
+    async def close(self):
+        if self._refresh_task is not None and not self._refresh_task.done():
+            self._refresh_task.cancel()
+        if self.session_id and self.item_id and _ACCESS_TOKEN:
+            await self._close(_ACCESS_TOKEN, self.item_id, self.session_id)
+        self.session_id = None
+
+    def info(self) -> dict:
+        return {"active": bool(self.session_id), "age": round(time.time() - self.used_at, 1) if self.session_id else None, **self.stats}
+
+_SESSIONS = WorkbookSessions()
 
 async def get_session_id_cached(token: str, item_id: str) -> str:
-    global _SESSION_ID, _SESSION_TS
-    now = time.time()
-    if _SESSION_ID and (now - _SESSION_TS) < _SESSION_TTL_SECONDS:
-        return _SESSION_ID
-    url = f"{GRAPH}/me/drive/items/{item_id}/workbook/createSession"
-    async with await graph_client(token) as client:
-        r = await client.post(url, json={"persistChanges": True})
-        if r.status_code not in (200, 201):
-            raise HTTPException(500, f"Erro ao criar sessão do Excel: {r.text}")
-        data = r.json(); _SESSION_ID = str(data.get("id") or "")
-        if not _SESSION_ID:
-            raise HTTPException(500, "Sessão do Excel não retornada")
-        _SESSION_TS = now
-        return _SESSION_ID
+    return await _SESSIONS.get(token, item_id)
 # ====== Descoberta na rede (UDP) para clientes auto-configurarem a URL ======
 _DISCOVERY_PORT = 56789
 
@@ -528,6 +1138,38 @@ async def _start_discovery():
         pass
 
 
+@app.on_event("startup")
+async def _start_http_client():
+    if STORAGE_BACKEND != "db":
+        get_http_client()
+
+
+async def shutdown_graph():
+    await stop_token_refresher()
+    await _SESSIONS.close()
+    await close_http_client()
+
+
+@app.on_event("shutdown")
+async def _stop_http_client():
+    await shutdown_graph()
+
+
+@app.get("/api/info")
+async def api_info():
+    out = {"storage": STORAGE_BACKEND, "db_ready": bool(_DB_READY)}
+    if _DB_READY:
+        out["pool"] = await _ADB.pool_status()
+        out["threads"] = _ADB.info()
+    return out
+
+
+@app.get("/api/graph/stats")
+async def graph_stats():
+    return {"storage": STORAGE_BACKEND, "http": http_pool_stats(), "scheduler": _SCHEDULER.info(), "mirror": _MIRROR.info(),
+            "batcher": {**_BATCHER.stats, "pending": len(_BATCHER.pending)}, "session": _SESSIONS.info()}
+
+
 
 
 
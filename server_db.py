@@ -1,14 +1,23 @@
+import csv
+import hashlib
+import io
+import json
 import os
 import re
+import tempfile
+import threading
+import time
 from datetime import datetime
 from typing import Literal, Optional
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
-from db_backend import DB as _DB
+from db_backend import DB as _DB, ADB as _ADB
 
 
 load_dotenv()
@@ -38,6 +47,41 @@ except Exception:
     pass
 
 
+def validar_datas(*datas: Optional[str]):
+    """400 para filtros de data fora de DD/MM/AAAA (antes de consultar ou abrir um stream)."""
+    for d in datas:
+        try:
+            if d:
+                datetime.strptime(d, "%d/%m/%Y")
+        except ValueError:
+            raise HTTPException(400, "Data inválida (use DD/MM/AAAA)")
+
+
+def listar_paginado(tabela: str, limit: Optional[int], cursor: Optional[str], offset: Optional[int], count: bool, **filtros) -> dict:
+    """Resposta paginada (keyset) das listagens; mantém 'count'/'rows' do formato antigo."""
+    limit = _DB.page_size(limit)
+    try:
+        page = _DB.list_page(tabela, limit, cursor=cursor, offset=offset, **filtros)
+    except ValueError as ex:
+        raise HTTPException(400, str(ex))
+    out = {"count": len(page["rows"]), "rows": page["rows"], "next_cursor": page["next_cursor"]}
+    if count:
+        out["total"] = _DB.count_rows(tabela, **filtros)
+    return out
+
+
+async def json_fora_do_loop(fn, *args, **kwargs) -> Response:
+    """Consulta + serialização nas threads do banco: o jsonable_encoder de listas grandes também trava o loop."""
+    def _tudo() -> bytes:
+        return json.dumps(fn(*args, **kwargs), ensure_ascii=False, default=str).encode("utf-8")
+    return Response(await _ADB.run(_tudo), media_type="application/json")
+
+
+def _lista(fn, **filtros) -> dict:
+    rows = fn(**filtros)
+    return {"count": len(rows), "rows": rows}
+
+
 def pt(n: float) -> str:
     return f"{n:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
 
@@ -90,6 +134,9 @@ class OrcamentoOut(BaseModel):
 
 app = FastAPI(title="Integração Orçamento API (DB)")
 
+# Listagens JSON grandes trafegam comprimidas (o cliente desktop envia Accept-Encoding: gzip)
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
 if ALLOWED_ORIGINS:
     app.add_middleware(
         CORSMiddleware,
@@ -119,21 +166,25 @@ async def proximo_id(tipo_servico: Literal["Impressão", "Digitalização"]):
     sigla = sigla_tipo(tipo_servico)
     dtok = data_tokens()
     prefix = f"OR-{sigla}"
-    rows = _DB.list_orcamentos_excel()
-    count = 0
-    for r in rows:
-        try:
-            v = str(r.get("ID Orçamento") or r.get("ID") or "")
-            if v.startswith(prefix):
-                count += 1
-        except Exception:
-            pass
-    seq = count + 1
+    seq = await _ADB.peek_orcamento_seq(sigla)
     return {"id": f"{prefix}{seq}{dtok['data_compacta']}"}
 
 
+# Reenvios da outbox do cliente trazem a mesma Idempotency-Key: devolvem o orçamento já criado
+async def _resposta_idempotente(chave: str) -> dict | None:
+    return await _ADB.resposta_idempotente(f"orcamentos:{chave}")
+
+
+async def _guardar_idempotente(chave: str, resposta: dict):
+    await _ADB.guardar_resposta_idempotente(f"orcamentos:{chave}", resposta)
+
+
 @app.post("/api/orcamentos", response_model=OrcamentoOut)
-async def criar_orcamento(body: OrcamentoIn):
+async def criar_orcamento(body: OrcamentoIn, idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")):
+    if idempotency_key:
+        anterior = await _resposta_idempotente(idempotency_key)
+        if anterior:
+            return OrcamentoOut(**anterior)
     if not validar_email(body.email):
         raise HTTPException(400, "E-mail inválido")
     d = re.sub(r'\D', '', body.cnpj)
@@ -149,16 +200,7 @@ async def criar_orcamento(body: OrcamentoIn):
     sigla = sigla_tipo(body.tipo_servico)
     dtok = data_tokens()
     prefix = f"OR-{sigla}"
-    rows = _DB.list_orcamentos_excel()
-    count = 0
-    for r in rows:
-        try:
-            v = str(r.get("ID Orçamento") or r.get("ID") or "")
-            if v.startswith(prefix):
-                count += 1
-        except Exception:
-            pass
-    seq = count + 1
+    seq = await _ADB.next_orcamento_seq(sigla)
     id_orc = f"{prefix}{seq}{dtok['data_compacta']}"
 
     metros = (qtd/100.0) if body.unidade == "Centímetros" else qtd
@@ -185,9 +227,9 @@ async def criar_orcamento(body: OrcamentoIn):
         "valor_total": pt(total),
     }
     dados_excel = { _DB.REV_ORC.get(k, k): v for k, v in row_by_db.items() }
-    _DB.salvar_orcamento(dados_excel)
+    await _ADB.salvar_orcamento(dados_excel)
 
-    return OrcamentoOut(
+    out = OrcamentoOut(
         id_orcamento=id_orc,
         data_hora=dtok["combinado"],
         tipo_servico=body.tipo_servico,
@@ -201,6 +243,9 @@ async def criar_orcamento(body: OrcamentoIn):
         preco_por_metro=pt(preco),
         valor_total=pt(total),
     )
+    if idempotency_key:
+        await _guardar_idempotente(idempotency_key, out.dict())
+    return out
 
 
 @app.get("/api/orcamentos")
@@ -210,19 +255,25 @@ async def listar_orcamentos(
     vendedor: Optional[str] = None,
     start: Optional[str] = None,
     end: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    offset: Optional[int] = None,
+    count: bool = False,
 ):
     if id:
-        d = _DB.get_orcamento_by_id(id)
+        d = await _ADB.get_orcamento_by_id(id)
         rows = [d] if d else []
         return {"count": len(rows), "rows": rows}
-    rows = _DB.list_orcamentos_excel(start=start, end=end, vendedor=vendedor, cnpj_digits=cnpj)
-    return {"count": len(rows), "rows": rows}
+    validar_datas(start, end)
+    if limit or cursor:
+        return await json_fora_do_loop(listar_paginado, "orcamentos", limit, cursor, offset, count, start=start, end=end, vendedor=vendedor, cnpj_digits=cnpj)
+    return await json_fora_do_loop(_lista, _DB.list_orcamentos_excel, start=start, end=end, vendedor=vendedor, cnpj_digits=cnpj, offset=offset)
 
 
 @app.get("/api/usuarios")
 async def listar_usuarios():
     try:
-        return {"rows": _DB.list_usuarios()}
+        return {"rows": await _ADB.list_usuarios()}
     except Exception as ex:
         raise HTTPException(500, f"Erro ao listar usuários: {ex}")
 
@@ -230,7 +281,7 @@ async def listar_usuarios():
 @app.post("/api/usuarios")
 async def criar_atualizar_usuario(body: UsuarioIn):
     try:
-        _DB.upsert_usuario(body.dict())
+        await _ADB.upsert_usuario(body.dict())
         return {"ok": True}
     except Exception as ex:
         raise HTTPException(500, f"Erro ao salvar usuário: {ex}")
@@ -238,7 +289,7 @@ async def criar_atualizar_usuario(body: UsuarioIn):
 
 @app.post("/api/login")
 async def login(body: LoginIn):
-    u = _DB.check_login(body.usuario, body.senha)
+    u = await _ADB.check_login(body.usuario, body.senha)
     if not u:
         raise HTTPException(401, "Usuário ou senha inválidos")
     return {
@@ -253,16 +304,16 @@ async def login(body: LoginIn):
 @app.post("/api/usuarios/change-senha")
 async def change_senha(usuario: str, senha_atual: str | None = None, senha_nova: str = "", force: bool = False):
     if not force:
-        u = _DB.check_login(usuario, senha_atual or "")
+        u = await _ADB.check_login(usuario, senha_atual or "")
         if not u:
             raise HTTPException(401, "Senha atual inválida")
-    _DB.set_password(usuario, senha_nova)
+    await _ADB.set_password(usuario, senha_nova)
     return {"ok": True}
 
 
 @app.get("/api/orcamentos/{orc_id}")
 async def obter_orcamento(orc_id: str):
-    d = _DB.get_orcamento_by_id(orc_id)
+    d = await _ADB.get_orcamento_by_id(orc_id)
     if d:
         return d
     raise HTTPException(404, "Orçamento não encontrado")
@@ -274,9 +325,15 @@ async def listar_cadastros(
     vendedor: Optional[str] = None,
     start: Optional[str] = None,
     end: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    offset: Optional[int] = None,
+    count: bool = False,
 ):
-    rows = _DB.list_cadastros_excel(start=start, end=end, vendedor=vendedor, cnpj_digits=cnpj)
-    return {"count": len(rows), "rows": rows}
+    validar_datas(start, end)
+    if limit or cursor:
+        return await json_fora_do_loop(listar_paginado, "cadastros", limit, cursor, offset, count, start=start, end=end, vendedor=vendedor, cnpj_digits=cnpj)
+    return await json_fora_do_loop(_lista, _DB.list_cadastros_excel, start=start, end=end, vendedor=vendedor, cnpj_digits=cnpj, offset=offset)
 
 
 @app.get("/api/pedidos")
@@ -285,13 +342,168 @@ async def listar_pedidos(
     vendedor: Optional[str] = None,
     start: Optional[str] = None,
     end: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    offset: Optional[int] = None,
+    count: bool = False,
 ):
-    rows = _DB.list_pedidos_excel(start=start, end=end, vendedor=vendedor, cnpj_digits=cnpj)
-    return {"count": len(rows), "rows": rows}
+    validar_datas(start, end)
+    if limit or cursor:
+        return await json_fora_do_loop(listar_paginado, "pedidos", limit, cursor, offset, count, start=start, end=end, vendedor=vendedor, cnpj_digits=cnpj)
+    return await json_fora_do_loop(_lista, _DB.list_pedidos_excel, start=start, end=end, vendedor=vendedor, cnpj_digits=cnpj, offset=offset)
+
+
+@app.get("/api/pedidos/proximo-numero")
+async def proximo_pedido_numero():
+    """Maior número de pedido + 1, calculado no banco (max(pedido))."""
+    return {"numero": await _ADB.get_proximo_pedido_numero()}
+
+
+# ====== Exportação em streaming (relatórios) ======
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+
+def _stream_ndjson(rows):
+    buf = []
+    for r in rows:
+        buf.append(json.dumps(r, ensure_ascii=False, default=str))
+        if len(buf) >= EXPORT_BATCH_SIZE:
+            yield ("\n".join(buf) + "\n").encode("utf-8")
+            buf = []
+    if buf:
+        yield ("\n".join(buf) + "\n").encode("utf-8")
+
+
+def _stream_csv(rows):
+    out = io.StringIO()
+    w = csv.writer(out, delimiter=";")
+    cols = None
+    n = 0
+    # BOM para o Excel reconhecer UTF-8 ao abrir o CSV direto
+    yield "\ufeff".encode("utf-8")
+    for r in rows:
+        if cols is None:
+            cols = list(r.keys())
+            w.writerow(cols)
+        w.writerow(["" if r.get(k) is None else r.get(k) for k in cols])
+        n += 1
+        if n % EXPORT_BATCH_SIZE == 0:
+            yield out.getvalue().encode("utf-8")
+            out.seek(0); out.truncate(0)
+    if out.tell():
+        yield out.getvalue().encode("utf-8")
+
+
+@app.get("/api/export/{entity}")
+async def exportar(
+    entity: Literal["orcamentos", "cadastros", "pedidos"],
+    format: Literal["ndjson", "csv"] = "ndjson",
+    cnpj: Optional[str] = None,
+    vendedor: Optional[str] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+):
+    # Valida as datas antes de abrir o stream (erros depois do início não viram 400)
+    validar_datas(start, end)
+    rows = _DB.iter_rows(entity, batch_size=EXPORT_BATCH_SIZE, start=start, end=end, vendedor=vendedor, cnpj_digits=cnpj)
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    if format == "csv":
+        body, media, ext = _stream_csv(rows), "text/csv; charset=utf-8", "csv"
+    else:
+        body, media, ext = _stream_ndjson(rows), "application/x-ndjson", "ndjson"
+    headers = {"Content-Disposition": f'attachment; filename="{entity}_{stamp}.{ext}"'}
+    return StreamingResponse(body, media_type=media, headers=headers)
+
+
+# ====== Relatório XLSX gerado no servidor ======
+REPORT_CACHE = os.getenv("REPORT_CACHE", "1") == "1"
+REPORT_DIR = os.getenv("REPORT_DIR") or os.path.join(tempfile.gettempdir(), "orcamento_relatorios")
+# relatórios substituídos só são apagados depois disso: downloads em andamento ainda podem abri-los
+REPORT_KEEP_SECONDS = int(os.getenv("REPORT_KEEP_SECONDS", "900"))
+_RELATORIO_ABAS = {
+    "Orçamentos": [("Orcamentos", "orcamentos")],
+    "Cadastros": [("Cadastros", "cadastros")],
+    "Pedidos": [("Pedidos", "pedidos")],
+}
+_RELATORIO_ABAS["Tudo"] = _RELATORIO_ABAS["Orçamentos"] + _RELATORIO_ABAS["Cadastros"] + _RELATORIO_ABAS["Pedidos"]
+_REPORT_LOCK = threading.Lock()
+_REPORT_LAST: dict = {"key": None, "path": None}
+
+
+def _gerar_relatorio_xlsx(tipo: str, filtros: dict, destino: str):
+    from openpyxl import Workbook
+    # write_only: as linhas vão direto para o arquivo, sem manter a planilha em memória
+    wb = Workbook(write_only=True)
+    for aba, tabela in _RELATORIO_ABAS[tipo]:
+        ws = wb.create_sheet(aba)
+        cols = None
+        for r in _DB.iter_rows(tabela, batch_size=EXPORT_BATCH_SIZE, **filtros):
+            if cols is None:
+                cols = list(r.keys())
+                ws.append(cols)
+            ws.append(["" if r.get(k) is None else r.get(k) for k in cols])
+    wb.save(destino)
+
+
+def _relatorio_cacheado(tipo: str, filtros: dict) -> str:
+    """Gera (ou reaproveita) o último relatório; a chave inclui a versão das tabelas envolvidas."""
+    versoes = [_DB.table_version(t) for _, t in _RELATORIO_ABAS[tipo]]
+    key = hashlib.sha1(json.dumps([tipo, filtros, versoes], sort_keys=True).encode("utf-8")).hexdigest()
+    with _REPORT_LOCK:
+        if REPORT_CACHE and _REPORT_LAST["key"] == key and os.path.exists(_REPORT_LAST["path"] or ""):
+            os.utime(_REPORT_LAST["path"])  # último uso: conta para o prazo de REPORT_KEEP_SECONDS
+            return _REPORT_LAST["path"]
+        os.makedirs(REPORT_DIR, exist_ok=True)
+        destino = os.path.join(REPORT_DIR, f"relatorio_{key}.xlsx")
+        tmp = destino + ".tmp"
+        _gerar_relatorio_xlsx(tipo, filtros, tmp)
+        os.replace(tmp, destino)
+        _REPORT_LAST.update(key=key, path=destino)
+        _limpar_relatorios(manter=destino)
+    return destino
+
+
+def _limpar_relatorios(manter: str):
+    limite = time.time() - REPORT_KEEP_SECONDS
+    for nome in os.listdir(REPORT_DIR):
+        caminho = os.path.join(REPORT_DIR, nome)
+        if caminho == manter or not nome.startswith("relatorio_"):
+            continue
+        try:
+            if os.path.getmtime(caminho) < limite:
+                os.remove(caminho)
+        except OSError:
+            pass
+
+
+@app.get("/api/relatorios.xlsx")
+async def relatorio_xlsx(
+    tipo: Literal["Tudo", "Orçamentos", "Cadastros", "Pedidos"] = "Tudo",
+    cnpj: Optional[str] = None,
+    vendedor: Optional[str] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+):
+    validar_datas(start, end)
+    filtros = {"start": start, "end": end, "vendedor": vendedor, "cnpj_digits": cnpj}
+    try:
+        caminho = await _ADB.run(_relatorio_cacheado, tipo, filtros)
+    except Exception as ex:
+        raise HTTPException(500, f"Erro ao gerar relatório: {ex}")
+    nome = f"Relatorio_{tipo}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+    return FileResponse(caminho, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", filename=nome)
+
 
 @app.get("/api/info")
 async def api_info():
-    return {"storage": "db", "backend": "postgres", "db_ready": True}
+    pool = await _ADB.pool_status()
+    return {
+        "storage": "db",
+        "backend": pool.get("dialect") or "postgres",
+        "db_ready": True,
+        "pool": pool,
+        "threads": _ADB.info(),
+    }
 
 
 # ====== Criação/Atualização (DB) ======
@@ -336,12 +548,33 @@ async def criar_ou_atualizar_cadastro(body: CadastroDBIn):
     # Converte para labels Excel usando REV_CAD
     dados_excel = { _DB.REV_CAD.get(k, k): v for k, v in dados_db.items() if v is not None }
     try:
-        _DB.salvar_cadastro(dados_excel)
+        await _ADB.salvar_cadastro(dados_excel)
         return {"ok": True}
     except Exception as ex:
         raise HTTPException(500, f"Erro ao salvar cadastro: {ex}")
 
 
+LOOKUP_MAX_DOCS = int(os.getenv("CADASTRO_LOOKUP_MAX", "5000"))
+
+
+class CadastroLookupIn(BaseModel):
+    documentos: list[str]
+
+
+def _lookup_cadastros(documentos: list[str]) -> dict:
+    digits = sorted({re.sub(r"\D", "", d or "") for d in documentos} - {""})
+    achados = _DB.buscar_cadastros_por_documentos(digits)
+    return {"count": len(achados), "cadastros": achados, "nao_encontrados": [d for d in digits if d not in achados]}
+
+
+@app.post("/api/cadastros/lookup")
+async def lookup_cadastros(body: CadastroLookupIn):
+    """Cadastros de vários CNPJ/CPF numa consulta só: {dígitos: cadastro mais recente}."""
+    if len(body.documentos) > LOOKUP_MAX_DOCS:
+        raise HTTPException(400, f"Máximo de {LOOKUP_MAX_DOCS} documentos por consulta")
+    return await json_fora_do_loop(_lookup_cadastros, body.documentos)
+
+
 class PedidoDBIn(BaseModel):
     id: str
     pedido: Optional[int] = None
@@ -375,7 +608,7 @@ async def criar_pedido(body: PedidoDBIn):
         dados_db["documento"] = "CNPJ" if len(digits) == 14 else "CPF"
     dados_excel = { _DB.REV_PED.get(k, k): v for k, v in dados_db.items() if v is not None }
     try:
-        _DB.salvar_pedido(dados_excel)
+        await _ADB.salvar_pedido(dados_excel)
         return {"ok": True}
     except Exception as ex:
         raise HTTPException(500, f"Erro ao salvar pedido: {ex}")
@@ -15,11 +15,14 @@ import secrets
 
 # Reuse existing API app and logic
 from server import app as api_app
-from server import OrcamentoIn, criar_orcamento, listar_orcamentos, obter_orcamento
+from server import OrcamentoIn, criar_orcamento, listar_orcamentos, obter_orcamento, shutdown_graph
 import orcamento as orc
-from db_backend import DB
+from db_backend import DB, ADB
 from openpyxl import load_workbook
 import tempfile
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 
 app = FastAPI(title="Orçamentos Web UI")
@@ -85,7 +88,7 @@ async def clientes(request: Request, doc: Optional[str] = None, _auth=Depends(re
     error = None
     if doc:
         try:
-            cad = DB.buscar_cadastro_por_documento('CNPJ/CPF', doc)
+            cad = await ADB.buscar_cadastro_por_documento('CNPJ/CPF', doc)
         except Exception as ex:
             error = f'Falha ao buscar: {ex}'
     return templates.TemplateResponse('clientes.html', {'request': request, 'doc': doc or '', 'cad': cad, 'error': error})
@@ -266,6 +269,12 @@ async def healthz():
     return {"ok": True}
 
 
+# Sub-apps montados não recebem startup/shutdown: fecha aqui o cliente Graph compartilhado
+@app.on_event("shutdown")
+async def _shutdown_api_clients():
+    await shutdown_graph()
+
+
 
 
 # ===== Importar Planilha (Excel -> DB) =====
@@ -283,68 +292,108 @@ def _row_to_dict(headers, row):
     return out
 
 
+def _linhas_planilha(ws):
+    """(nº da linha, dados) das linhas não vazias, na ordem da planilha."""
+    headers = _header_map(ws)
+    for i, row in enumerate(ws.iter_rows(min_row=2), start=2):
+        d = _row_to_dict(headers, row)
+        if any(v for v in d.values()):
+            yield i, d
+
+
+# Importação em segundo plano: o upload vai para disco em blocos e o processamento roda numa
+# thread própria (um job por vez), com progresso consultado em /importar/{job_id}
+IMPORT_CHUNK = 1024 * 1024
+IMPORT_MAX_JOBS = 20
+_IMPORT_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="import")
+_IMPORT_JOBS: dict = {}
+_IMPORT_LOCK = threading.Lock()
+_ABAS_IMPORT = (
+    ('orc', ('Orçamentos', 'Orcamentos'), DB.bulk_upsert_orcamentos),
+    ('cad', ('Cadastros',), DB.bulk_upsert_cadastros),
+    ('ped', ('Pedidos',), DB.bulk_upsert_pedidos),
+)
+
+
+def _novo_job(nome: str) -> dict:
+    job = {
+        'id': uuid.uuid4().hex[:12], 'arquivo': nome, 'status': 'na fila', 'aba': None,
+        'orc_lidos': 0, 'orc_inseridos': 0, 'cad_lidos': 0, 'cad_inseridos': 0, 'ped_lidos': 0, 'ped_inseridos': 0,
+        'falhas': 0, 'erros': [], 'iniciado': datetime.now().strftime('%d/%m/%Y %H:%M:%S'), 'terminado': None,
+    }
+    with _IMPORT_LOCK:
+        _IMPORT_JOBS[job['id']] = job
+        # guarda só os últimos jobs
+        for antigo in list(_IMPORT_JOBS)[:-IMPORT_MAX_JOBS]:
+            _IMPORT_JOBS.pop(antigo, None)
+    return job
+
+
+def _importar_planilha(tmp_path: str, job: dict) -> dict:
+    job['status'] = 'processando'
+    try:
+        wb = load_workbook(tmp_path, read_only=True, data_only=True)
+        try:
+            for prefixo, nomes, gravar in _ABAS_IMPORT:
+                ws = next((wb[n] for n in nomes if n in wb.sheetnames), None)
+                if ws is None:
+                    continue
+                job['aba'] = nomes[0]
+
+                def _progresso(res, prefixo=prefixo):
+                    job[f'{prefixo}_lidos'] = res['lidos']
+                    job[f'{prefixo}_inseridos'] = res['gravados']
+
+                # uma transação/executemany por lote em vez de um INSERT por linha
+                res = gravar(_linhas_planilha(ws), progresso=_progresso)
+                _progresso(res)
+                job['falhas'] += len(res['erros'])
+                job['erros'] += [f"{nomes[0]} linha {e['linha']}: {e['erro']}" for e in res['erros']][:200 - len(job['erros'])]
+        finally:
+            wb.close()
+        job['status'] = 'concluído'
+    except Exception as ex:
+        job['status'] = 'erro'
+        job['erros'].append(f'Falha ao importar: {ex}')
+    finally:
+        job['aba'] = None
+        job['terminado'] = datetime.now().strftime('%d/%m/%Y %H:%M:%S')
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+    return job
+
+
 @app.get('/importar', response_class=HTMLResponse)
-async def importar_get(request: Request, _auth=Depends(require_auth)):
-    return templates.TemplateResponse('importar.html', {'request': request})
+async def importar_get(request: Request, job: Optional[str] = None, _auth=Depends(require_auth)):
+    return templates.TemplateResponse('importar.html', {'request': request, 'job': _IMPORT_JOBS.get(job) if job else None})
+
+
+@app.get('/importar/{job_id}')
+async def importar_status(job_id: str, _auth=Depends(require_auth)):
+    job = _IMPORT_JOBS.get(job_id)
+    if not job:
+        raise HTTPException(404, 'Importação não encontrada')
+    return dict(job)
 
 
 @app.post('/importar', response_class=HTMLResponse)
 async def importar_post(request: Request, file: UploadFile = File(...), _auth=Depends(require_auth)):
     if not DB.is_ready():
         return templates.TemplateResponse('importar.html', {'request': request, 'error': 'Banco não configurado. No Heroku, adicione o add-on Postgres (DATABASE_URL é criado automaticamente).'}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    job = _novo_job(file.filename or 'planilha.xlsx')
+    job['status'] = 'recebendo'
     with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as tmp:
-        content = await file.read()
-        tmp.write(content)
+        while True:
+            chunk = await file.read(IMPORT_CHUNK)
+            if not chunk:
+                break
+            tmp.write(chunk)
         tmp_path = tmp.name
-    wb = load_workbook(tmp_path, read_only=True, data_only=True)
-    def get_ws(*names):
-        for n in names:
-            if n in wb.sheetnames:
-                return wb[n]
-        return None
-    ws_orc = get_ws('Orçamentos', 'Orcamentos')
-    ws_cad = get_ws('Cadastros')
-    ws_ped = get_ws('Pedidos')
-    counts = {'orc_lidos': 0, 'orc_inseridos': 0, 'cad_lidos': 0, 'cad_inseridos': 0, 'ped_lidos': 0, 'ped_inseridos': 0}
-    if ws_orc is not None:
-        headers = _header_map(ws_orc)
-        for row in ws_orc.iter_rows(min_row=2):
-            d = _row_to_dict(headers, row)
-            if not any(v for v in d.values()):
-                continue
-            counts['orc_lidos'] += 1
-            try:
-                DB.salvar_orcamento(d)
-                counts['orc_inseridos'] += 1
-            except Exception:
-                pass
-    if ws_cad is not None:
-        headers = _header_map(ws_cad)
-        for row in ws_cad.iter_rows(min_row=2):
-            d = _row_to_dict(headers, row)
-            if not any(v for v in d.values()):
-                continue
-            counts['cad_lidos'] += 1
-            try:
-                DB.salvar_cadastro(d)
-                counts['cad_inseridos'] += 1
-            except Exception:
-                pass
-    if ws_ped is not None:
-        headers = _header_map(ws_ped)
-        for row in ws_ped.iter_rows(min_row=2):
-            d = _row_to_dict(headers, row)
-            if not any(v for v in d.values()):
-                continue
-            counts['ped_lidos'] += 1
-            try:
-                DB.salvar_pedido(d)
-                counts['ped_inseridos'] += 1
-            except Exception:
-                pass
-    return templates.TemplateResponse('importar.html', {'request': request, 'result': counts})
-
-
+    job['status'] = 'na fila'
+    _IMPORT_EXECUTOR.submit(_importar_planilha, tmp_path, job)
+    return RedirectResponse(f"/importar?job={job['id']}", status_code=status.HTTP_303_SEE_OTHER)
 
 
 @app.post('/clientes', response_class=HTMLResponse)
@@ -354,9 +403,9 @@ async def clientes_post(request: Request, _auth=Depends(require_auth)):
     if 'cnpj_cpf' in d and 'CNPJ/CPF' not in d:
         d['CNPJ/CPF'] = d['cnpj_cpf']
     try:
-        DB.salvar_cadastro(d)
+        await ADB.salvar_cadastro(d)
         msg = 'Cadastro salvo com sucesso.'
-        cad = DB.buscar_cadastro_por_documento('CNPJ/CPF', d.get('CNPJ/CPF',''))
+        cad = await ADB.buscar_cadastro_por_documento('CNPJ/CPF', d.get('CNPJ/CPF',''))
     except Exception as ex:
         msg = f'Falha ao salvar: {ex}'
         cad = d